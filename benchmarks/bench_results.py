@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Result iteration benchmark (Python 3).
+
+Reads every session of a synthetic records.db (a million by default) and
+sums the durations, once through the old ``fetch_assoc`` (``fetchall`` plus
+a dict per row) and once per row type through ``results.iter_rows``. Prints
+the best time and the traced peak memory of each as JSON.
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import tracemalloc
+from collections import namedtuple
+from timeit import default_timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks import generate
+from timeline.results import iter_rows
+from timeline.storage import TimeStore
+
+SQL = "SELECT id, project_id, date_start, date_end, duration FROM times"
+COLS = ["id", "project_id", "date_start", "date_end", "duration"]
+
+Row = namedtuple("Row", COLS)
+
+
+def fetch_assoc(cur):
+    # what every query went through before the results module
+    out = []
+    for row in cur.fetchall():
+        data = dict()
+        for i, col in enumerate(row):
+            data[COLS[i]] = col
+        out.append(data)
+    return out
+
+
+def read_assoc(db):
+    return sum(row["duration"] for row in fetch_assoc(db.execute(SQL)))
+
+
+def read_tuples(db):
+    return sum(row[4] for row in iter_rows(db.execute(SQL)))
+
+
+def read_namedtuples(db):
+    return sum(row.duration for row in iter_rows(db.execute(SQL), Row))
+
+READERS = (
+    ("fetch_assoc", read_assoc),
+    ("iter_rows", read_tuples),
+    ("iter_rows_namedtuple", read_namedtuples)
+)
+
+
+def measure(db, read, repeat):
+    best = None
+    for i in range(repeat):
+        start = default_timer()
+        total = read(db)
+        seconds = default_timer() - start
+        best = seconds if best is None else min(best, seconds)
+
+    tracemalloc.start()
+    read(db)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return total, best, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--projects", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        dbfile = os.path.join(tmpdir, "records.db")
+        generate.generate(dbfile, args.rows, args.projects)
+        store = TimeStore(dbfile)
+        results = {}
+        for name, read in READERS:
+            total, seconds, peak = measure(store.db, read, args.repeat)
+            results[name] = {
+                "seconds": round(seconds, 3),
+                "rows_per_second": int(args.rows / seconds),
+                "peak_mb": round(peak / 1048576.0, 1),
+                "total": total
+            }
+        store.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+    totals = set(result.pop("total") for result in results.values())
+    if len(totals) != 1:
+        raise RuntimeError("the readers disagree: %s" % sorted(totals))
+
+    output = {
+        "benchmark": "result_iteration",
+        "rows": args.rows,
+        "results": results
+    }
+    json.dump(output, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+JSON API load test (Python 3).
+
+Generates a synthetic records.db, starts ``python -m timeline serve`` on a
+Unix socket and runs hundreds of concurrent keep-alive clients against it.
+Each client starts a timer of its own project, then mixes timer listings,
+heartbeats and one-week reports, and finally stops its timer. Prints the
+client-side latency per request type and the throughput as JSON.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from timeit import default_timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks import generate
+from timeline.metrics import Histogram
+
+# share of each request type after the start, by weight
+MIX = (
+    ("GET /timers", 5),
+    ("POST /timers/heartbeat", 2),
+    ("GET /report", 3)
+)
+
+
+async def request(reader, writer, method, target, body=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else b""
+    writer.write((
+        "%s %s HTTP/1.1\r\nHost: localhost\r\n"
+        "Content-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+        % (method, target, len(data))
+    ).encode("latin-1") + data)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line == b"\r\n":
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    body = json.loads((await reader.readexactly(length)).decode("utf-8"))
+    if status != 200:
+        raise RuntimeError("%s %s: %s" % (method, target, body))
+    return body
+
+
+async def client(path, number, requests, latency, report_from):
+    reader, writer = await asyncio.open_unix_connection(path)
+    project = "client %d" % number
+    kinds = [kind for kind, weight in MIX for i in range(weight)]
+    rng = random.Random(number)
+
+    async def timed(kind, target, body=None):
+        method, path = kind.split(" ")
+        start = default_timer()
+        await request(reader, writer, method, target or path, body)
+        latency[kind].add(default_timer() - start)
+
+    await timed("POST /timers/start", None,
+                {"project": project, "create": True})
+    for i in range(requests):
+        kind = rng.choice(kinds)
+        if kind == "GET /report":
+            await timed(kind, "/report?from=%s&to=%s" % report_from)
+        else:
+            await timed(kind, None)
+    await timed("POST /timers/stop", None, {"project": project})
+    writer.close()
+
+
+async def load(path, clients, requests, latency, report_from):
+    await asyncio.gather(*[
+        client(path, i, requests, latency, report_from)
+        for i in range(clients)
+    ])
+
+
+def wait_for(path, process, timeout=30):
+    deadline = time.time() + timeout
+    while not os.path.exists(path):
+        if process.poll() is not None or time.time() > deadline:
+            raise RuntimeError("the server didn't start")
+        time.sleep(0.05)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--years", type=float, default=2)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=50,
+                        help="requests per client")
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    process = None
+    try:
+        dbfile = os.path.join(tmpdir, "records.db")
+        generate.generate(dbfile, args.rows, args.projects, args.years)
+        path = os.path.join(tmpdir, "api.sock")
+
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        process = subprocess.Popen([
+            sys.executable, "-m", "timeline", "--db", dbfile, "serve",
+            "--socket", path, "--readers", str(args.readers)
+        ], env=env, stderr=subprocess.DEVNULL)
+        wait_for(path, process)
+
+        last_week = generate.EPOCH + int(args.years * 365 - 7) * 86400
+        report_from = (
+            time.strftime("%Y-%m-%d", time.gmtime(last_week)),
+            time.strftime("%Y-%m-%d", time.gmtime(last_week + 6 * 86400))
+        )
+        kinds = ["POST /timers/start", "POST /timers/stop"]
+        latency = dict((kind, Histogram())
+                       for kind in kinds + [kind for kind, weight in MIX])
+
+        start = default_timer()
+        asyncio.get_event_loop().run_until_complete(load(
+            path, args.clients, args.requests, latency, report_from
+        ))
+        seconds = default_timer() - start
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(tmpdir)
+
+    total = sum(histogram.count for histogram in latency.values())
+    output = {
+        "benchmark": "api_server",
+        "rows": args.rows,
+        "clients": args.clients,
+        "readers": args.readers,
+        "requests": total,
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(total / seconds, 1),
+        "latency": dict(
+            (kind, dict((key, value)
+                        for key, value in histogram.snapshot().items()
+                        if key != "histogram_us"))
+            for kind, histogram in latency.items()
+        )
+    }
+    json.dump(output, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
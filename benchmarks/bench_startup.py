@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Startup benchmark for the command line interface.
+
+Times ``python -m timeline status`` against a bare interpreter start and
+fails if the CLI pulls in PyQt4 or its own startup cost exceeds the budget.
+Prints the measurements as JSON.
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import subprocess
+from timeit import default_timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHECK_IMPORTS = '''
+import sys
+from timeline import cli
+cli.main(["--db", sys.argv[1], "status"])
+qt = sorted(m for m in sys.modules if m.startswith(("PyQt", "sip")))
+sys.stderr.write(",".join(qt))
+'''
+
+
+def run(cmd, env):
+    start = default_timer()
+    subprocess.check_call(cmd, cwd=ROOT, env=env, stdout=subprocess.PIPE)
+    return default_timer() - start
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=100.0,
+                        help="allowed CLI overhead over a bare interpreter")
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    db = os.path.join(tmp, "records.db")
+    env = dict(os.environ, PYTHONPATH=ROOT)
+
+    try:
+        # first run creates and migrates the database
+        cmd = [sys.executable, "-m", "timeline", "--db", db, "status"]
+        run(cmd, env)
+
+        bare = median([run([sys.executable, "-c", "pass"], env)
+                       for i in range(args.runs)])
+        status = median([run(cmd, env) for i in range(args.runs)])
+
+        child = subprocess.Popen(
+            [sys.executable, "-c", CHECK_IMPORTS, db],
+            cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        qt_modules = child.communicate()[1].decode().strip()
+    finally:
+        shutil.rmtree(tmp)
+
+    overhead_ms = (status - bare) * 1000
+    result = {
+        "benchmark": "cli_startup",
+        "runs": args.runs,
+        "interpreter_ms": round(bare * 1000, 2),
+        "status_ms": round(status * 1000, 2),
+        "overhead_ms": round(overhead_ms, 2),
+        "budget_ms": args.budget_ms,
+        "qt_modules": qt_modules.split(",") if qt_modules else []
+    }
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+    if result["qt_modules"] or overhead_ms > args.budget_ms:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Team report benchmark.
+
+Generates a directory of synthetic per-user databases and times a
+by-project team report over all of them with 1, 2, 4, ... worker
+processes up to the number of cores. Prints the timings and the speedup
+over a single process as JSON.
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+from timeit import default_timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks import generate
+from timeline.teamreport import TeamReport, find_databases
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def get_job_counts(cores):
+    jobs = 1
+    counts = []
+    while jobs < cores:
+        counts.append(jobs)
+        jobs *= 2
+    counts.append(cores)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--databases", type=int, default=56)
+    parser.add_argument("--rows", type=int, default=50000,
+                        help="sessions per database")
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--years", type=float, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for i in range(args.databases):
+            generate.generate(os.path.join(tmpdir, "user%03d.db" % i),
+                              args.rows, args.projects, args.years, seed=i)
+
+        filenames = find_databases([tmpdir])
+        date_from = generate.EPOCH
+        date_to = generate.EPOCH + int(args.years * 365) * 86400 - 1
+
+        results = {}
+        for jobs in get_job_counts(multiprocessing.cpu_count()):
+            team = TeamReport(filenames, jobs)
+            timings = []
+            for i in range(args.repeat):
+                start = default_timer()
+                for row in team.iter_report(None, date_from, date_to, True):
+                    pass
+                timings.append(default_timer() - start)
+            results[jobs] = median(timings)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    single = results[1]
+    output = {
+        "benchmark": "team_report",
+        "databases": args.databases,
+        "rows_per_database": args.rows,
+        "cores": multiprocessing.cpu_count(),
+        "results": dict(
+            (str(jobs), {
+                "median_ms": round(seconds * 1000, 3),
+                "speedup": round(single / seconds, 2)
+            }) for jobs, seconds in sorted(results.items())
+        )
+    }
+    json.dump(output, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
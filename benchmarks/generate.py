@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Synthetic records.db generator for the benchmarks.
+
+Sessions are laid out day by day over a number of years: log-normal
+lengths, occasional overnight sessions and weekends mostly off.
+"""
+
+import os
+import sys
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from timeline.storage import TimeStore
+
+DAY = 86400
+# 2015-01-05, a Monday
+EPOCH = 1420416000
+
+
+def iter_sessions(rows, projects, years=10, overnight=0.02, seed=0):
+    """
+    Yield ``rows`` (project_id, date_start, date_end, duration) tuples
+    spread day by day over ``years``. Large row counts give many
+    (overlapping) sessions per day, like a team's merged history.
+    """
+    rnd = random.Random(seed)
+    days = max(1, int(years * 365))
+    per_day = float(rows) / days
+    produced = 0
+
+    for index in range(days):
+        day = EPOCH + index * DAY
+        weekday = index % 7
+        # weekends mostly off, their share goes to working days
+        if weekday >= 5:
+            count = int(rnd.random() < 0.1)
+        else:
+            count = int(per_day * 7 / 5.2 + rnd.random())
+        if index == days - 1:
+            count = rows - produced
+
+        starts = sorted(day + rnd.randint(7 * 3600, 18 * 3600)
+                        for i in range(min(count, rows - produced)))
+        for start in starts:
+            if rnd.random() < overnight:
+                start = day + rnd.randint(18 * 3600, 23 * 3600)
+                length = rnd.randint(4 * 3600, 14 * 3600)
+            else:
+                length = int(min(rnd.lognormvariate(7.6, 0.8), 6 * 3600))
+
+            yield rnd.randint(1, projects), start, start + length, length
+            produced += 1
+
+        if produced >= rows:
+            break
+
+
+def generate(filename, rows, projects, years=10, overnight=0.02, seed=0,
+             batch=100000):
+    if os.path.exists(filename):
+        os.remove(filename)
+
+    store = TimeStore(filename)
+    cur = store.db.cursor()
+
+    with store.db:
+        cur.executemany(
+            store.SQL_ADD_PROJECT,
+            ({"name": "Project %05d" % i} for i in range(1, projects + 1))
+        )
+
+    sessions = iter_sessions(rows, projects, years, overnight, seed)
+    while True:
+        chunk = [session for i, session in zip(range(batch), sessions)]
+        if not chunk:
+            break
+        with store.db:
+            cur.executemany('''
+                INSERT INTO times (
+                    project_id,
+                    date_start,
+                    date_end,
+                    duration
+                ) VALUES (?, ?, ?, ?)
+            ''', chunk)
+
+    store.rebuild_daily_totals()
+    store.rebuild_session_stats()
+    store.close()
+    return filename
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("filename")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--projects", type=int, default=2000)
+    parser.add_argument("--years", type=float, default=10)
+    parser.add_argument("--overnight", type=float, default=0.02,
+                        help="share of sessions running past midnight")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    generate(args.filename, args.rows, args.projects, args.years,
+             args.overnight, args.seed)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
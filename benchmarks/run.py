@@ -0,0 +1,508 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for the hot paths, written as JSON so runs on different
+revisions can be compared.
+
+    python benchmarks/run.py --rows 1000000 --output before.json
+
+Storage benchmarks need nothing but the standard library. The GUI ones
+(MainWindow startup and combo box population) run only when PyQt4 can be
+imported and, on X11, a display is set: Qt 4 has no offscreen platform,
+so on a headless machine run them under ``xvfb-run``.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import platform
+import tempfile
+import argparse
+import subprocess
+from timeit import default_timer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks import generate
+from timeline import report
+from timeline import aggregate
+from timeline.storage import TimeStore
+from timeline.journal import SessionJournal
+from timeline.session import SessionTracker
+from timeline.projects import ProjectList
+from timeline.importer import Importer
+from timeline.merge import Merger
+from timeline.reportcache import ReportCache
+from timeline.stats import merge_sketches
+from timeline.replay import Replay, parse_script
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+
+class NullStream(object):
+    def write(self, text):
+        pass
+
+
+class Context(object):
+    def __init__(self, dbfile, tmpdir, repeat):
+        self.dbfile = dbfile
+        self.tmpdir = tmpdir
+        self.repeat = repeat
+        store = TimeStore(dbfile)
+        cur = store.db.cursor()
+        self.rows = cur.execute("SELECT COUNT(*) FROM times").fetchone()[0]
+        self.projects = cur.execute(
+            "SELECT COUNT(*) FROM projects"
+        ).fetchone()[0]
+        self.date_from, self.date_to = cur.execute(
+            "SELECT MIN(date_start), MAX(date_end) FROM times"
+        ).fetchone()
+        # the project with the median number of sessions
+        self.project_id = (cur.execute('''
+            SELECT project_id
+            FROM times
+            GROUP BY project_id
+            ORDER BY COUNT(*)
+            LIMIT 1 OFFSET (SELECT COUNT(DISTINCT project_id) FROM times) / 2
+        ''').fetchone() or [1])[0]
+        store.close()
+
+    def copy(self):
+        # fresh copy of the database for destructive benchmarks
+        filename = os.path.join(self.tmpdir, "copy.db")
+        shutil.copyfile(self.dbfile, filename)
+        return filename
+
+
+def measure(func, repeat, setup=None):
+    timings = []
+    for i in range(repeat):
+        arg = setup() if setup is not None else None
+        start = default_timer()
+        func(arg)
+        timings.append(default_timer() - start)
+    timings.sort()
+    return {
+        "repeat": repeat,
+        "min_ms": round(timings[0] * 1000, 3),
+        "median_ms": round(timings[len(timings) // 2] * 1000, 3),
+        "max_ms": round(timings[-1] * 1000, 3)
+    }
+
+
+@benchmark
+def storage_open(ctx):
+    # what init_app does before the window is built
+    def run(arg):
+        TimeStore(ctx.dbfile).close()
+    return measure(run, ctx.repeat)
+
+
+@benchmark
+def storage_projects(ctx):
+    # the query behind load_cbox
+    store = TimeStore(ctx.dbfile)
+    result = measure(lambda arg: list(store.projects()), ctx.repeat)
+    store.close()
+    return result
+
+
+@benchmark
+def project_list_load(ctx):
+    # lean query + sorted in-memory list shared by both combo boxes
+    store = TimeStore(ctx.dbfile)
+    projects = ProjectList()
+    result = measure(lambda arg: projects.load(store.project_rows()),
+                     ctx.repeat)
+    store.close()
+    return result
+
+
+@benchmark
+def project_search(ctx):
+    # one keystroke of the completer: prefix + fuzzy top 10
+    store = TimeStore(ctx.dbfile)
+    projects = ProjectList()
+    projects.load(store.project_rows())
+    store.close()
+    projects.fuzzy("")
+
+    def run(arg):
+        for text in ("p", "proj", "project 01", "prjoect 0123", "zzz"):
+            projects.search(text, 10)
+    return measure(run, ctx.repeat)
+
+
+def report_benchmark(ctx, project_id, days, by_project=False, tz=None,
+                     granularity="day"):
+    store = TimeStore(ctx.dbfile)
+    date_to = ctx.date_to
+    date_from = max(ctx.date_from, date_to - days * 86400)
+    writer = report.TextWriter()
+    if tz is not None:
+        tz = aggregate.get_timezone(tz)
+
+    def run(arg):
+        writer.write(
+            store.iter_report(project_id, date_from, date_to, by_project, tz,
+                              granularity),
+            NullStream()
+        )
+
+    result = measure(run, ctx.repeat)
+    store.close()
+    return result
+
+
+@benchmark
+def report_week_all(ctx):
+    return report_benchmark(ctx, 0, 7)
+
+
+@benchmark
+def report_week_project(ctx):
+    return report_benchmark(ctx, ctx.project_id, 7)
+
+
+@benchmark
+def report_all_time_all(ctx):
+    return report_benchmark(ctx, 0, 365 * 100)
+
+
+@benchmark
+def report_all_time_by_project(ctx):
+    return report_benchmark(ctx, 0, 365 * 100, True)
+
+
+@benchmark
+def report_all_time_weekly_tz(ctx):
+    return report_benchmark(ctx, 0, 365 * 100, False, "Europe/Berlin",
+                            "week")
+
+
+@benchmark
+def report_all_time_monthly_tz(ctx):
+    return report_benchmark(ctx, 0, 365 * 100, False, "Europe/Berlin",
+                            "month")
+
+
+@benchmark
+def report_week_tz(ctx):
+    return report_benchmark(ctx, 0, 7, False, "Europe/Berlin")
+
+
+@benchmark
+def stats_all_time(ctx):
+    # the statistics view over every month, merged from the sketches
+    store = TimeStore(ctx.dbfile)
+
+    def run(arg):
+        sketches = store.session_stats(0, ctx.date_from, ctx.date_to)
+        for sketch in sketches.values():
+            sketch.summary()
+        merge_sketches(sketches.values()).summary()
+
+    result = measure(run, ctx.repeat)
+    store.close()
+    return result
+
+
+@benchmark
+def report_all_time_cached(ctx):
+    # Show Result clicked again with nothing written in between
+    store = TimeStore(ctx.dbfile)
+    cache = ReportCache()
+    key = (0, ctx.date_from, ctx.date_to, "day")
+
+    def run(arg):
+        cache.validate(store.write_generation())
+        rows = cache.get(key)
+        if rows is None:
+            rows = list(store.iter_report(0, ctx.date_from, ctx.date_to))
+            cache.put(key, rows, cache.generation)
+        report.TextWriter().write(rows, NullStream())
+
+    result = measure(run, ctx.repeat)
+    result["cache"] = cache.stats()
+    store.close()
+    return result
+
+
+@benchmark
+def delete_project(ctx):
+    def run(filename):
+        store = TimeStore(filename)
+        store.delete_project(ctx.project_id)
+        store.close()
+    return measure(run, ctx.repeat, ctx.copy)
+
+
+@benchmark
+def heartbeat_update(ctx):
+    # the per-minute UPDATE + commit the GUI used to do
+    def run(filename):
+        store = TimeStore(filename)
+        rowid = store.start_session(ctx.project_id, ctx.date_to)
+        for minute in range(1, 61):
+            store.heartbeat(rowid, ctx.date_to + minute * 60)
+        store.close()
+    return measure(run, ctx.repeat, ctx.copy)
+
+
+@benchmark
+def heartbeat_journal(ctx):
+    # the same hour of heartbeats through the session journal
+    def run(filename):
+        store = TimeStore(filename)
+        journal = SessionJournal(SessionJournal.filename_for(filename))
+        tracker = SessionTracker(store, journal)
+        tracker.start(ctx.project_id, ctx.date_to)
+        for minute in range(1, 61):
+            tracker.tick(ctx.date_to + minute * 60)
+        tracker.stop(ctx.project_id, ctx.date_to + 3600)
+        journal.close()
+        store.close()
+    return measure(run, ctx.repeat, ctx.copy)
+
+
+def concurrent_benchmark(ctx, timers):
+    # an hour of heartbeats of ``timers`` timers running at once
+    def setup():
+        filename = ctx.copy()
+        store = TimeStore(filename)
+        ids = [store.add_project("timer %d" % i) for i in range(timers)]
+        store.close()
+        return filename, ids
+
+    def run(arg):
+        filename, ids = arg
+        store = TimeStore(filename)
+        journal = SessionJournal(SessionJournal.filename_for(filename))
+        tracker = SessionTracker(store, journal)
+        for id in ids:
+            tracker.start(id, ctx.date_to)
+        for minute in range(1, 61):
+            tracker.tick(ctx.date_to + minute * 60)
+        tracker.stop_all(ctx.date_to + 3600)
+        journal.close()
+        store.close()
+    return measure(run, ctx.repeat, setup)
+
+
+@benchmark
+def heartbeat_10_timers(ctx):
+    return concurrent_benchmark(ctx, 10)
+
+
+@benchmark
+def heartbeat_100_timers(ctx):
+    return concurrent_benchmark(ctx, 100)
+
+
+# a working week with a second timer, a minimised window and a crash
+WORKWEEK = []
+for day in range(5):
+    WORKWEEK.extend([
+        "%dd9h start Writing" % day,
+        "+3h start Email",
+        "+30m stop Email",
+        "+1h hide",
+        "+2h show"
+    ])
+    if day == 2:
+        WORKWEEK.extend(["+17m crash", "+5m start Writing"])
+    WORKWEEK.append("%dd17h stop-all" % day)
+
+
+@benchmark
+def replay_workweek(ctx):
+    # timer I/O of the GUI over a simulated week, with what it wrote
+    replays = []
+
+    def run(filename):
+        start = ctx.date_to // 86400 * 86400 + 86400
+        replay = Replay(filename, start)
+        replay.run(parse_script(WORKWEEK, start))
+        replays.append(replay.result())
+        replay.close()
+
+    result = measure(run, ctx.repeat, ctx.copy)
+    counts = replays[-1]
+    result.update({
+        "journal_writes": counts["journal"]["writes"],
+        "database_writes": counts["database"]["writes"],
+        "commits": counts["database"]["commits"],
+        "lost_seconds": counts["seconds"]["lost"]
+    })
+    return result
+
+
+@benchmark
+def import_csv(ctx):
+    # 100k records from another tracker into an empty database
+    filename = os.path.join(ctx.tmpdir, "import.csv")
+    with open(filename, "w") as stream:
+        stream.write("project,start,end\n")
+        for project_id, start, end, duration in generate.iter_sessions(
+                100000, 200, seed=1):
+            stream.write("Imported %d,%d,%d\n" % (project_id, start, end))
+
+    def setup():
+        dbfile = os.path.join(ctx.tmpdir, "import.db")
+        if os.path.exists(dbfile):
+            os.remove(dbfile)
+        return dbfile
+
+    def run(dbfile):
+        store = TimeStore(dbfile)
+        Importer(store).import_file(filename)
+        store.close()
+    return measure(run, ctx.repeat, setup)
+
+
+@benchmark
+def merge_twice(ctx):
+    # the whole database into an empty one, then again (nothing to add)
+    def setup():
+        dbfile = os.path.join(ctx.tmpdir, "merged.db")
+        if os.path.exists(dbfile):
+            os.remove(dbfile)
+        return dbfile
+
+    def run(dbfile):
+        store = TimeStore(dbfile)
+        merger = Merger(store)
+        merger.merge(ctx.dbfile)
+        merger.merge(ctx.dbfile)
+        store.close()
+    return measure(run, ctx.repeat, setup)
+
+
+def gui_benchmarks(ctx):
+    """
+    MainWindow startup and load_cbox, only when PyQt4 is installed and
+    there is a display to open windows on. Returns {} otherwise.
+    """
+    if sys.platform.startswith(("linux", "freebsd")) and \
+            not os.environ.get("DISPLAY"):
+        sys.stderr.write("No DISPLAY, GUI benchmarks skipped "
+                         "(run under xvfb-run for them)\n")
+        return {}
+    try:
+        from PyQt4 import QtGui
+    except ImportError:
+        return {}
+
+    from timeline import paths
+    from timeline.MainWindow import MainWindow
+
+    app = QtGui.QApplication.instance() or QtGui.QApplication([])
+    paths.get_db_filename = lambda create=True: ctx.dbfile
+
+    windows = []
+
+    def start(arg):
+        window = MainWindow()
+        window.hide()
+        windows.append(window)
+
+    results = {"gui_startup": measure(start, ctx.repeat)}
+    window = windows[-1]
+    results["gui_load_cbox"] = measure(
+        lambda arg: window.load_cbox(True), ctx.repeat
+    )
+
+    for window in windows:
+        window.close()
+    app.processEvents()
+    return results
+
+
+def get_revision():
+    try:
+        output = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.PIPE
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.decode().strip()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time-Line benchmarks, results as JSON"
+    )
+    parser.add_argument("--db", help="benchmark an existing database "
+                        "(default: generate one)")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--projects", type=int, default=2000)
+    parser.add_argument("--years", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", action="append", metavar="NAME",
+                        help="run only the named benchmark (repeatable)")
+    parser.add_argument("--no-gui", action="store_true")
+    parser.add_argument("--output", metavar="FILE",
+                        help="write JSON to FILE instead of stdout")
+    args = parser.parse_args(argv)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        dbfile = args.db
+        generated = None
+        if dbfile is None:
+            dbfile = os.path.join(tmpdir, "records.db")
+            start = default_timer()
+            generate.generate(dbfile, args.rows, args.projects, args.years,
+                              seed=args.seed)
+            generated = round(default_timer() - start, 3)
+
+        ctx = Context(dbfile, tmpdir, args.repeat)
+        results = {}
+        for func in BENCHMARKS:
+            if args.only and func.__name__ not in args.only:
+                continue
+            results[func.__name__] = func(ctx)
+
+        if not args.no_gui and not args.only:
+            results.update(gui_benchmarks(ctx))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    output = {
+        "revision": get_revision(),
+        "time": int(time.time()),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "database": {
+            "rows": ctx.rows,
+            "projects": ctx.projects,
+            "generated_in_s": generated
+        },
+        "results": results
+    }
+
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(output, stream, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import random
+import datetime
+import unittest
+from timeline import aggregate
+from timeline.storage import TimeStore
+
+DAY = 86400
+# 2020-01-01 00:00 UTC; 2020 has DST changes in March and October in
+# Europe and in April and October in Australia
+YEAR_START = 1577836800
+YEAR_END = 1609459200
+ZONES = (None, "Europe/Berlin", "America/New_York", "Australia/Lord_Howe",
+         "Asia/Kolkata")
+
+
+def get_zone(name):
+    if name is None:
+        return None
+    try:
+        return aggregate.get_timezone(name)
+    except ValueError:
+        return False
+
+
+def brute_split(starts, ends, edges):
+    # the overlap of every interval with every bucket
+    return [
+        sum(max(0, min(end, edges[i + 1]) - max(start, edges[i]))
+            for start, end in zip(starts, ends))
+        for i in range(len(edges) - 1)
+    ]
+
+
+def random_intervals(rng, count, date_from, date_to):
+    starts = []
+    ends = []
+    for i in range(count):
+        start = rng.randrange(date_from - 10 * DAY, date_to + 10 * DAY)
+        # mostly short, some over days and weeks, some empty or negative
+        length = rng.choice((0, -60, rng.randrange(1, 4 * 3600),
+                             rng.randrange(1, 3 * DAY),
+                             rng.randrange(1, 40 * DAY)))
+        starts.append(start)
+        ends.append(start + length)
+    return starts, ends
+
+
+class BucketBoundariesTest(unittest.TestCase):
+    def test_edges_are_local_period_starts(self):
+        for name in ZONES:
+            tz = get_zone(name)
+            if tz is False:
+                continue
+            for granularity in aggregate.GRANULARITIES:
+                edges = aggregate.bucket_boundaries(YEAR_START + 3600,
+                                                    YEAR_END, granularity, tz)
+                self.assertEqual(edges[0], YEAR_START + 3600)
+                self.assertEqual(edges[-1], YEAR_END)
+                for edge in edges[1:-1]:
+                    if tz is None:
+                        local = aggregate.EPOCH + datetime.timedelta(
+                            seconds=edge)
+                    else:
+                        local = datetime.datetime.fromtimestamp(edge, tz)
+                    self.assertEqual((local.hour, local.minute), (0, 0),
+                                     (name, granularity, edge))
+                    date = local.date()
+                    self.assertEqual(
+                        aggregate.period_start(date, granularity), date
+                    )
+
+                labels = aggregate.bucket_labels(edges, granularity, tz)
+                self.assertEqual(len(labels), len(set(labels)))
+
+    def test_period_counts(self):
+        counts = {"day": 366, "week": 53, "month": 12, "quarter": 4,
+                  "year": 1}
+        for granularity, count in counts.items():
+            edges = aggregate.bucket_boundaries(YEAR_START, YEAR_END,
+                                                granularity)
+            self.assertEqual(len(edges) - 1, count, granularity)
+
+
+class SplitIntervalsTest(unittest.TestCase):
+    def check(self, starts, ends, edges):
+        expected = brute_split(starts, ends, edges)
+        self.assertEqual(aggregate._split_array(starts, ends, edges),
+                         expected)
+        self.assertEqual(aggregate.split_intervals(starts, ends, edges),
+                         expected)
+        if aggregate.get_numpy():
+            self.assertEqual(aggregate._split_numpy(starts, ends, edges),
+                             expected)
+
+    def test_against_brute_force(self):
+        rng = random.Random(5)
+        for name in ZONES:
+            tz = get_zone(name)
+            if tz is False:
+                continue
+            for granularity in aggregate.GRANULARITIES:
+                date_from = YEAR_START + rng.randrange(0, 60 * DAY)
+                date_to = YEAR_END - rng.randrange(0, 60 * DAY)
+                edges = aggregate.bucket_boundaries(date_from, date_to,
+                                                    granularity, tz)
+                starts, ends = random_intervals(rng, 300, date_from, date_to)
+                self.check(starts, ends, edges)
+
+    def test_vectorised_path(self):
+        # enough intervals for split_intervals to take NumPy when installed
+        rng = random.Random(23)
+        edges = aggregate.bucket_boundaries(YEAR_START, YEAR_END, "week",
+                                            get_zone("Europe/Berlin") or None)
+        starts, ends = random_intervals(rng, aggregate.NUMPY_MIN_SIZE + 1,
+                                        YEAR_START, YEAR_END)
+        self.check(starts, ends, edges)
+
+    def test_edge_cases(self):
+        edges = [0, 10, 20, 30]
+        self.check([], [], edges)
+        self.check([-5, 5, 10, 29, 30, 15], [40, 15, 20, 31, 50, 15], edges)
+        self.assertEqual(aggregate.split_intervals([0], [10], [0]), [])
+
+
+class ReportTest(unittest.TestCase):
+    """
+    TimeStore.report reads whole days from the daily totals and splits
+    only the days cut by a period edge from the sessions; the sum has to
+    match splitting every session.
+    """
+
+    def test_report_matches_brute_force(self):
+        store = TimeStore(":memory:")
+        project_id = store.add_project(u"Work")
+        rng = random.Random(7)
+        starts, ends = random_intervals(rng, 400, YEAR_START, YEAR_END)
+        sessions = sorted((start, end) for start, end in zip(starts, ends)
+                          if end > start)
+        with store.db:
+            for start, end in sessions:
+                store.insert_session(project_id, start, end)
+
+        for name in ZONES:
+            tz = get_zone(name)
+            if tz is False:
+                continue
+            for granularity in ("day", "week", "month"):
+                date_from = YEAR_START + 100 * DAY + 7200
+                date_to = YEAR_START + 300 * DAY
+                edges = aggregate.bucket_boundaries(date_from, date_to + 1,
+                                                    granularity, tz)
+                expected = brute_split([s[0] for s in sessions],
+                                       [s[1] for s in sessions], edges)
+                report = store.report(project_id, date_from, date_to, tz,
+                                      granularity)
+                self.assertEqual([seconds for label, seconds in report],
+                                 expected, (name, granularity))
+        store.close()
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from timeline import aggregate
+from timeline.archive import Archiver
+from timeline.importer import Importer
+from timeline.merge import Merger
+from timeline.storage import TimeStore
+
+DAY = 86400
+# 2020-01-30 12:00 UTC
+START = 1580385600
+# archiving 30 days before it takes January and February
+NOW = START + 60 * DAY
+YEAR = (START - 30 * DAY, START + 365 * DAY)
+
+
+def fill(store, name, sessions):
+    project_id = store.add_project(name)
+    for start, end in sessions:
+        store.fold_session(0, project_id, start, end, stopped=True)
+    return project_id
+
+
+class ArchiveDuplicatesTest(unittest.TestCase):
+    """
+    Sessions that went into the archive are still the database's: merging
+    or importing them again, or folding their journal record again, adds
+    nothing.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = TimeStore(os.path.join(self.tmpdir, "records.db"))
+        self.sessions = [(START + i * DAY, START + i * DAY + 3600)
+                         for i in range(0, 60, 3)]
+        self.seconds = 3600 * len(self.sessions)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def total(self):
+        return sum(seconds for label, seconds in
+                   self.store.report(0, YEAR[0], YEAR[1], granularity="year"))
+
+    def archive(self, keep_raw=True):
+        stats = Archiver(self.store).archive(30, keep_raw, now=NOW)
+        self.assertTrue(stats["sessions"])
+
+    def test_merge_archive_merge(self):
+        source = TimeStore(os.path.join(self.tmpdir, "source.db"))
+        fill(source, u"Work", self.sessions + [(NOW, NOW + 60)])
+        source.close()
+
+        merger = Merger(self.store)
+        self.assertEqual(merger.merge(source.filename)["merged"], 21)
+        self.archive()
+        stats = merger.merge(source.filename)
+        self.assertEqual((stats["merged"], stats["duplicates"]), (0, 21))
+        self.assertEqual(self.total(), self.seconds + 60)
+
+    def test_merge_after_totals_only_archive(self):
+        source = TimeStore(os.path.join(self.tmpdir, "source.db"))
+        fill(source, u"Work", self.sessions + [(NOW, NOW + 60)])
+        source.close()
+
+        merger = Merger(self.store)
+        merger.merge(source.filename)
+        self.archive(keep_raw=False)
+        # archived days can't be checked without their sessions
+        stats = merger.merge(source.filename)
+        self.assertEqual((stats["merged"], stats["duplicates"]), (0, 21))
+        self.assertEqual(self.total(), self.seconds + 60)
+
+    def test_import_archive_import(self):
+        records = [(u"Work", start, end) for start, end in self.sessions]
+        Importer(self.store).run(records)
+        self.archive()
+
+        # one new session in an archived month goes in
+        records.append((u"Work", START + DAY, START + DAY + 60))
+        stats = Importer(self.store).run(records)
+        self.assertEqual((stats["imported"], stats["duplicates"]),
+                         (1, len(self.sessions)))
+        self.assertEqual(self.total(), self.seconds + 60)
+
+    def test_fold_after_archive(self):
+        project_id = fill(self.store, u"Work", self.sessions)
+        self.archive()
+
+        start, end = self.sessions[0]
+        self.assertEqual(self.store.fold_session(0, project_id, start, end,
+                                                 stopped=True), 0)
+        self.assertEqual(self.store.fold_sessions([(0, project_id, start,
+                                                    end)]), [0])
+        self.assertEqual(self.total(), self.seconds)
+        self.assertEqual(
+            self.store.session_stats(0, YEAR[0], YEAR[1])[u"Work"].count,
+            len(self.sessions)
+        )
+
+
+class ArchiveReportTest(unittest.TestCase):
+    """
+    Archiving moves sessions out of ``times`` without changing any report.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = TimeStore(os.path.join(self.tmpdir, "records.db"))
+        rng = random.Random(19)
+        for name in (u"Work", u"Play"):
+            sessions = []
+            start = START - 20 * DAY
+            while start < NOW + 10 * DAY:
+                # some over midnight, some over the archive boundary
+                end = start + rng.choice((rng.randrange(60, 4 * 3600),
+                                          rng.randrange(DAY, 3 * DAY)))
+                sessions.append((start, end))
+                start = end + rng.randrange(600, 2 * DAY)
+            fill(self.store, name, sessions)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def reports(self, zones):
+        reports = {}
+        for project_id in (0, 1, 2):
+            reports["totals", project_id] = list(
+                self.store.daily_totals(project_id, YEAR[0], YEAR[1])
+            )
+            for name in zones:
+                tz = name and aggregate.get_timezone(name)
+                for granularity in ("day", "week", "month"):
+                    reports[project_id, name, granularity] = (
+                        self.store.report(project_id, YEAR[0], YEAR[1], tz,
+                                          granularity)
+                    )
+                    reports["rows", project_id, name, granularity] = list(
+                        self.store.iter_report(project_id, YEAR[0], YEAR[1],
+                                               True, tz, granularity)
+                    )
+        reports["stats"] = dict(
+            (name, (sketch.count, sketch.total)) for name, sketch in
+            self.store.session_stats(0, YEAR[0], YEAR[1]).items()
+        )
+        return reports
+
+    def check(self, keep_raw, zones):
+        before = self.reports(zones)
+        stats = Archiver(self.store).archive(30, keep_raw, now=NOW)
+        self.assertTrue(stats["sessions"])
+        after = self.reports(zones)
+        for key in sorted(before, key=repr):
+            self.assertEqual(after[key], before[key], key)
+
+    def test_reports_match_after_archiving(self):
+        zones = [None]
+        try:
+            aggregate.get_timezone("Europe/Berlin")
+            zones.append("Europe/Berlin")
+        except ValueError:
+            pass
+        self.check(True, zones)
+
+    def test_utc_reports_match_after_archiving_totals_only(self):
+        self.check(False, [None])
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
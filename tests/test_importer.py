@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import unittest
+from timeline.importer import Importer, read_csv
+from timeline.storage import TimeStore
+
+# 2020-01-30 12:00 UTC
+START = 1580385600
+
+
+def names(store):
+    return sorted(name for id, name in store.project_rows())
+
+
+class ImporterTest(unittest.TestCase):
+    def setUp(self):
+        self.store = TimeStore(":memory:")
+        self.store.add_project(u"Ärger")
+        self.store.add_project(u"Work")
+
+    def tearDown(self):
+        self.store.close()
+
+    def test_names_match_like_nocase(self):
+        stats = Importer(self.store).run([
+            (u"WORK", START, START + 60),
+            (u"ärger", START, START + 60),
+            (u"ÄRGER", START + 60, START + 120),
+            (u"Ärger", START + 120, START + 180),
+        ])
+        # only the ASCII letters of "ÄRGER" fold, making it "Ärger"
+        self.assertEqual(stats["projects"], 1)
+        self.assertEqual(names(self.store), [u"Work", u"Ärger", u"ärger"])
+
+    def test_second_import_adds_nothing(self):
+        lines = ["project,start,duration\n",
+                 "Work,2020-01-30T23:00:00Z,7200\n",
+                 "Work,%d,60\n" % START,
+                 "Work,%d,60\n" % START,
+                 "Work,bad,60\n"]
+        stats = Importer(self.store).run(read_csv(lines))
+        self.assertEqual((stats["imported"], stats["duplicates"],
+                          stats["invalid"]), (2, 1, 1))
+
+        stats = Importer(self.store).run(read_csv(lines))
+        self.assertEqual((stats["imported"], stats["duplicates"]), (0, 3))
+        self.assertEqual(list(self.store.daily_totals(0, 0, 2 ** 40)),
+                         [(START - 43200, 3660),
+                          (START + 43200, 3600)])
+
+    def test_failed_import_is_rolled_back(self):
+        # a first import drops the indexes and has to bring them back
+        indexes = self.store.db.execute(Importer.SQL_INDEXES).fetchall()
+
+        def fail(last_rowid):
+            raise sqlite3.OperationalError("interrupted")
+
+        self.store.add_session_stats_since = fail
+        with self.assertRaises(sqlite3.OperationalError):
+            Importer(self.store).run([(u"New", START, START + 60)])
+
+        self.assertEqual(names(self.store), [u"Work", u"Ärger"])
+        self.assertEqual(self.store.db.execute(Importer.SQL_INDEXES)
+                         .fetchall(), indexes)
+        self.assertEqual(list(self.store.daily_totals(0, 0, 2 ** 40)), [])
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from timeline.journal import SessionJournal
+from timeline.session import SessionTracker
+from timeline.storage import TimeStore
+
+# 2020-01-30 12:00 UTC
+START = 1580385600
+
+
+class SessionJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "records.journal")
+        self.journal = SessionJournal(self.filename)
+
+    def tearDown(self):
+        self.journal.close()
+        shutil.rmtree(self.tmpdir)
+
+    def reopen(self):
+        self.journal.close()
+        self.journal = SessionJournal(self.filename)
+
+    def corrupt(self, index, offset=8):
+        # flip a byte of the index-th record (negative from the end)
+        size = SessionJournal.RECORD.size
+        with open(self.filename, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            records = f.tell() // size
+            f.seek((index % records) * size + offset)
+            byte = f.read(1)
+            f.seek(-1, os.SEEK_CUR)
+            f.write(bytearray([ord(byte) ^ 0xff]))
+
+    def test_ticks_move_the_last_frame(self):
+        self.journal.append_frame([(0, 1, START)], START)
+        self.journal.append_frame([(0, 1, START), (0, 2, START + 5)],
+                                  START + 5)
+        self.journal.tick(START + 60)
+        self.journal.tick(START + 120)
+        self.assertEqual(self.journal.frame(), [
+            (0, 1, START, START + 120, SessionJournal.FRAME),
+            (0, 2, START + 5, START + 120,
+             SessionJournal.FRAME | SessionJournal.FRAME_END)
+        ])
+
+    def test_partial_record_is_trimmed(self):
+        self.journal.append_frame([(0, 1, START)], START)
+        self.journal.tick(START + 60)
+        with open(self.filename, "ab") as f:
+            f.write(self.journal.pack(0, 0, 0, START + 120,
+                                      SessionJournal.TICK)[:20])
+
+        self.reopen()
+        self.assertEqual(os.path.getsize(self.filename),
+                         2 * SessionJournal.RECORD.size)
+        self.assertEqual([record[3] for record in self.journal.frame()],
+                         [START + 60])
+
+        # appends stay aligned after the trim
+        self.journal.tick(START + 180)
+        self.assertEqual([record[3] for record in self.journal.frame()],
+                         [START + 180])
+
+    def test_bad_crc_tick_is_skipped(self):
+        self.journal.append_frame([(0, 1, START)], START)
+        self.journal.tick(START + 60)
+        self.journal.tick(START + 120)
+        self.corrupt(-1, offset=24)
+        self.assertEqual([record[3] for record in self.journal.frame()],
+                         [START + 60])
+
+    def test_torn_frame_falls_back_to_the_one_before(self):
+        self.journal.append_frame([(7, 1, START)], START)
+        self.journal.tick(START + 60)
+        self.journal.append_frame([(7, 1, START), (0, 2, START + 90)],
+                                  START + 90)
+
+        # the frame's last record fails its CRC: the frame is incomplete
+        self.corrupt(-1)
+        frame = self.journal.frame()
+        self.assertEqual([record[:4] for record in frame],
+                         [(7, 1, START, START + 60)])
+
+        # a frame cut short by a crash before its end record, likewise
+        self.journal.reset()
+        self.journal.append_frame([(7, 1, START)], START)
+        self.journal.write(self.journal.pack(7, 1, START, START + 90,
+                                             SessionJournal.FRAME))
+        self.assertEqual([record[:4] for record in self.journal.frame()],
+                         [(7, 1, START, START)])
+
+    def test_empty_frame_resets(self):
+        self.journal.append_frame([(0, 1, START)], START)
+        self.journal.append_frame([], START + 10)
+        self.assertEqual(self.journal.frame(), [])
+        self.assertEqual(os.path.getsize(self.filename), 0)
+
+
+class RecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "records.db")
+        self.store = TimeStore(self.filename)
+        self.work = self.store.add_project(u"Work")
+        self.play = self.store.add_project(u"Play")
+        self.journal = None
+
+    def tearDown(self):
+        self.journal.close()
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def tracker(self):
+        # a fresh process: new journal handle, new tracker
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = SessionJournal(
+            SessionJournal.filename_for(self.filename)
+        )
+        return SessionTracker(self.store, self.journal, flush_interval=900)
+
+    def sessions(self):
+        return self.store.db.execute(
+            "SELECT project_id, date_start, date_end FROM times "
+            "ORDER BY date_start"
+        ).fetchall()
+
+    def test_crash_with_several_timers(self):
+        tracker = self.tracker()
+        tracker.start(self.work, START)
+        tracker.tick(START + 1000)
+        tracker.start(self.play, START + 1100)
+        tracker.tick(START + 1200)
+        # killed here: Work is folded up to +1000, Play not at all
+
+        tracker = self.tracker()
+        self.assertEqual(sorted(tracker.recover()), [
+            (self.work, START, START + 1200),
+            (self.play, START + 1100, START + 1200)
+        ])
+        self.assertEqual(self.sessions(), [
+            (self.work, START, START + 1200),
+            (self.play, START + 1100, START + 1200)
+        ])
+        self.assertEqual(list(self.store.daily_totals(0, 0, 2 ** 40)),
+                         [(START - 43200, 1300)])
+
+        # the journal is empty, a second recovery adds nothing
+        self.assertEqual(self.tracker().recover(), [])
+        self.assertEqual(len(self.sessions()), 2)
+
+    def test_recovery_with_a_torn_tick(self):
+        tracker = self.tracker()
+        tracker.start(self.work, START)
+        tracker.tick(START + 60)
+        tracker.tick(START + 120)
+        self.journal.file.seek(0, os.SEEK_END)
+        self.journal.write(b"\0" * 10)
+
+        self.assertEqual(self.tracker().recover(),
+                         [(self.work, START, START + 120)])
+        self.assertEqual(self.sessions(), [(self.work, START, START + 120)])
+
+    def test_folding_twice_keeps_one_row(self):
+        # a crash after the fold but before the journal reset
+        tracker = self.tracker()
+        tracker.start(self.work, START)
+        tracker.tick(START + 300)
+        frame = self.journal.frame()
+        self.store.fold_sessions([record[:4] for record in frame],
+                                 stopped=True)
+
+        self.assertEqual(self.tracker().recover(),
+                         [(self.work, START, START + 300)])
+        self.assertEqual(self.sessions(), [(self.work, START, START + 300)])
+
+    def test_detached_timers_keep_running(self):
+        tracker = self.tracker()
+        tracker.start(self.work, START, detached=True)
+
+        tracker = self.tracker()
+        self.assertEqual(tracker.recover(), [])
+        self.assertTrue(tracker.resume(attach=False))
+        self.assertEqual(tracker.sessions(), [(self.work, START)])
+        self.assertEqual(self.sessions(), [])
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from timeline.merge import Merger, MergeError
+from timeline.storage import TimeStore
+
+DAY = 86400
+# 2020-01-30 12:00 UTC
+START = 1580385600
+
+
+class MergerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = TimeStore(os.path.join(self.tmpdir, "records.db"))
+        self.work = self.store.add_project(u"Work")
+        self.store.fold_session(0, self.work, START, START + 3600,
+                                stopped=True)
+        self.source_filename = os.path.join(self.tmpdir, "laptop.db")
+        self.source = TimeStore(self.source_filename)
+
+    def tearDown(self):
+        if self.source.db is not None:
+            self.source.close()
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def merge(self):
+        if self.source.db is not None:
+            self.source.close()
+        return Merger(self.store).merge(self.source_filename)
+
+    def sessions(self):
+        return self.store.db.execute(
+            "SELECT p.name, t.date_start, t.date_end FROM times t "
+            "JOIN projects p ON p.rowid = t.project_id "
+            "ORDER BY t.date_start, p.name"
+        ).fetchall()
+
+    def totals(self):
+        return list(self.store.daily_totals(0, 0, 2 ** 40))
+
+    def test_merging_twice_adds_nothing(self):
+        work = self.source.add_project(u"WORK")
+        play = self.source.add_project(u"Play")
+        with self.source.db:
+            self.source.insert_session(work, START + DAY, START + DAY + 60)
+            self.source.insert_session(play, START, START + 600)
+            # over midnight, split between two days in the totals
+            self.source.insert_session(play, START + 43000, START + 44000)
+
+        stats = self.merge()
+        self.assertEqual((stats["read"], stats["merged"],
+                          stats["duplicates"], stats["projects"]),
+                         (3, 3, 0, 1))
+        sessions = self.sessions()
+        totals = self.totals()
+        self.assertEqual(totals, [(START - 43200, 3600 + 600 + 200),
+                                  (START + 43200, 800 + 60)])
+
+        stats = self.merge()
+        self.assertEqual((stats["merged"], stats["duplicates"],
+                          stats["projects"]), (0, 3, 0))
+        self.assertEqual(self.sessions(), sessions)
+        self.assertEqual(self.totals(), totals)
+
+    def test_overlapping_and_invalid_sessions(self):
+        work = self.source.add_project(u"work")
+        blank = self.source.add_project(u" ")
+        with self.source.db:
+            # overlaps the target's session, identical, inside it
+            self.source.insert_session(work, START + 1800, START + 5400)
+            self.source.insert_session(work, START, START + 3600)
+            self.source.insert_session(work, START + 60, START + 120)
+            # touching it is fine
+            self.source.insert_session(work, START + 3600, START + 3700)
+            # empty, negative and in a project without a name
+            self.source.insert_session(work, START + 7200, START + 7200)
+            self.source.insert_session(work, START + 7200, START + 7100)
+            self.source.insert_session(blank, START + 7200, START + 7300)
+
+        stats = self.merge()
+        self.assertEqual((stats["read"], stats["merged"], stats["duplicates"],
+                          stats["invalid"], stats["projects"]),
+                         (7, 1, 3, 3, 0))
+        self.assertEqual(self.sessions(), [
+            (u"Work", START, START + 3600),
+            (u"Work", START + 3600, START + 3700)
+        ])
+        self.assertEqual(self.totals(), [(START - 43200, 3700)])
+
+    def test_errors(self):
+        with self.assertRaises(MergeError):
+            Merger(self.store).merge(os.path.join(self.tmpdir, "none.db"))
+        with self.assertRaises(MergeError):
+            Merger(self.store).merge(self.store.filename)
+
+        other = os.path.join(self.tmpdir, "other.db")
+        db = sqlite3.connect(other)
+        db.execute("CREATE TABLE times (id INTEGER)")
+        db.close()
+        with self.assertRaises(MergeError):
+            Merger(self.store).merge(other)
+
+        # the failed merges left nothing attached
+        self.assertEqual(len(self.store.db.execute(
+            "PRAGMA database_list").fetchall()), 2)
+        self.assertEqual(self.merge()["read"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import unittest
+from timeline import migrations
+
+# (version, query): the query scans its table before that version and
+# searches an index from it on
+INDEXED = [
+    (2, "SELECT rowid FROM times WHERE project_id = 1 AND date_start >= 0"),
+    (2, "SELECT rowid FROM times WHERE date_start >= 0 AND date_start < 9"),
+    (2, "SELECT value FROM settings WHERE name = 'x' COLLATE NOCASE"),
+    (2, "SELECT rowid FROM projects WHERE name = 'x' COLLATE NOCASE"),
+    (4, "SELECT rowid FROM times WHERE duration > 100"),
+]
+
+# (version, query) of tables created with their indexes
+CREATED = [
+    (3, "SELECT day, project_id, seconds FROM daily_totals "
+        "WHERE day >= 0 AND day < 9"),
+    (3, "SELECT seconds FROM daily_totals WHERE project_id = 1 AND day >= 0"),
+    (7, "SELECT count FROM session_stats WHERE month >= 0"),
+    (7, "SELECT count FROM session_stats WHERE project_id = 1 AND month = 0"),
+]
+
+
+def plan(db, sql):
+    return " ".join(row[-1] for row in db.execute("EXPLAIN QUERY PLAN " + sql))
+
+
+def migrated(version):
+    db = sqlite3.connect(":memory:")
+    migrations.migrate(db, version)
+    return db
+
+
+class QueryPlanTest(unittest.TestCase):
+    def test_indexes_turn_scans_into_searches(self):
+        for version, sql in INDEXED:
+            before = plan(migrated(version - 1), sql)
+            after = plan(migrated(version), sql)
+            self.assertTrue(before.startswith("SCAN"), (version, before))
+            self.assertTrue(after.startswith("SEARCH"), (version, after))
+            self.assertIn("INDEX", after)
+
+    def test_new_tables_come_indexed(self):
+        for version, sql in CREATED:
+            self.assertTrue(plan(migrated(version), sql).startswith("SEARCH"),
+                            (version, sql))
+
+    def test_latest_schema_searches_everywhere(self):
+        # migration 6 rebuilds the tables and has to bring every index back
+        db = migrated(migrations.SCHEMA_VERSION)
+        for version, sql in INDEXED + CREATED:
+            self.assertTrue(plan(db, sql).startswith("SEARCH"), sql)
+
+
+class MigrationTest(unittest.TestCase):
+    def test_versions_are_applied_in_order(self):
+        db = migrated(3)
+        self.assertEqual(migrations.get_version(db), 3)
+        self.assertEqual(migrations.migrate(db),
+                         list(range(4, migrations.SCHEMA_VERSION + 1)))
+        self.assertEqual(migrations.migrate(db), [])
+
+    def test_case_duplicates_are_folded(self):
+        db = migrated(1)
+        db.executemany("INSERT INTO settings (name, value) VALUES (?, ?)",
+                       [("Foo", "1"), ("foo", "2"), ("bar", "3")])
+        db.executemany("INSERT INTO projects (name) VALUES (?)",
+                       [("Work",), ("work",)])
+        db.executemany("INSERT INTO times (project_id, date_start, date_end, "
+                       "duration) VALUES (?, 0, 10, 10)", [(1,), (2,)])
+        db.commit()
+
+        migrations.migrate(db, 2)
+        self.assertEqual(
+            db.execute("SELECT name, value FROM settings "
+                       "ORDER BY name").fetchall(),
+            [("bar", "3"), ("foo", "2")]
+        )
+        self.assertEqual(
+            db.execute("SELECT DISTINCT project_id FROM times").fetchall(),
+            [(1,)]
+        )
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
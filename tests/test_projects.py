@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from timeline.projects import ProjectList
+
+
+class ProjectListTest(unittest.TestCase):
+    def setUp(self):
+        self.projects = ProjectList()
+        self.projects.load([(1, u"Ärger"), (2, u"ärger"), (3, u"Apple"),
+                            (4, u"Проект"), (5, u"проект")])
+
+    def test_non_ascii_case_variants_are_distinct(self):
+        # COLLATE NOCASE only folds ASCII, so these are four projects
+        for id in (1, 2, 4, 5):
+            index = self.projects.index_of(id)
+            self.assertEqual(self.projects.ids[index], id)
+            self.assertEqual(self.projects.find(self.projects.name_of(id)),
+                             index)
+
+    def test_ascii_case_is_ignored(self):
+        self.assertEqual(self.projects.find(u"APPLE"),
+                         self.projects.index_of(3))
+        self.assertEqual(self.projects.find(u"äRGER"),
+                         self.projects.index_of(2))
+        self.assertEqual(self.projects.find(u"ÄRGER"),
+                         self.projects.index_of(1))
+        self.assertEqual(self.projects.find(u"Banana"), -1)
+
+    def test_remove_by_id(self):
+        self.projects.remove(2)
+        self.assertEqual(sorted(self.projects.ids), [1, 3, 4, 5])
+        self.assertEqual(sorted(self.projects.by_id), [1, 3, 4, 5])
+        self.assertEqual(self.projects.name_of(1), u"Ärger")
+
+        self.projects.remove(4)
+        self.assertEqual(self.projects.find(u"проект"),
+                         self.projects.index_of(5))
+        self.assertEqual(self.projects.find(u"Проект"), -1)
+
+    def test_add_keeps_order_and_index(self):
+        index = self.projects.add(6, u"apple pie")
+        self.assertEqual(self.projects.ids[index], 6)
+        self.assertEqual(self.projects.keys, sorted(self.projects.keys))
+        self.assertEqual([name for id, name in self.projects.prefix(u"APP")],
+                         [u"Apple", u"apple pie"])
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
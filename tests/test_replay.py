@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from timeline import replay
+from timeline.clock import SimulatedClock
+from timeline.replay import Event, Replay, ScriptError
+from timeline.session import SessionTracker
+from timeline.storage import TimeStore
+
+START = replay.START
+SCRIPT = """
+0      start  Writing
++25m   start  Email    # two timers at once
++5m    stop   Email
++2h    hide
++30m   show
++1h    crash
++10m   launch
+9h     stop-all
+"""
+
+
+class ParseScriptTest(unittest.TestCase):
+    def test_times(self):
+        self.assertEqual([replay.parse_seconds(text) for text in
+                          ("90", "1.5h", "1h30m", "2d", "10S")],
+                         [90, 5400, 5400, 172800, 10])
+        self.assertEqual(list(replay.parse_script(SCRIPT.splitlines()))[:3], [
+            Event(START, "start", "Writing"),
+            Event(START + 1500, "start", "Email"),
+            Event(START + 1800, "stop", "Email")
+        ])
+
+    def test_errors(self):
+        for lines in (["1x start Work"], ["1h"], ["0 jump Work"],
+                      ["0 start"], ["1h start Work", "30m stop Work"]):
+            with self.assertRaises(ScriptError):
+                list(replay.parse_script(lines))
+
+    def test_clock_does_not_go_back(self):
+        clock = SimulatedClock(10)
+        clock.advance(5)
+        self.assertEqual(clock(), 15)
+        with self.assertRaises(ValueError):
+            clock.set(14)
+
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def replay(self, events, name="replay.db", exact=False):
+        result = Replay(os.path.join(self.tmpdir, name), exact=exact)
+        try:
+            result.run(events)
+            return result.result()
+        finally:
+            result.close()
+
+    def test_crash_loses_less_than_a_heartbeat(self):
+        result = self.replay(replay.parse_script(SCRIPT.splitlines()))
+        self.assertEqual((result["launches"], result["crashes"],
+                          result["sessions"]), (2, 1, 2))
+        # Writing until the crash at 4h, Email for 5 minutes
+        seconds = result["seconds"]
+        self.assertEqual(seconds["expected"], 4 * 3600 + 300)
+        self.assertTrue(0 <= seconds["lost"] <
+                        SessionTracker.HEARTBEAT_INTERVAL, seconds)
+        # the stop-all after the crash had nothing to stop
+        self.assertEqual(result["ignored"], 1)
+
+    def test_skipped_ticks_change_nothing(self):
+        events = list(replay.parse_script(SCRIPT.splitlines()))
+        fast = self.replay(events)
+        exact = self.replay(events, "exact.db", exact=True)
+        self.assertTrue(exact["ticks"] > 10 * fast["ticks"])
+        for key in ("heartbeats", "sessions", "seconds", "journal"):
+            self.assertEqual(fast[key], exact[key], key)
+        self.assertEqual(fast["database"]["commits"],
+                         exact["database"]["commits"])
+
+    def test_writes_per_timer_hour(self):
+        # a working day of one timer: a journal write per heartbeat, a
+        # database commit per flush
+        result = self.replay(replay.parse_script(["0 start Work",
+                                                  "8h stop Work"]))
+        self.assertEqual(result["seconds"]["lost"], 0)
+        per_hour = result["per_timer_hour"]
+        self.assertTrue(per_hour["journal_writes"] <= 62, per_hour)
+        flushes = 3600 / SessionTracker.DEFAULT_FLUSH_INTERVAL
+        self.assertTrue(per_hour["commits"] <= flushes + 1, per_hour)
+
+    def test_recorded_sessions(self):
+        filename = os.path.join(self.tmpdir, "records.db")
+        store = TimeStore(filename)
+        work = store.add_project(u"Work")
+        play = store.add_project(u"Play")
+        with store.db:
+            store.insert_session(work, START, START + 3600)
+            store.insert_session(play, START + 1800, START + 2000)
+            store.insert_session(work, START + 3600, START + 7200)
+        events = list(replay.recorded_events(store))
+        store.close()
+
+        self.assertEqual(events, [
+            Event(START, "start", u"Work"),
+            Event(START + 1800, "start", u"Play"),
+            Event(START + 2000, "stop", u"Play"),
+            Event(START + 3600, "stop", u"Work"),
+            Event(START + 3600, "start", u"Work"),
+            Event(START + 7200, "stop", u"Work")
+        ])
+        seconds = self.replay(events)["seconds"]
+        self.assertEqual((seconds["expected"], seconds["lost"]), (7400, 0))
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
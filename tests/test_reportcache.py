@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from timeline.reportcache import ReportCache, PersistentReportCache
+from timeline.reportcache import ROW_BYTES
+from timeline.storage import TimeStore
+
+DAY = 86400
+# 2020-01-30 12:00 UTC
+START = 1580385600
+KEY = (0, START - 43200, START + 6 * DAY, "day")
+
+
+class ReportCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "records.db")
+        self.store = TimeStore(self.filename)
+        self.work = self.store.add_project(u"Work")
+        self.store.fold_session(0, self.work, START, START + 3600,
+                                stopped=True)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def report(self, cache, key=KEY):
+        # what the report windows and the command line do
+        cache.validate(self.store.write_generation())
+        rows = cache.get(key)
+        if rows is None:
+            rows = list(self.store.iter_report(key[0], key[1], key[2]))
+            cache.put(key, rows, cache.generation)
+        return rows
+
+    def seconds(self, rows):
+        return sum(row[2] for row in rows)
+
+    def check_invalidation(self, cache):
+        self.assertEqual(self.seconds(self.report(cache)), 3600)
+        self.assertEqual(self.seconds(self.report(cache)), 3600)
+        self.assertEqual((cache.stats()["hits"], cache.stats()["misses"]),
+                         (1, 1))
+
+        # any write to times voids the entry
+        self.store.fold_session(0, self.work, START + DAY,
+                                START + DAY + 60, stopped=True)
+        self.assertEqual(self.seconds(self.report(cache)), 3660)
+        self.assertEqual(cache.stats()["invalidations"], 1)
+
+        # so does a write through another connection
+        other = TimeStore(self.filename)
+        other.fold_session(0, self.work, START + 2 * DAY,
+                           START + 2 * DAY + 60, stopped=True)
+        other.close()
+        self.assertEqual(self.seconds(self.report(cache)), 3720)
+        self.assertEqual(cache.stats()["invalidations"], 2)
+
+    def test_memory_cache_invalidation(self):
+        self.check_invalidation(ReportCache())
+
+    def test_persistent_cache_invalidation(self):
+        filename = PersistentReportCache.filename_for(self.filename)
+        cache = PersistentReportCache(filename)
+        try:
+            self.check_invalidation(cache)
+        finally:
+            cache.close()
+
+        # a later run hits the entry of the earlier one
+        cache = PersistentReportCache(filename)
+        try:
+            self.assertEqual(self.report(cache),
+                             list(self.store.iter_report(*KEY[:3])))
+            self.assertEqual(cache.stats()["hits"], 1)
+        finally:
+            cache.close()
+
+    def test_stale_rows_are_not_stored(self):
+        cache = ReportCache()
+        cache.validate(self.store.write_generation())
+        generation = cache.generation
+        rows = list(self.store.iter_report(*KEY[:3]))
+        # a write lands while the report runs
+        self.store.fold_session(0, self.work, START + DAY,
+                                START + DAY + 60, stopped=True)
+        cache.validate(self.store.write_generation())
+        cache.put(KEY, rows, generation)
+        self.assertIsNone(cache.get(KEY))
+
+    def test_unchanged_fold_keeps_the_cache(self):
+        cache = ReportCache()
+        self.report(cache)
+        rowid = self.store.find_session(self.work, START)
+        self.store.fold_sessions([(rowid, self.work, START, START + 3600)])
+        self.report(cache)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        rows = [(u"2020-01-30", None, 60)]
+        cache = ReportCache(max_bytes=2 * ROW_BYTES)
+        cache.validate(1)
+        cache.put("a", rows, 1)
+        cache.put("b", rows, 1)
+        cache.get("a")
+        cache.put("c", rows, 1)
+        self.assertEqual(list(cache.entries), ["a", "c"])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
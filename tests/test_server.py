@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import shutil
+import socket
+import tempfile
+import unittest
+from timeline.storage import TimeStore
+
+if sys.version_info >= (3, 5):
+    from timeline import server
+
+
+@unittest.skipIf(sys.version_info < (3, 5), "the API server needs Python 3")
+class ApiServerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "records.db")
+        TimeStore(self.filename).close()
+        self.server = server.ApiServer(self.filename, readers=1)
+        self.server.start_thread(port=0)
+        self.address = self.server.server.sockets[0].getsockname()[:2]
+
+    def tearDown(self):
+        self.server.stop_thread()
+        shutil.rmtree(self.tmpdir)
+
+    def request(self, head, body=b""):
+        # send a raw request, return (status, JSON body) of the response
+        sock = socket.create_connection(self.address, timeout=10)
+        try:
+            sock.sendall(head.encode("latin-1") + b"\r\n" + body)
+            data = b""
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        finally:
+            sock.close()
+
+        head, _, body = data.partition(b"\r\n\r\n")
+        status = int(head.split()[1])
+        return status, json.loads(body.decode("utf-8"))
+
+    def post(self, path, data, headers=""):
+        body = json.dumps(data).encode("utf-8")
+        return self.request(
+            "POST %s HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+            "Content-Type: application/json\r\nContent-Length: %d\r\n%s"
+            % (path, len(body), headers), body
+        )
+
+    def get(self, path, headers="Host: localhost\r\n"):
+        return self.request("GET %s HTTP/1.1\r\nConnection: close\r\n%s"
+                            % (path, headers))
+
+    def test_requests(self):
+        self.assertEqual(self.post("/projects", {"name": "Work"}),
+                         (200, {"id": 1, "name": "Work"}))
+        self.assertEqual(self.post("/projects", {"name": "work"})[0], 409)
+        status, result = self.post("/timers/start", {"project": "Work"})
+        self.assertEqual((status, result["project_id"]), (200, 1))
+        status, result = self.get("/timers")
+        self.assertEqual([timer["project"] for timer in result["timers"]],
+                         ["Work"])
+        status, result = self.post("/timers/stop", {"all": True})
+        self.assertEqual(len(result["stopped"]), 1)
+
+        self.assertEqual(self.get("/projects", "Host: localhost:8765\r\n"),
+                         (200, {"projects": [{"id": 1, "name": "Work"}]}))
+        # HTTP/1.0 clients may not send a Host at all
+        self.assertEqual(self.request("GET /timers HTTP/1.0\r\n")[0], 200)
+
+    def test_cross_origin_requests_are_refused(self):
+        for headers in ("Host: localhost\r\nOrigin: http://example.com\r\n",
+                        "Host: localhost\r\nOrigin: null\r\n",
+                        # DNS rebinding
+                        "Host: example.com\r\n",
+                        "Host: example.com:8765\r\n"):
+            self.assertEqual(self.get("/projects", headers)[0], 403,
+                             headers)
+        self.assertEqual(self.post("/projects", {"name": "Work"},
+                                   "Origin: http://example.com\r\n")[0], 403)
+
+    def test_malformed_requests_are_refused(self):
+        close = "Host: localhost\r\nConnection: close\r\n"
+        for head, status in (
+                ("NONSENSE\r\n", 400),
+                # a form post, which pages can send without asking
+                ("POST /projects HTTP/1.1\r\n%sContent-Type: text/plain\r\n"
+                 "Content-Length: 2\r\n" % close, 415),
+                ("POST /projects HTTP/1.1\r\n%s" % close, 415),
+                ("GET /projects HTTP/1.1\r\n%sContent-Length: x\r\n"
+                 % close, 400),
+                ("GET /projects HTTP/1.1\r\n%sContent-Length: -1\r\n"
+                 % close, 400),
+                ("GET /projects HTTP/1.1\r\n%sContent-Length: %d\r\n"
+                 % (close, server.MAX_BODY + 1), 413),
+                ("GET /nowhere HTTP/1.1\r\n%s" % close, 404),
+                ("DELETE /projects HTTP/1.1\r\n%s" % close, 405)):
+            self.assertEqual(self.request(head)[0], status, head)
+
+        for body in (b"{", b"[]", b"\xff"):
+            self.assertEqual(self.request(
+                "POST /projects HTTP/1.1\r\n%sContent-Type: application/json"
+                "\r\nContent-Length: %d\r\n" % (close, len(body)), body
+            )[0], 400, body)
+
+        self.assertEqual(self.post("/projects", {"name": " "})[0], 400)
+        self.assertEqual(self.post("/timers/start", {"project": "None"})[0],
+                         404)
+        self.assertEqual(self.get("/report?from=yesterday")[0], 400)
+        self.assertEqual(self.get("/report?granularity=hour")[0], 400)
+        self.assertEqual(self.server.stats()["errors"], 15)
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+from timeline.journal import SessionJournal
+from timeline.session import SessionTracker
+from timeline.storage import TimeStore
+
+# 2020-01-30 12:00 UTC
+START = 1580385600
+
+
+class SessionTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        filename = os.path.join(self.tmpdir, "records.db")
+        self.store = TimeStore(filename)
+        self.journal = SessionJournal(SessionJournal.filename_for(filename))
+        self.tracker = SessionTracker(self.store, self.journal,
+                                      flush_interval=900)
+        self.work = self.store.add_project(u"Work")
+        self.play = self.store.add_project(u"Play")
+
+    def sessions(self):
+        return self.store.db.execute(
+            "SELECT project_id, date_start, date_end FROM times "
+            "ORDER BY date_start"
+        ).fetchall()
+
+    def tearDown(self):
+        self.journal.close()
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_unsaved_is_what_a_flush_would_write(self):
+        self.tracker.start(self.work, START)
+        self.tracker.tick(START + 1000)
+        self.tracker.start(self.play, START + 1200)
+        self.tracker.tick(START + 1500)
+        generation = self.store.write_generation()
+
+        # Work was folded up to the flush at +1000, Play not at all
+        self.assertEqual(self.tracker.unsaved(), [
+            (self.work, START + 1000, START + 1500),
+            (self.play, START + 1200, START + 1500)
+        ])
+        self.assertEqual(self.store.write_generation(), generation)
+
+        self.tracker.flush()
+        self.assertEqual(self.tracker.unsaved(), [])
+        self.assertEqual(self.tracker.unsaved(START + 1600), [
+            (self.work, START + 1500, START + 1600),
+            (self.play, START + 1500, START + 1600)
+        ])
+
+    def test_timers_run_side_by_side(self):
+        self.assertTrue(self.tracker.start(self.work, START))
+        self.assertTrue(self.tracker.start(self.play, START + 100))
+        self.assertFalse(self.tracker.start(self.work, START + 200))
+        self.assertEqual(len(self.tracker), 2)
+
+        # the flush folds both, later folds update the same rows
+        self.tracker.tick(START + 1000)
+        self.assertEqual(self.sessions(), [
+            (self.work, START, START + 1000),
+            (self.play, START + 100, START + 1000)
+        ])
+
+        self.assertEqual(self.tracker.stop(self.work, START + 1200),
+                         (START, START + 1200))
+        self.assertIsNone(self.tracker.stop(self.work, START + 1300))
+        self.assertEqual(self.tracker.sessions(), [(self.play, START + 100)])
+        self.assertEqual([record[1] for record in self.journal.frame()],
+                         [self.play])
+
+        self.assertEqual(self.tracker.stop_all(START + 1500),
+                         [(self.play, START + 100, START + 1500)])
+        self.assertFalse(self.tracker.running)
+        self.assertEqual(self.journal.frame(), [])
+        self.assertEqual(self.sessions(), [
+            (self.work, START, START + 1200),
+            (self.play, START + 100, START + 1500)
+        ])
+
+    def test_abort_one_timer(self):
+        self.tracker.start(self.work, START)
+        self.tracker.start(self.play, START + 100)
+        self.tracker.abort(self.work)
+        self.assertEqual(self.tracker.sessions(), [(self.play, START + 100)])
+        self.tracker.stop_all(START + 500)
+        self.assertEqual(self.sessions(),
+                         [(self.play, START + 100, START + 500)])
+
+    def test_start_joins_timers_of_another_process(self):
+        # the command line started a detached timer in the same journal
+        other = SessionJournal(self.journal.filename)
+        SessionTracker(self.store, other).start(self.work, START,
+                                                detached=True)
+        other.close()
+
+        self.tracker.start(self.play, START + 100)
+        self.assertEqual(self.tracker.sessions(), [
+            (self.work, START), (self.play, START + 100)
+        ])
+        self.assertEqual(self.tracker.stop_all(START + 600), [
+            (self.work, START, START + 600),
+            (self.play, START + 100, START + 600)
+        ])
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from timeline import stats
+from timeline.archive import month_start, pack, unpack
+
+DAY = 86400
+# 2020-01-30 12:00 UTC
+START = 1580385600
+
+
+class SessionSketchTest(unittest.TestCase):
+    def test_short_sessions(self):
+        sketch = stats.SessionSketch()
+        for seconds in (1, 1, 1, 0):
+            sketch.add(START, START + seconds)
+        self.assertEqual(sketch.quantile(0.5), 1)
+        self.assertEqual(sketch.quantile(0.99), 1)
+
+        empty = stats.SessionSketch()
+        empty.add(START, START)
+        self.assertEqual(empty.quantile(0.5), 0)
+
+    def test_quantiles_within_accuracy(self):
+        sketch = stats.SessionSketch()
+        lengths = list(range(60, 6060, 60))
+        for seconds in lengths:
+            sketch.add(START, START + seconds)
+        for q in (0.5, 0.9, 0.99):
+            exact = lengths[int(q * len(lengths)) - 1]
+            self.assertAlmostEqual(sketch.quantile(q), exact,
+                                   delta=exact * stats.ACCURACY + 1)
+        self.assertEqual(sketch.longest, 6000)
+
+    def test_sessions_split_by_month(self):
+        # three days from January into February, one second in March
+        march = month_start(START + 40 * DAY)
+        sessions = [(1, START, START + 3 * DAY), (1, march, march + 1),
+                    (2, START, START + 60)]
+        sketches = stats.sketch_sessions(sessions)
+
+        january = month_start(START)
+        february = month_start(START + 3 * DAY)
+        self.assertEqual(sorted(sketches), [(1, january), (1, february),
+                                            (1, march), (2, january)])
+        self.assertEqual(sketches[1, january].count, 1)
+        self.assertEqual(sketches[1, february].count, 0)
+        first_day = START - START % DAY
+        self.assertEqual(sketches[1, january].streak(), (first_day, 2))
+
+        merged = stats.merge_sketches(sketches[1, month]
+                                      for month in (january, february))
+        self.assertEqual(merged.streak(), (first_day, 4))
+        self.assertEqual(sum(merged.heatmap), 3 * DAY)
+
+    def test_row_round_trip(self):
+        sketch = stats.sketch_sessions([(1, START, START + 5000)])[
+            1, month_start(START)]
+        month = month_start(START)
+        copy = stats.SessionSketch.from_row(month, sketch.to_row(month))
+        self.assertEqual(copy.buckets, sketch.buckets)
+        self.assertEqual(list(copy.heatmap), list(sketch.heatmap))
+        self.assertEqual(copy.days, sketch.days)
+
+    def test_pack(self):
+        values = [0, 1, -5, 2 ** 40, START]
+        self.assertEqual(list(unpack(pack(values))), values)
+        self.assertEqual(list(unpack(pack(values, 1))), values)
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from timeline.clock import SimulatedClock
+
+try:
+    from PyQt4 import QtCore
+except ImportError:
+    QtCore = None
+
+
+@unittest.skipIf(QtCore is None, "needs PyQt4")
+class TickSchedulerTest(unittest.TestCase):
+    """
+    Drives the scheduler's QTimer by emitting its timeout by hand on a
+    SimulatedClock, so no event loop (or display) is needed and every tick
+    handler run is counted.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = (QtCore.QCoreApplication.instance() or
+                   QtCore.QCoreApplication([]))
+
+    def setUp(self):
+        from timeline.TickScheduler import TickScheduler
+        self.clock = SimulatedClock(1000.25)
+        self.scheduler = TickScheduler(clock=self.clock)
+        self.ticks = []
+        self.scheduler.tick.connect(self.ticks.append)
+
+    def fire(self):
+        self.scheduler.timer.timeout.emit()
+
+    def test_one_tick_per_timeout_after_many_cycles(self):
+        for i in range(500):
+            self.scheduler.start()
+            self.scheduler.stop()
+        self.scheduler.start()
+
+        for i in range(10):
+            self.clock.advance(1)
+            self.fire()
+        self.assertEqual(self.ticks, [1001.25 + i for i in range(10)])
+
+    def test_no_ticks_while_stopped(self):
+        self.scheduler.start()
+        self.scheduler.stop()
+        self.fire()
+        self.assertEqual(self.ticks, [])
+        self.assertFalse(self.scheduler.timer.isActive())
+
+    def test_ticks_land_on_second_boundaries(self):
+        slack = self.scheduler.SLACK
+        self.scheduler.start()
+        self.assertEqual(self.scheduler.timer.interval(), 750 + slack)
+
+        self.clock.set(1001.005)
+        self.fire()
+        self.assertEqual(self.scheduler.timer.interval(), 995 + slack)
+
+    def test_coarse_ticks(self):
+        slack = self.scheduler.SLACK
+        self.scheduler.set_coarse(True)
+        self.assertFalse(self.scheduler.timer.isActive())
+
+        self.scheduler.start()
+        # 1000.25 s is 10.25 s into a 30 s period
+        self.assertEqual(self.scheduler.timer.interval(), 19750 + slack)
+        self.scheduler.set_coarse(False)
+        self.assertEqual(self.scheduler.timer.interval(), 750 + slack)
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from concurrent.futures import Future
+from PyQt4 import QtCore
+from timeline.server import run_jobs
+
+
+class ApiBridge(QtCore.QObject):
+    """
+    Writer of an ApiServer embedded in the main window. Write jobs arrive
+    from the server thread and run on the GUI thread against the window's
+    store and tracker, so the API and the window share one set of timers.
+    """
+    detached = False
+
+    request = QtCore.pyqtSignal(object, object)
+    changed = QtCore.pyqtSignal()
+
+    def __init__(self, window):
+        super(ApiBridge, self).__init__(window)
+        self.window = window
+        self.request.connect(self.on_request, QtCore.Qt.QueuedConnection)
+
+    def submit(self, jobs):
+        # called on the server thread
+        future = Future()
+        self.request.emit(jobs, future)
+        return future
+
+    def on_request(self, jobs, future):
+        if not future.set_running_or_notify_cancel():
+            return
+
+        future.set_result(
+            run_jobs(jobs, self.window.store, self.window.tracker)
+        )
+        self.changed.emit()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sqlite3
+from PyQt4 import QtCore
+from timeline.storage import TimeStore
+
+
+class CancelledError(Exception):
+    pass
+
+
+class SignalStream(object):
+    # file-like object that hands written text to the GUI thread in chunks
+    CHUNK_SIZE = 16384
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.buffer = []
+        self.size = 0
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= self.CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.worker.chunk.emit("".join(self.buffer))
+            self.buffer = []
+            self.size = 0
+
+
+class DatabaseWorker(QtCore.QThread):
+    """
+    Runs ``job(store, worker)`` on its own thread with its own connection.
+    The job's return value is delivered by the ``done`` signal; the GUI
+    thread never waits for SQLite.
+    """
+    # virtual machine instructions between two cancellation checks
+    CHECK_EVERY = 10000
+
+    progress = QtCore.pyqtSignal(int, int)
+    chunk = QtCore.pyqtSignal(object)
+    done = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(object)
+    cancelled = QtCore.pyqtSignal()
+
+    def __init__(self, dbfile, job, parent=None):
+        super(DatabaseWorker, self).__init__(parent)
+        self.dbfile = dbfile
+        self.job = job
+        self.is_cancelled = False
+
+    def cancel(self):
+        self.is_cancelled = True
+
+    def check_cancelled(self):
+        if self.is_cancelled:
+            raise CancelledError()
+
+    def report_progress(self, done, total):
+        self.check_cancelled()
+        self.progress.emit(done, total)
+
+    def on_sqlite_progress(self):
+        # non-zero aborts the running statement
+        return 1 if self.is_cancelled else 0
+
+    def run(self):
+        store = None
+
+        try:
+            store = TimeStore(self.dbfile)
+            store.db.set_progress_handler(self.on_sqlite_progress,
+                                          self.CHECK_EVERY)
+            result = self.job(store, self)
+            self.check_cancelled()
+        except CancelledError:
+            self.cancelled.emit()
+            return
+        except sqlite3.Error as e:
+            if self.is_cancelled:
+                self.cancelled.emit()
+            else:
+                self.failed.emit(e.args[0])
+            return
+        except (EnvironmentError, ValueError) as e:
+            # unreadable or malformed input files
+            self.failed.emit(str(e))
+            return
+        finally:
+            if store is not None:
+                store.close()
+
+        self.done.emit(result)
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
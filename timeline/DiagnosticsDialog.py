@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+from PyQt4 import QtGui
+from timeline import metrics
+
+
+class DiagnosticsDialog(QtGui.QDialog):
+    """
+    Shows the database metrics of this process as JSON, to be copied into
+    a bug report or saved to a file.
+    """
+
+    def __init__(self, parent=None):
+        super(DiagnosticsDialog, self).__init__(parent)
+        self.init_ui()
+        self.refresh()
+
+    def init_ui(self):
+        self.text = QtGui.QPlainTextEdit(self)
+        self.text.setReadOnly(True)
+        self.text.setLineWrapMode(QtGui.QPlainTextEdit.NoWrap)
+
+        btn_refresh = QtGui.QPushButton(_("&Refresh"), self)
+        btn_refresh.clicked.connect(self.refresh)
+        btn_reset = QtGui.QPushButton(_("R&eset"), self)
+        btn_reset.clicked.connect(self.on_clicked_btn_reset)
+        btn_save = QtGui.QPushButton(_("&Save..."), self)
+        btn_save.clicked.connect(self.on_clicked_btn_save)
+        btn_close = QtGui.QPushButton(_("&Close"), self)
+        btn_close.clicked.connect(self.accept)
+
+        buttons = QtGui.QHBoxLayout()
+        buttons.addWidget(btn_refresh)
+        buttons.addWidget(btn_reset)
+        buttons.addStretch(1)
+        buttons.addWidget(btn_save)
+        buttons.addWidget(btn_close)
+
+        layout = QtGui.QVBoxLayout()
+        layout.addWidget(self.text)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+
+        self.resize(560, 480)
+        self.setWindowTitle(_("Diagnostics"))
+
+    def get_json(self):
+        return json.dumps(metrics.registry.snapshot(), indent=2,
+                          sort_keys=True)
+
+    def refresh(self):
+        self.text.setPlainText(self.get_json())
+
+    def on_clicked_btn_reset(self):
+        metrics.registry.reset()
+        self.refresh()
+
+    def on_clicked_btn_save(self):
+        filename = QtGui.QFileDialog.getSaveFileName(
+            self,
+            _("Save Diagnostics"),
+            "timeline-metrics.json",
+            _("JSON files (*.json)")
+        )
+        if not filename:
+            return
+
+        try:
+            with open(str(filename), "w") as f:
+                f.write(self.get_json() + "\n")
+        except EnvironmentError as e:
+            QtGui.QMessageBox.critical(
+                self,
+                _("Error"),
+                _("Can't save the file:") + " " + str(e)
+            )
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -8,6 +8,22 @@ import gettext
 from PyQt4 import QtGui, QtCore
 from time import time, strftime
 from timeline.ShowTimesWindow import ShowTimesWindow
+from timeline.StatisticsWindow import StatisticsWindow
+from timeline.storage import TimeStore
+from timeline.journal import SessionJournal
+from timeline.session import SessionTracker
+from timeline import paths
+from timeline.DatabaseWorker import DatabaseWorker
+from timeline.TickScheduler import TickScheduler
+from timeline.projects import ProjectList
+from timeline.ProjectListModel import ProjectListModel
+from timeline.ProjectCompleter import ProjectCompleter
+from timeline.importer import Importer
+from timeline.archive import Archiver
+from timeline.reportcache import ReportCache
+from timeline.report import format_seconds
+from timeline.DiagnosticsDialog import DiagnosticsDialog
+from timeline import metrics
 
 
 class MainWindow(QtGui.QMainWindow):
@@ -17,24 +33,34 @@ class MainWindow(QtGui.QMainWindow):
     ICONS_DIR = "icons/"
 
     # properties
-    running = False
-    time_start = time()
     time_end = time()
-    time_mid = time()
-    qtimer = QtCore.QTimer()
-    db = None
-    db_cur = None
-    current_timer_rowid = 0
-
-    def __init__(self):
+    clock = time
+    ticker = None
+    lcd_text = None
+    store = None
+    tracker = None
+    worker = None
+    import_progress = None
+    delete_progress = None
+    archive_progress = None
+    report_cache = None
+    api = None
+    project_list = None
+    last_project = None
+
+    def __init__(self, clock=time):
         super(MainWindow, self).__init__()
+        # anything reading the time goes through it, see timeline.clock
+        self.clock = clock
+        self.project_list = ProjectList()
+        # report rows, shared by every Show Times window
+        self.report_cache = ReportCache()
+        metrics.registry.add_source("report_cache", self.report_cache.stats)
+        self.ticker = TickScheduler(self, clock=clock)
+        self.ticker.tick.connect(self.update_timer)
         self.init_app()
 
     def init_app(self):
-        dbfile = self.get_db_filename()
-        self.db = sqlite3.connect(dbfile)
-        self.db_cur = self.db.cursor()
-
         if sys.version_info.major < 3:
             gettext.install("Time-Line", "locale", unicode=True,
                             names=['ngettext'])
@@ -45,23 +71,18 @@ class MainWindow(QtGui.QMainWindow):
         self.ICONS_DIR = os.path.dirname(os.path.abspath(sys.argv[0])) + os.sep
         self.ICONS_DIR += "icons" + os.sep
 
-        # init db tables
-        self.db_cur.execute('''
-            PRAGMA encoding="UTF-8";
-        ''')
-
         try:
-            self.db_cur.execute('''
-                CREATE TABLE IF NOT EXISTS test (
-                    name VARCHAR(255)
-                )
-            ''')
-            self.db.commit()
-
-            self.db_cur.execute('''
-                DROP TABLE IF EXISTS test
-            ''')
-            self.db.commit()
+            dbfile = self.get_db_filename()
+            self.store = TimeStore(dbfile)
+            journal = SessionJournal(SessionJournal.filename_for(dbfile))
+            self.tracker = SessionTracker(self.store, journal)
+            # fold a session interrupted by a crash
+            self.tracker.recover()
+            self.project_list.load(self.store.project_rows())
+            self.last_project = self.store.get_setting("last_project")
+            metrics.registry.configure(float(self.store.get_setting(
+                "slow_query_ms", metrics.Metrics.SLOW_MS
+            )))
         except sqlite3.Error as e:
             self.init_ui()
             QtGui.QMessageBox.critical(
@@ -71,36 +92,61 @@ class MainWindow(QtGui.QMainWindow):
             )
             return
 
-        self.db_cur.execute('''
-            CREATE TABLE IF NOT EXISTS times (
-                project_id INTEGER,
-                date_start INTEGER,
-                date_end INTEGER,
-                duration INTEGER
+        self.init_ui()
+        self.resume_state()
+        self.start_api()
+
+        # a deletion interrupted by a crash is finished first
+        if self.store.get_setting(TimeStore.DELETING_PROJECT) is not None:
+            self.start_deletion(
+                lambda store, worker: store.resume_deletion(
+                    worker.report_progress
+                )
             )
-        ''')
-        self.db.commit()
 
-        self.db_cur.execute('''
-            CREATE TABLE IF NOT EXISTS projects (
-                name VARCHAR(255)
-            )
-        ''')
-        self.db.commit()
+    # serve the JSON API to scripts when the api_port setting is set
+    def start_api(self):
+        port = self.store.get_setting("api_port")
+        if not port:
+            return
+
+        try:
+            from timeline.server import ApiServer
+            from timeline.ApiBridge import ApiBridge
+        except (ImportError, SyntaxError):
+            # Python 2
+            return
 
-        self.db_cur.execute('''
-            CREATE TABLE IF NOT EXISTS settings (
-                name VARCHAR(255),
-                value VARCHAR(255)
+        bridge = ApiBridge(self)
+        bridge.changed.connect(self.on_api_changed)
+        self.api = ApiServer(self.store.filename, bridge)
+        try:
+            self.api.start_thread(port=int(port))
+        except EnvironmentError as e:
+            self.api = None
+            QtGui.QMessageBox.warning(
+                self,
+                _("Error"),
+                _("Can't start the API server:") + " " + str(e)
             )
-        ''')
-        self.db.commit()
 
-        self.init_ui()
+    # timers started or stopped, or projects added, through the API
+    def on_api_changed(self):
+        for project in self.store.projects():
+            if self.project_list.index_of(project.id) < 0:
+                self.project_list.add(project.id, project.name)
+        self.update_cbox_state()
+
+        if self.is_running():
+            self.start_ui()
+        else:
+            self.after_stop()
 
     def __del__(self):
-        if hasattr(self, "db"):
-            self.db.close()
+        if self.tracker is not None:
+            self.tracker.journal.close()
+        if self.store is not None:
+            self.store.close()
 
     def init_ui(self):
         # labels
@@ -110,11 +156,18 @@ class MainWindow(QtGui.QMainWindow):
         # edit field
         self.edit_project = QtGui.QLineEdit()
 
-        # combobox
+        # combobox, both windows share the cached projects list
+        self.projects_model = ProjectListModel(self.project_list, None, self)
+        self.projects_model_all = ProjectListModel(
+            self.project_list, _('< All projects >'), self
+        )
         self.cbox_list = QtGui.QComboBox(self)
-        self.cbox_list.setInsertPolicy(QtGui.QComboBox.InsertAlphabetically)
+        self.cbox_list.setInsertPolicy(QtGui.QComboBox.NoInsert)
+        self.cbox_list.setModel(self.projects_model)
         self.cbox_list.setEditable(True)
-        self.cbox_list.setAutoCompletion(True)
+        self.cbox_completer = ProjectCompleter(self.project_list,
+                                               self.cbox_list)
+        self.cbox_completer.chosen.connect(self.on_change_cbox_list)
         self.load_cbox()
 
         cbox_is_empty = self.cbox_list.count() <= 0
@@ -144,7 +197,13 @@ class MainWindow(QtGui.QMainWindow):
         # timer display
         self.lcd_timer = QtGui.QLCDNumber(self)
         self.lcd_timer.setDigitCount(8)
-        self.lcd_timer.display(self.get_time_delta())
+        self.update_lcd()
+
+        # every running timer, double click selects its project
+        self.list_running = QtGui.QListWidget(self)
+        self.list_running.itemDoubleClicked.connect(
+            self.on_dclicked_list_running
+        )
 
         # layout
         grid = QtGui.QGridLayout()
@@ -157,12 +216,33 @@ class MainWindow(QtGui.QMainWindow):
         grid.addWidget(self.btn_del, 1, 2)
         grid.addWidget(self.btn_state, 3, 0, 1, 0)
         grid.addWidget(self.lcd_timer, 2, 0, 1, 0)
+        grid.addWidget(self.list_running, 4, 0, 1, 0)
 
         # menubar
         menuitem_stats = QtGui.QAction(_("Show &Times..."), self)
         menuitem_stats.setShortcut('Ctrl+T')
         menuitem_stats.triggered.connect(self.on_clicked_menuitem_showtimes)
 
+        menuitem_statistics = QtGui.QAction(_("&Statistics..."), self)
+        menuitem_statistics.triggered.connect(
+            self.on_clicked_menuitem_statistics
+        )
+
+        menuitem_import = QtGui.QAction(_("&Import..."), self)
+        menuitem_import.setShortcut('Ctrl+I')
+        menuitem_import.triggered.connect(self.on_clicked_menuitem_import)
+
+        menuitem_archive = QtGui.QAction(_("&Archive Old Records..."), self)
+        menuitem_archive.triggered.connect(self.on_clicked_menuitem_archive)
+
+        menuitem_rebuild = QtGui.QAction(_("&Rebuild Totals"), self)
+        menuitem_rebuild.triggered.connect(self.on_clicked_menuitem_rebuild)
+
+        menuitem_diagnostics = QtGui.QAction(_("&Diagnostics..."), self)
+        menuitem_diagnostics.triggered.connect(
+            self.on_clicked_menuitem_diagnostics
+        )
+
         menuitem_exit = QtGui.QAction(_("&Exit"), self)
         menuitem_exit.setShortcut('Ctrl+Q')
         menuitem_exit.triggered.connect(QtGui.qApp.quit)
@@ -170,14 +250,20 @@ class MainWindow(QtGui.QMainWindow):
         self.menubar = self.menuBar()
         menuitem_file = self.menubar.addMenu(_("&File"))
         menuitem_file.addAction(menuitem_stats)
+        menuitem_file.addAction(menuitem_statistics)
+        menuitem_file.addAction(menuitem_import)
+        menuitem_file.addAction(menuitem_archive)
+        menuitem_file.addAction(menuitem_rebuild)
         menuitem_file.addSeparator()
         menuitem_file.addAction(menuitem_exit)
+        menuitem_help = self.menubar.addMenu(_("&Help"))
+        menuitem_help.addAction(menuitem_diagnostics)
 
         # main window
         q_widget = QtGui.QWidget(self)
         q_widget.setLayout(grid)
         self.setCentralWidget(q_widget)
-        self.setFixedSize(320, 240)
+        self.setFixedSize(320, 360)
         self.setWindowTitle(_("Time-Line"))
         self.setWindowIcon(QtGui.QIcon(self.ICONS_DIR + "timer.png"))
         self.setWindowFlags(QtCore.Qt.WindowStaysOnTopHint)
@@ -192,118 +278,257 @@ class MainWindow(QtGui.QMainWindow):
         window_show_times.setAttribute(QtCore.Qt.WA_DeleteOnClose, True)
         window_show_times.show()
 
+    def on_clicked_menuitem_statistics(self):
+        dialog = StatisticsWindow(self)
+        dialog.setAttribute(QtCore.Qt.WA_DeleteOnClose, True)
+        dialog.show()
+        dialog.refresh()
+
+    def on_clicked_menuitem_diagnostics(self):
+        dialog = DiagnosticsDialog(self)
+        dialog.setAttribute(QtCore.Qt.WA_DeleteOnClose, True)
+        dialog.show()
+
+    # load records exported by other trackers, off the GUI thread
+    def on_clicked_menuitem_import(self):
+        if self.worker is not None:
+            return
+
+        filename = QtGui.QFileDialog.getOpenFileName(
+            self,
+            _("Import"),
+            "",
+            _("Time records (*.csv *.ics);;All files (*)")
+        )
+        if not filename:
+            return
+        filename = self.strip_text(filename)
+
+        self.import_progress = QtGui.QProgressDialog(
+            _("Importing..."), _("Cancel"), 0, 0, self
+        )
+        self.import_progress.setWindowModality(QtCore.Qt.WindowModal)
+
+        def job(store, worker):
+            # KiB, so large files fit the signal's int
+            importer = Importer(store, lambda done, total:
+                                worker.report_progress(done // 1024,
+                                                       total // 1024))
+            return importer.import_file(filename)
+
+        self.worker = DatabaseWorker(self.store.filename, job, self)
+        self.worker.progress.connect(self.on_import_progress)
+        self.worker.done.connect(self.on_imported)
+        self.worker.failed.connect(self.on_import_failed)
+        self.worker.finished.connect(self.on_import_finished)
+        self.import_progress.canceled.connect(self.worker.cancel)
+        self.worker.start()
+        self.import_progress.show()
+
+    def on_import_progress(self, done, total):
+        self.import_progress.setMaximum(total)
+        self.import_progress.setValue(min(done, total))
+
+    def on_imported(self, stats):
+        self.load_cbox(True)
+        self.update_cbox_state()
+        QtGui.QMessageBox.information(
+            self,
+            _("Import"),
+            _("Imported %(imported)d of %(read)d records, skipped "
+              "%(duplicates)d duplicates and %(invalid)d invalid records, "
+              "created %(projects)d projects.") % stats
+        )
+
+    def on_import_failed(self, message):
+        QtGui.QMessageBox.critical(
+            self,
+            _("Error"),
+            _("Import failed:") + " " + message
+        )
+
+    def on_import_finished(self):
+        self.import_progress.reset()
+        self.import_progress = None
+        self.worker = None
+
+    # move old sessions into the archive database, off the GUI thread
+    def on_clicked_menuitem_archive(self):
+        if self.worker is not None:
+            return
+
+        older_than, ok = QtGui.QInputDialog.getInt(
+            self,
+            _("Archive Old Records"),
+            _("Archive sessions older than (days):"),
+            int(self.store.get_setting(Archiver.OLDER_THAN_SETTING,
+                                       Archiver.OLDER_THAN)),
+            1,
+            100000
+        )
+        if not ok:
+            return
+        self.store.set_setting(Archiver.OLDER_THAN_SETTING, older_than)
+
+        self.archive_progress = QtGui.QProgressDialog(
+            _("Archiving..."), None, 0, 0, self
+        )
+        self.archive_progress.setWindowModality(QtCore.Qt.WindowModal)
+
+        self.worker = DatabaseWorker(
+            self.store.filename,
+            lambda store, worker: Archiver(store).archive(older_than),
+            self
+        )
+        self.worker.done.connect(self.on_archived)
+        self.worker.failed.connect(self.on_archive_failed)
+        self.worker.finished.connect(self.on_archive_finished)
+        self.worker.start()
+        self.archive_progress.show()
+
+    def on_archived(self, stats):
+        QtGui.QMessageBox.information(
+            self,
+            _("Archive Old Records"),
+            _("Archived %(sessions)d sessions.") % stats
+        )
+
+    def on_archive_failed(self, message):
+        QtGui.QMessageBox.critical(
+            self,
+            _("Error"),
+            _("Database error:") + " " + message
+        )
+
+    def on_archive_finished(self):
+        self.archive_progress.reset()
+        self.archive_progress = None
+        self.worker = None
+
+    # recompute the daily totals used by reports and the session
+    # statistics from the raw records
+    def on_clicked_menuitem_rebuild(self):
+        try:
+            self.store.rebuild_daily_totals()
+            self.store.rebuild_session_stats()
+        except sqlite3.Error as e:
+            QtGui.QMessageBox.critical(
+                self,
+                _("Error"),
+                _("Database error:") + " " + e.args[0]
+            )
+
     # save selected project into db for next run
     def on_change_cbox_list(self):
         index = self.cbox_list.currentIndex()
+        self.last_project = self.get_id_from_cbox(index)
+        self.store.set_setting("last_project", self.last_project)
+        self.update_state_ui()
 
-        self.db_cur.execute('''
-            SELECT value
-            FROM settings
-            WHERE name = :name COLLATE NOCASE
-            LIMIT 1
-        ''', {"name": "last_project"})
-        result = self.db_fetch_assoc(["rowid"])
-
-        if result:
-            self.db_cur.execute('''
-                UPDATE settings
-                SET value = :value
-                WHERE name = :name
-            ''', {
-                "name": "last_project",
-                "value": self.get_id_from_cbox(index)
-            })
-            self.db.commit()
-        else:
-            self.db_cur.execute('''
-                INSERT INTO settings (
-                    name,
-                    value
-                ) VALUES (:name, :value)
-            ''', {
-                "name": "last_project",
-                "value": int(index)
-            })
-            self.db.commit()
+    def on_dclicked_list_running(self, item):
+        index = self.cbox_list.findData(self.get_item_id(item))
+        if index >= 0:
+            self.cbox_list.setCurrentIndex(index)
+            self.on_change_cbox_list()
 
+    # start or stop the timer of the selected project, others keep running
     def on_clicked_btn_state(self):
-        if not self.running:
-            self.running = True
-            self.btn_state.setIcon(QtGui.QIcon(self.ICONS_DIR + "stop.png"))
-            self.btn_state.setText(_("Stop"))
-            self.btn_state.setToolTip(
-                _("Press button to stop and save the counter.")
-            )
-            self.time_start = time()
-            self.time_end = time()
-            self.time_mid = time()
-            self.qtimer.timeout.connect(self.update_timer)
-            self.qtimer.start(1000)
-            self.btn_state.setChecked(True)
-
-            index = self.cbox_list.currentIndex()
-            times = self.get_times_list()
+        id = self.get_selected_id()
 
+        if id not in self.tracker:
             try:
-                current_timer_rowid = 0
-                self.db_cur.execute('''
-                    INSERT INTO times (
-                        project_id,
-                        date_start,
-                        date_end,
-                        duration
-                    ) VALUES (:p_id, :date_start, :date_end, :duration)
-                ''', {
-                    "p_id": self.get_id_from_cbox(index),
-                    "date_start": times["start"],
-                    "date_end": times["end"],
-                    "duration": times["duration"]
-                })
-                self.db.commit()
-                self.current_timer_rowid = self.db_cur.lastrowid
+                self.tracker.start(id, self.clock())
             except sqlite3.Error as e:
-                self.stop_state(pass_db_update=True)
+                self.tracker.abort(id)
                 QtGui.QMessageBox.critical(
                     self,
                     _("Error"),
                     _("Database error:") + " " + e.args[0]
                 )
+            self.start_ui()
 
         else:
-            self.stop_state()
-
-    def stop_state(self, pass_db_update=False):
-        self.running = False
-        self.btn_state.setIcon(QtGui.QIcon(self.ICONS_DIR + "play.png"))
-        self.btn_state.setText(_("Start"))
-        self.btn_state.setToolTip(_("Press button to start the counter."))
-        self.qtimer.stop()
-        self.btn_state.setChecked(False)
+            self.stop_timer(id)
+
+    def is_running(self):
+        return self.tracker is not None and self.tracker.running
+
+    def start_ui(self):
+        if self.is_running() and not self.ticker.is_active():
+            self.time_end = self.clock()
+            self.ticker.start()
+        self.update_state_ui()
+        self.update_running_list()
+
+    def update_state_ui(self):
+        # the button and display follow the selected project
+        id = self.get_selected_id()
+        if self.tracker is not None and id in self.tracker:
+            self.btn_state.setIcon(QtGui.QIcon(self.ICONS_DIR + "stop.png"))
+            self.btn_state.setText(_("Stop"))
+            self.btn_state.setToolTip(
+                _("Press button to stop and save the counter.")
+            )
+            self.btn_state.setChecked(True)
+        else:
+            self.btn_state.setIcon(QtGui.QIcon(self.ICONS_DIR + "play.png"))
+            self.btn_state.setText(_("Start"))
+            self.btn_state.setToolTip(_("Press button to start the counter."))
+            self.btn_state.setChecked(False)
+        self.update_lcd()
+
+    # take over the timers started from the command line
+    def resume_state(self):
+        if not self.tracker.resume():
+            return
 
-        if pass_db_update:
+        for id, date_start in self.tracker.sessions():
+            if self.project_list.index_of(id) < 0:
+                self.tracker.abort(id)
+        if not self.tracker.running:
             return
 
-        times = self.get_times_list()
+        if self.get_selected_id() not in self.tracker:
+            index = self.cbox_list.findData(self.tracker.project_ids[0])
+            self.cbox_list.setCurrentIndex(index)
+        self.start_ui()
 
+    def stop_timer(self, id):
+        # on an error the timer keeps running, its time stays in the
+        # journal (for recover() should the application close)
         try:
-            self.db_cur.execute('''
-                UPDATE times
-                SET
-                    date_end = :date_end,
-                    duration = :duration
-                WHERE rowid = :id
-            ''', {
-                "date_end": times["end"],
-                "duration": times["duration"],
-                "id": self.current_timer_rowid
-            })
-            self.db.commit()
+            self.tracker.stop(id, self.clock())
         except sqlite3.Error as e:
             QtGui.QMessageBox.critical(
                 self,
                 _("Error"),
                 _("Database error:") + " " + e.args[0]
             )
+        self.after_stop()
+
+    def stop_state(self, pass_db_update=False):
+        # stop every timer
+        if self.tracker is None:
+            return
+
+        if pass_db_update:
+            self.tracker.abort()
+        else:
+            try:
+                self.tracker.stop_all(self.clock())
+            except sqlite3.Error as e:
+                QtGui.QMessageBox.critical(
+                    self,
+                    _("Error"),
+                    _("Database error:") + " " + e.args[0]
+                )
+        self.after_stop()
+
+    def after_stop(self):
+        if not self.is_running():
+            self.ticker.stop()
+        self.update_state_ui()
+        self.update_running_list()
 
     def on_clicked_btn_add(self):
         text = self.edit_project.text()
@@ -317,38 +542,30 @@ class MainWindow(QtGui.QMainWindow):
             )
             return
 
-        index = self.cbox_list.findText(text, QtCore.Qt.MatchFixedString)
+        index = self.project_list.find(text)
         if index >= 0:
             self.cbox_list.setCurrentIndex(index)
         else:
-            # check if item exist in DB
-            self.db_cur.execute('''
-                SELECT rowid
-                FROM projects
-                WHERE name = :name COLLATE NOCASE
-                LIMIT 1
-            ''', {"name": text})
-            result = self.db_fetch_assoc(["rowid"])
-
-            if not len(result):
-                self.db_cur.execute('''
-                    INSERT INTO projects (name)
-                    VALUES (:name)
-                ''', {"name": text})
-                self.db.commit()
-                self.cbox_list.addItem(text, self.db_cur.lastrowid)
-
-            self.load_cbox(True)
-            index = self.cbox_list.findText(text, QtCore.Qt.MatchFixedString)
-            if index >= 0:
-                self.cbox_list.setCurrentIndex(index)
-                self.btn_state.setDisabled(False)
-                self.btn_del.setDisabled(False)
-                self.cbox_list.setDisabled(False)
+            try:
+                id = self.store.add_project(text)
+            except sqlite3.IntegrityError:
+                # added from the command line since the list was loaded
+                id = self.store.find_project(text)
+                text = self.store.project_name(id)
+
+            index = self.project_list.add(id, text)
+            self.cbox_list.setCurrentIndex(index)
+            self.btn_state.setDisabled(False)
+            self.btn_del.setDisabled(False)
+            self.cbox_list.setDisabled(False)
 
         self.edit_project.setText("")
 
     def on_clicked_btn_del(self):
+        # one worker at a time: an import, archive or deletion is running
+        if self.worker is not None:
+            return
+
         item = "<b>" + self.cbox_list.currentText() + "</b>"
         index = self.cbox_list.currentIndex()
         id = self.get_id_from_cbox(index)
@@ -364,21 +581,60 @@ class MainWindow(QtGui.QMainWindow):
             if isOk == QtGui.QMessageBox.No:
                 return
 
-            # remove elements from DB
-            self.db_cur.execute('''
-                DELETE FROM times
-                WHERE project_id = :id
-            ''', {"id": id})
-            self.db.commit()
+            # drop the running session of the deleted project
+            if id in self.tracker:
+                self.tracker.abort(id)
+                self.after_stop()
+
+            self.btn_del.setDisabled(True)
+            self.start_deletion(
+                lambda store, worker: store.delete_project(
+                    id, worker.report_progress
+                )
+            )
+            return
 
-            self.db_cur.execute('''
-                DELETE FROM projects
-                WHERE rowid = :id
-            ''', {"id": id})
-            self.db.commit()
+        self.update_cbox_state()
 
-            self.cbox_list.removeItem(index)
+    # remove elements from DB in batches, off the GUI thread
+    def start_deletion(self, job):
+        self.delete_progress = QtGui.QProgressDialog(
+            _("Deleting records..."), None, 0, 0, self
+        )
+        self.delete_progress.setWindowModality(QtCore.Qt.WindowModal)
+        self.delete_progress.setMinimumDuration(500)
+
+        # the job returns the id of the deleted project
+        self.worker = DatabaseWorker(self.store.filename, job, self)
+        self.worker.progress.connect(self.on_delete_progress)
+        self.worker.done.connect(self.on_deleted)
+        self.worker.failed.connect(self.on_delete_failed)
+        self.worker.finished.connect(self.on_delete_finished)
+        self.worker.start()
+
+    def on_delete_progress(self, done, total):
+        self.delete_progress.setMaximum(total)
+        self.delete_progress.setValue(min(done, total))
+
+    def on_deleted(self, id):
+        if self.project_list.index_of(id) >= 0:
+            self.project_list.remove(id)
+        self.update_cbox_state()
+
+    def on_delete_failed(self, message):
+        self.update_cbox_state()
+        QtGui.QMessageBox.critical(
+            self,
+            _("Error"),
+            _("Database error:") + " " + message
+        )
 
+    def on_delete_finished(self):
+        self.delete_progress.reset()
+        self.delete_progress = None
+        self.worker = None
+
+    def update_cbox_state(self):
         cbox_is_empty = self.cbox_list.count() <= 0
 
         if cbox_is_empty:
@@ -388,29 +644,40 @@ class MainWindow(QtGui.QMainWindow):
         self.btn_del.setDisabled(cbox_is_empty)
         self.cbox_list.setDisabled(cbox_is_empty)
 
-    def update_timer(self):
-        self.time_end = time()
-        self.lcd_timer.display(self.get_time_delta())
+    def update_lcd(self):
+        # redraw only when the shown value changes
+        text = self.get_time_delta()
+        if text != self.lcd_text:
+            self.lcd_text = text
+            self.lcd_timer.display(text)
 
-        if (self.time_end - self.time_mid) < 60:
+    def update_running_list(self):
+        self.list_running.clear()
+        if self.tracker is None:
             return
 
-        self.time_mid = time()
-        times = self.get_times_list()
+        for id, date_start in self.tracker.sessions():
+            item = QtGui.QListWidgetItem(self.list_running)
+            item.setData(QtCore.Qt.UserRole, id)
+        self.update_running_texts()
+
+    def update_running_texts(self):
+        for i, (id, date_start) in enumerate(self.tracker.sessions()):
+            self.list_running.item(i).setText("%s  %s" % (
+                format_seconds(self.time_end - date_start),
+                self.project_list.name_of(id)
+            ))
+
+    def update_timer(self, now=None):
+        self.time_end = now if now is not None else self.clock()
+        self.update_lcd()
+        if not self.isMinimized():
+            self.update_running_texts()
 
         try:
-            self.db_cur.execute('''
-                UPDATE times
-                SET
-                    date_end = :date_end,
-                    duration = :duration
-                WHERE rowid = :id
-            ''', {
-                "date_end": times["end"],
-                "duration": times["duration"],
-                "id": self.current_timer_rowid
-            })
-            self.db.commit()
+            # one journal record for all timers a minute, folded into the
+            # database every flush interval
+            self.tracker.heartbeat(self.time_end)
         except sqlite3.Error as e:
             self.stop_state(pass_db_update=True)
             QtGui.QMessageBox.critical(
@@ -420,52 +687,27 @@ class MainWindow(QtGui.QMainWindow):
             )
 
     def get_time_delta(self):
-        time = int(self.time_end - self.time_start)
-        hours, remainder = divmod(time, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        time = "%02d:%02d:%02d" % (hours, minutes, seconds)
-        return time
-
-    def get_times_list(self):
-        start = int(self.time_start)
-        end = int(self.time_end)
-        duration = int(end - start)
-        return {
-            "start": start,
-            "end": end,
-            "duration": duration
-        }
-
-    def db_fetch_assoc(self, cols):
-        out = []
-
-        for row in self.db_cur.fetchall():
-            data = dict()
-            for i, col in enumerate(row):
-                data[cols[i]] = col
-            out.append(data)
-
-        return out
+        # elapsed time of the selected project, zero when it isn't running
+        id = self.get_selected_id()
+        if self.tracker is None or id not in self.tracker:
+            return format_seconds(0)
+        return format_seconds(self.time_end - self.tracker.date_start(id))
 
     def get_db_filename(self):
-        cfg = QtCore.QSettings(
-            QtCore.QSettings.IniFormat,
-            QtCore.QSettings.UserScope,
-            self.APP_NAME, "application"
-        )
-        dir = QtCore.QFileInfo(cfg.fileName()).absolutePath() + "/"
-        dir = self.strip_text(dir)
+        # same location as QSettings, resolved without Qt (shared with CLI)
+        return paths.get_db_filename()
 
-        if not os.path.exists(dir):
-            os.makedirs(dir)
+    def get_selected_id(self):
+        # None while there is no project
+        if self.cbox_list.count() <= 0:
+            return None
+        return self.get_id_from_cbox(self.cbox_list.currentIndex())
 
-        db = dir + self.DB_NAME
-
-        if not os.path.exists(db):
-            with open(db, 'a'):
-                os.utime(db, None)
-
-        return db
+    def get_item_id(self, item):
+        try:
+            return int(item.data(QtCore.Qt.UserRole).toPyObject())
+        except:
+            return int(item.data(QtCore.Qt.UserRole))
 
     def get_id_from_cbox(self, index, list=None):
         list = list if list is not None else self.cbox_list
@@ -477,35 +719,16 @@ class MainWindow(QtGui.QMainWindow):
         return id
 
     def load_cbox(self, clear_current=False):
+        if self.store is None:
+            return
+
+        # the list is cached, only reload it when asked to
         if clear_current:
-            self.cbox_list.clear()
-
-        # get current projects list
-        self.db_cur.execute('''
-            SELECT
-                rowid AS id,
-                name AS name
-            FROM projects
-            ORDER BY name COLLATE NOCASE ASC
-        ''')
-        self.projects = self.db_fetch_assoc(["id", "name"])
-
-        if hasattr(self, "projects") and len(self.projects) > 0:
-            for cols in self.projects:
-                self.cbox_list.addItem(cols["name"], cols["id"])
+            self.project_list.load(self.store.project_rows())
 
         # get previous selected project, if available
-        self.db_cur.execute('''
-            SELECT value
-            FROM settings
-            WHERE name = :name COLLATE NOCASE
-            LIMIT 1
-        ''', {"name": "last_project"})
-        result = self.db_fetch_assoc(["value"])
-
-        if len(result):
-            id = int(result[0]["value"])
-            index = self.cbox_list.findData(id)
+        if self.last_project is not None:
+            index = self.cbox_list.findData(int(self.last_project))
             self.cbox_list.setCurrentIndex(index)
 
     def strip_text(self, text):
@@ -516,8 +739,31 @@ class MainWindow(QtGui.QMainWindow):
 
         return text
 
+    # tick coarsely while nobody can see the display
+    def changeEvent(self, event):
+        if event.type() == QtCore.QEvent.WindowStateChange:
+            self.ticker.set_coarse(self.isMinimized())
+            if not self.isMinimized() and self.is_running():
+                self.update_timer()
+        super(MainWindow, self).changeEvent(event)
+
+    def hideEvent(self, event):
+        self.ticker.set_coarse(True)
+        super(MainWindow, self).hideEvent(event)
+
+    def showEvent(self, event):
+        self.ticker.set_coarse(self.isMinimized())
+        super(MainWindow, self).showEvent(event)
+
     def closeEvent(self, event):
-        if self.running:
+        if self.api is not None:
+            self.api.stop_thread()
+            self.api = None
+
+        if self.is_running():
             self.stop_state()
 
+        if self.worker is not None:
+            self.worker.wait()
+
 # vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
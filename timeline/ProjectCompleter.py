@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from PyQt4 import QtGui, QtCore
+
+
+class ProjectCompleter(QtGui.QCompleter):
+    """
+    Completer for an editable project combo box backed by a ProjectList.
+
+    Every keystroke asks the list's search index for the best ``limit``
+    matches (prefix first, then fuzzy) instead of letting Qt filter the
+    whole model. Picking a match selects its row in the combo box and
+    emits ``chosen`` with the row.
+    """
+    LIMIT = 10
+
+    chosen = QtCore.pyqtSignal(int)
+
+    def __init__(self, projects, combo, limit=LIMIT):
+        super(ProjectCompleter, self).__init__(combo)
+        self.projects = projects
+        self.combo = combo
+        self.limit = limit
+
+        self.matches = QtGui.QStringListModel(self)
+        self.setModel(self.matches)
+        self.setCompletionMode(QtGui.QCompleter.UnfilteredPopupCompletion)
+        self.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
+
+        combo.setCompleter(self)
+        combo.lineEdit().textEdited.connect(self.on_text_edited)
+        self.activated[str].connect(self.on_activated)
+
+    def on_text_edited(self, text):
+        text = self.strip_text(text)
+        if not text:
+            self.matches.setStringList([])
+            self.popup().hide()
+            return
+
+        names = [name for id, name in self.projects.search(text, self.limit)]
+        self.matches.setStringList(names)
+        if names:
+            self.complete()
+        else:
+            self.popup().hide()
+
+    def on_activated(self, text):
+        index = self.projects.find(self.strip_text(text))
+        if index < 0:
+            return
+
+        # rows after the "all projects" one, if the model has it
+        row = index + getattr(self.combo.model(), "offset", 0)
+        self.combo.setCurrentIndex(row)
+        self.chosen.emit(row)
+
+    def strip_text(self, text):
+        try:
+            text = unicode(text).strip()
+        except Exception:
+            text = text.strip()
+
+        return text
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
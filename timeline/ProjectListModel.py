@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from PyQt4 import QtCore
+
+
+class ProjectListModel(QtCore.QAbstractListModel):
+    """
+    Qt view of a shared ProjectList. The project id is stored under
+    Qt.UserRole, like QComboBox.addItem(name, id) did. With ``all_label``
+    an extra "all projects" row with id 0 is shown first.
+    """
+
+    def __init__(self, projects, all_label=None, parent=None):
+        super(ProjectListModel, self).__init__(parent)
+        self.projects = projects
+        self.all_label = all_label
+        self.offset = 1 if all_label is not None else 0
+        projects.add_listener(self)
+
+    def detach(self):
+        self.projects.remove_listener(self)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.projects) + self.offset
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row = index.row() - self.offset
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return self.all_label if row < 0 else self.projects.names[row]
+        if role == QtCore.Qt.UserRole:
+            return 0 if row < 0 else self.projects.ids[row]
+        return None
+
+    # ProjectList listener
+
+    def projects_resetting(self):
+        self.beginResetModel()
+
+    def projects_reset(self):
+        self.endResetModel()
+
+    def project_inserting(self, index):
+        row = index + self.offset
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+
+    def project_inserted(self, index):
+        self.endInsertRows()
+
+    def project_removing(self, index):
+        row = index + self.offset
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+
+    def project_removed(self, index):
+        self.endRemoveRows()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -1,11 +1,64 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import datetime
 from PyQt4 import QtGui, QtCore
+from timeline import aggregate
+from timeline import report
+from timeline.DatabaseWorker import DatabaseWorker, SignalStream
+from timeline.ProjectCompleter import ProjectCompleter
+
+
+class PlainTextStream(object):
+    """
+    File-like adapter that appends to a QPlainTextEdit in chunks instead of
+    building the whole text first.
+    """
+    CHUNK_SIZE = 16384
+
+    def __init__(self, widget):
+        self.widget = widget
+        self.buffer = []
+        self.size = 0
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= self.CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        self.widget.moveCursor(QtGui.QTextCursor.End)
+        self.widget.insertPlainText("".join(self.buffer))
+        self.buffer = []
+        self.size = 0
+
+
+def add_live(rows, live):
+    # report rows (one per period) plus the {label: seconds} of running
+    # time not in the database yet
+    if not live:
+        return rows
+    return [(label, name, seconds + live.get(label, 0))
+            for label, name, seconds in rows]
 
 
 class ShowTimesWindow(QtGui.QMainWindow):
+    worker = None
+    # cache key of the report on screen and of the one being computed
+    shown_key = None
+    pending_key = None
+    pending_generation = None
+    # time zone name of the report on screen, None for UTC
+    shown_zone = None
+    pending_zone = None
+    # running time added to the cached rows of those reports
+    shown_live = None
+    pending_live = None
+    TIMEZONE_SETTING = "report_timezone"
+
     def __init__(self, parent=None):
         self.parent = parent
         super(ShowTimesWindow, self).__init__(parent)
@@ -15,17 +68,18 @@ class ShowTimesWindow(QtGui.QMainWindow):
         self.reset_ui()
 
     def init_ui(self):
-        self.db_cur = self.parent.db_cur
-        self.db_fetch_assoc = self.parent.db_fetch_assoc
+        self.store = self.parent.store
 
         self.setWindowTitle(_("Show Times"))
 
         # project line
         label_project = QtGui.QLabel(_("Project"))
         self.cbox_list = QtGui.QComboBox(self)
-        self.cbox_list.setInsertPolicy(QtGui.QComboBox.InsertAlphabetically)
+        self.cbox_list.setInsertPolicy(QtGui.QComboBox.NoInsert)
+        self.cbox_list.setModel(self.parent.projects_model_all)
         self.cbox_list.setEditable(True)
-        self.cbox_list.setAutoCompletion(True)
+        self.cbox_completer = ProjectCompleter(self.parent.project_list,
+                                               self.cbox_list)
         self.load_cbox()
 
         # dates range line
@@ -41,6 +95,22 @@ class ShowTimesWindow(QtGui.QMainWindow):
         self.date_to.setCalendarPopup(True)
         self.date_to.setDateTime(range["end"])
 
+        # periods line
+        label_granularity = QtGui.QLabel(_("Group by"))
+        self.cbox_granularity = QtGui.QComboBox(self)
+        # in the order of aggregate.GRANULARITIES
+        self.cbox_granularity.addItems([
+            _("Day"), _("Week"), _("Month"), _("Quarter"), _("Year")
+        ])
+        label_zone = QtGui.QLabel(_("Time zone"))
+        self.cbox_zone = QtGui.QComboBox(self)
+        self.cbox_zone.setEditable(True)
+        self.cbox_zone.setInsertPolicy(QtGui.QComboBox.NoInsert)
+        self.cbox_zone.addItem("UTC")
+        self.cbox_zone.addItems(
+            [name for name in aggregate.timezone_names() if name != "UTC"]
+        )
+
         # third & fourth line
         label_options = QtGui.QLabel(_("Options"))
         self.cb_show_each_day = QtGui.QCheckBox(
@@ -50,6 +120,7 @@ class ShowTimesWindow(QtGui.QMainWindow):
         self.cb_show_each_day.clicked.connect(self.on_clicked_cb_show_each_day)
         self.cb_pass_empty = QtGui.QCheckBox(_("Show non-working days"))
         self.cb_pass_empty.setChecked(True)
+        self.cb_pass_empty.clicked.connect(self.render_cached)
 
         # fifth line
         font = QtGui.QFont("Monospace")
@@ -67,6 +138,9 @@ class ShowTimesWindow(QtGui.QMainWindow):
         self.btn_close = QtGui.QPushButton(_("&Close"))
         self.btn_close.setMinimumSize(0, 25)
         self.btn_close.clicked.connect(self.on_clicked_btn_close)
+        self.progress = QtGui.QProgressBar()
+        self.progress.setTextVisible(False)
+        self.progress.hide()
 
         # layout
         grid_date_range = QtGui.QGridLayout()
@@ -84,12 +158,17 @@ class ShowTimesWindow(QtGui.QMainWindow):
         grid.addWidget(label_date_range_to, 1, 2, QtCore.Qt.AlignCenter)
         grid.addWidget(self.date_from, 1, 1)
         grid.addWidget(self.date_to, 1, 3)
-        grid.addWidget(label_options, 2, 0)
-        grid.addWidget(self.cb_show_each_day, 2, 1, 1, 3)
-        grid.addWidget(self.cb_pass_empty, 3, 1, 1, 3)
-        grid.addWidget(self.btn_show_result, 4, 1, 1, 1)
-        grid.addWidget(self.btn_close, 4, 3)
-        grid.addWidget(self.output, 5, 0, 1, 4)
+        grid.addWidget(label_granularity, 2, 0)
+        grid.addWidget(self.cbox_granularity, 2, 1)
+        grid.addWidget(label_zone, 2, 2, QtCore.Qt.AlignCenter)
+        grid.addWidget(self.cbox_zone, 2, 3)
+        grid.addWidget(label_options, 3, 0)
+        grid.addWidget(self.cb_show_each_day, 3, 1, 1, 3)
+        grid.addWidget(self.cb_pass_empty, 4, 1, 1, 3)
+        grid.addWidget(self.btn_show_result, 5, 1, 1, 1)
+        grid.addWidget(self.progress, 5, 2)
+        grid.addWidget(self.btn_close, 5, 3)
+        grid.addWidget(self.output, 6, 0, 1, 4)
 
         q_widget = QtGui.QWidget(self)
         q_widget.setLayout(grid)
@@ -99,12 +178,17 @@ class ShowTimesWindow(QtGui.QMainWindow):
         range = self.get_default_date_range()
         self.date_from.setDateTime(range["start"])
         self.date_to.setDateTime(range["end"])
-        self.load_cbox(True)
+        self.load_cbox()
+        self.cbox_granularity.setCurrentIndex(0)
+        self.cbox_zone.setEditText(
+            self.store.get_setting(self.TIMEZONE_SETTING, "UTC")
+        )
         self.cb_show_each_day.setChecked(True)
         self.cb_pass_empty.setChecked(True)
         self.cb_pass_empty.setEnabled(True)
         self.output.setPlainText("")
         self.output.show()
+        self.shown_key = None
 
     def get_default_date_range(self):
         end = QtCore.QDateTime.currentDateTime()
@@ -121,103 +205,208 @@ class ShowTimesWindow(QtGui.QMainWindow):
     def on_clicked_cb_show_each_day(self):
         checked = self.cb_show_each_day.isChecked()
         self.cb_pass_empty.setEnabled(True if checked else False)
+        self.render_cached()
+
+    def get_writer(self, zone=None):
+        return report.TextWriter(
+            self.cb_show_each_day.isChecked(),
+            self.cb_pass_empty.isChecked(),
+            {
+                "none": _("none"),
+                "total": _("Total time:"),
+                "utc": _("Dates are in UTC"),
+                "zone": _("Dates are in %s")
+            },
+            zone
+        )
+
+    def get_timezone(self):
+        # (tzinfo, name) of the chosen zone, (None, None) for UTC; raises
+        # ValueError for unknown names
+        name = str(self.cbox_zone.currentText()).strip()
+        if name in ("", "UTC"):
+            return None, None
+        return aggregate.get_timezone(name), name
+
+    def render(self, rows, zone):
+        self.output.setPlainText("")
+        self.output.show()
+        stream = PlainTextStream(self.output)
+        self.get_writer(zone).write(rows, stream)
+        stream.flush()
+
+    def render_cached(self):
+        # display options only change the text: re-render the report on
+        # screen from the cache, without asking the database
+        if self.shown_key is None or self.worker is not None:
+            return
+
+        rows = self.parent.report_cache.get(self.shown_key)
+        if rows is not None:
+            self.render(add_live(rows, self.shown_live), self.shown_zone)
+
+    def live_totals(self, project_id, edges, granularity, tz):
+        """
+        {period label: seconds} of the running time the database doesn't
+        hold yet. It is added to the report rather than flushed first: a
+        flush bumps the write generation, so the cache would never serve
+        a report while a timer runs.
+        """
+        tracker = self.parent.tracker
+        if tracker is None or not tracker.running:
+            return None
+
+        parts = [part for part in tracker.unsaved()
+                 if project_id <= 0 or part[0] == project_id]
+        if not parts:
+            return None
+
+        totals = aggregate.split_intervals([part[1] for part in parts],
+                                           [part[2] for part in parts],
+                                           edges)
+        labels = aggregate.bucket_labels(edges, granularity, tz)
+        live = {}
+        for label, seconds in zip(labels, totals):
+            if seconds:
+                live[label] = live.get(label, 0) + seconds
+        return live
 
     def on_clicked_btn_close(self):
         self.close()
 
+    def closeEvent(self, event):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker.wait()
+
     def on_clicked_btn_show_result(self):
-        output = ""
+        # the button doubles as "Cancel" while a report is running
+        if self.worker is not None:
+            self.worker.cancel()
+            return
+
+        try:
+            tz, zone = self.get_timezone()
+        except ValueError as e:
+            QtGui.QMessageBox.critical(self, _("Error"), e.args[0])
+            return
+        if (zone or "UTC") != self.store.get_setting(self.TIMEZONE_SETTING,
+                                                     "UTC"):
+            self.store.set_setting(self.TIMEZONE_SETTING, zone or "UTC")
+
         index = int(self.cbox_list.currentIndex())
         project_id = self.parent.get_id_from_cbox(index, self.cbox_list)
-        date_from = self.date_from.dateTime().toTime_t()
-        date_to = self.date_to.dateTime().toTime_t()
-        show_days = self.cb_show_each_day.isChecked()
-        pass_empty_days = self.cb_pass_empty.isChecked()
-
-        self.db_cur.execute('''
-            SELECT
-                STRFTIME("%Y-%m-%d", date_start, "unixepoch") AS date,
-                SUM(duration) AS duration
-            FROM times
-            WHERE
-                (:project_id <= 0 OR project_id = :project_id)
-                AND date_start <= :date_to
-                AND date_end >= :date_from
-            GROUP BY date
-            ORDER BY date_start
-        ''', {
-            "project_id": project_id,
-            "date_from": date_from,
-            "date_to": date_to
-        })
-        result = self.db_fetch_assoc(["date", "duration"])
-        if result is None:
+        granularity = aggregate.GRANULARITIES[
+            self.cbox_granularity.currentIndex()
+        ]
+        # the picked dates and times are wall times in the zone
+        date_from = aggregate.wall_timestamp(
+            self.date_from.dateTime().toTime_t(), tz
+        )
+        date_to = aggregate.wall_timestamp(
+            self.date_to.dateTime().toTime_t(), tz
+        )
+        key = (project_id, date_from, date_to,
+               granularity + ("@" + zone if zone else ""))
+
+        edges = aggregate.bucket_boundaries(date_from, date_to + 1,
+                                            granularity, tz)
+        live = self.live_totals(project_id, edges, granularity, tz)
+
+        # unchanged database and parameters: nothing to compute
+        cache = self.parent.report_cache
+        generation = self.store.write_generation()
+        cache.validate(generation)
+        rows = cache.get(key)
+        if rows is not None:
+            self.render(add_live(rows, live), zone)
+            self.shown_key = key
+            self.shown_zone = zone
+            self.shown_live = live
             return
 
-        total = 0
-        dates = {}
-        for time in result:
-            total += (time['duration'])
-            if not show_days:
-                continue
-            dates[str(time["date"])] = self.secondsToTime(time["duration"])
-
-        if pass_empty_days and show_days:
-            for x in range(date_from, date_to, 86400):
-                key = datetime.datetime.fromtimestamp(x).strftime('%Y-%m-%d')
-                key = str(key)
-                if key in dates:
-                    output += str(key) + ": " + str(dates[key]) + "\n"
-                else:
-                    output += str(key) + ": " + _("none") + "\n"
-            output += "-" * 36 + "\n"
-        elif show_days:
-            for x in sorted(dates):
-                output += str(x) + ": " + str(dates[x]) + "\n"
-            output += "-" * 36 + "\n"
-
-        output += _("Total time:") + " " + self.secondsToTime(total) + "\n\n"
-        output += _("Dates are in UTC") + "\n"
-        self.output.setPlainText(output)
+        writer = self.get_writer(zone)
+        periods = len(edges) - 1
+
+        def job(store, worker):
+            result = []
+            # a flush since the click already wrote the running time
+            extra = live if store.write_generation() == generation else None
+
+            def rows():
+                last = None
+                done = 0
+                for row in store.iter_report(project_id, date_from, date_to,
+                                             False, tz, granularity):
+                    if row[0] != last:
+                        last = row[0]
+                        done += 1
+                        if done % 32 == 0:
+                            worker.report_progress(done, periods)
+                    result.append(row)
+                    if extra:
+                        row = (row[0], row[1], row[2] + extra.get(row[0], 0))
+                    yield row
+
+            stream = SignalStream(worker)
+            writer.write(rows(), stream)
+            stream.flush()
+            return result
+
+        self.output.setPlainText("")
         self.output.show()
+        self.stream = PlainTextStream(self.output)
+        self.shown_key = None
+        self.pending_key = key
+        self.pending_zone = zone
+        self.pending_live = live
+        self.pending_generation = generation
+
+        self.worker = DatabaseWorker(self.store.filename, job, self)
+        self.worker.chunk.connect(self.stream.write)
+        self.worker.progress.connect(self.on_worker_progress)
+        self.worker.done.connect(self.on_report_done)
+        self.worker.failed.connect(self.on_report_failed)
+        self.worker.cancelled.connect(self.on_report_cancelled)
+        self.worker.finished.connect(self.on_worker_finished)
+
+        self.btn_show_result.setText(_("&Cancel"))
+        self.progress.setRange(0, 0)
+        self.progress.show()
+        self.worker.start()
+
+    def on_worker_progress(self, done, total):
+        self.progress.setRange(0, total)
+        self.progress.setValue(done)
+
+    def on_report_done(self, result):
+        self.stream.flush()
+        self.parent.report_cache.put(self.pending_key, result,
+                                     self.pending_generation)
+        self.shown_key = self.pending_key
+        self.shown_zone = self.pending_zone
+        self.shown_live = self.pending_live
+
+    def on_report_failed(self, message):
+        self.stream.flush()
+        QtGui.QMessageBox.critical(
+            self,
+            _("Error"),
+            _("Database error:") + " " + message
+        )
+
+    def on_report_cancelled(self):
+        self.stream.flush()
+
+    def on_worker_finished(self):
+        self.worker = None
+        self.progress.hide()
+        self.btn_show_result.setText(_("&Show Result"))
 
-    def secondsToTime(self, seconds=0):
-        minutes, seconds = divmod(seconds, 60)
-        hours, minutes = divmod(minutes, 60)
-        return "%02d:%02d:%02d" % (hours, minutes, seconds)
-
-    def load_cbox(self, clear_current=False):
-        if clear_current:
-            self.cbox_list.clear()
-
-        # get current projects list
-        self.db_cur.execute('''
-            SELECT
-                rowid AS id,
-                name AS name
-            FROM projects
-            ORDER BY name COLLATE NOCASE ASC
-        ''')
-        self.projects = self.db_fetch_assoc(["id", "name"])
-
-        if hasattr(self, "projects") and len(self.projects) > 0:
-            for cols in self.projects:
-                self.cbox_list.addItem(cols["name"], cols["id"])
-
-        self.cbox_list.insertItem(0, _('< All projects >'), 0)
-
-        # get previous selected project, if available
-        self.db_cur.execute('''
-            SELECT value
-            FROM settings
-            WHERE name = :name COLLATE NOCASE
-            LIMIT 1
-        ''', {"name": "last_project"})
-        result = self.db_fetch_assoc(["value"])
-
-        if len(result):
-            id = int(result[0]["value"])
-            index = self.cbox_list.findData(id)
-            self.cbox_list.setCurrentIndex(index)
+    def load_cbox(self):
+        # the model is shared with the main window, only pick the project
+        id = self.parent.last_project
+        index = self.cbox_list.findData(int(id)) if id is not None else 0
+        self.cbox_list.setCurrentIndex(max(index, 0))
 
 # vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sqlite3
+from PyQt4 import QtGui, QtCore
+from timeline.report import format_seconds
+from timeline.stats import merge_sketches, heatmap_rows
+from timeline.ProjectCompleter import ProjectCompleter
+
+
+class StatisticsWindow(QtGui.QDialog):
+    """
+    Session counts, lengths, streaks and the busy hours of the week, per
+    project, from the per-month statistics kept by TimeStore. Cheap enough
+    to compute on the GUI thread whatever the range.
+    """
+    COLUMNS = ("sessions", "seconds", "mean", "median", "p90", "p99",
+               "longest")
+
+    def __init__(self, parent=None):
+        super(StatisticsWindow, self).__init__(parent)
+        self.parent = parent
+        self.store = parent.store
+        self.init_ui()
+
+    def init_ui(self):
+        label_project = QtGui.QLabel(_("Project"))
+        self.cbox_list = QtGui.QComboBox(self)
+        self.cbox_list.setInsertPolicy(QtGui.QComboBox.NoInsert)
+        self.cbox_list.setModel(self.parent.projects_model_all)
+        self.cbox_list.setEditable(True)
+        self.cbox_completer = ProjectCompleter(self.parent.project_list,
+                                               self.cbox_list)
+        self.cbox_list.setCurrentIndex(0)
+
+        # whole UTC months
+        label_range = QtGui.QLabel(_("Months"))
+        label_range_to = QtGui.QLabel(_("To"))
+        today = QtCore.QDate.currentDate()
+        self.date_from = QtGui.QDateEdit(
+            QtCore.QDate(today.year(), today.month(), 1).addMonths(-11)
+        )
+        self.date_from.setDisplayFormat("yyyy-MM")
+        self.date_from.setCalendarPopup(True)
+        self.date_to = QtGui.QDateEdit(today)
+        self.date_to.setDisplayFormat("yyyy-MM")
+        self.date_to.setCalendarPopup(True)
+
+        self.table = QtGui.QTableWidget(0, len(self.COLUMNS) + 2, self)
+        self.table.setHorizontalHeaderLabels([
+            _("Project"), _("Sessions"), _("Total"), _("Mean"), _("Median"),
+            _("P90"), _("P99"), _("Longest"), _("Streak (days)")
+        ])
+        self.table.verticalHeader().hide()
+        self.table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionMode(QtGui.QAbstractItemView.NoSelection)
+
+        self.heatmap = QtGui.QTableWidget(7, 24, self)
+        self.heatmap.setVerticalHeaderLabels([
+            _("Mon"), _("Tue"), _("Wed"), _("Thu"), _("Fri"), _("Sat"),
+            _("Sun")
+        ])
+        self.heatmap.setHorizontalHeaderLabels(
+            [str(hour) for hour in range(24)]
+        )
+        self.heatmap.horizontalHeader().setDefaultSectionSize(22)
+        self.heatmap.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.heatmap.setSelectionMode(QtGui.QAbstractItemView.NoSelection)
+
+        label_note = QtGui.QLabel(
+            _("Sessions count in the UTC month they started, "
+              "hours are in UTC")
+        )
+
+        btn_show = QtGui.QPushButton(_("&Show Result"), self)
+        btn_show.clicked.connect(self.refresh)
+        btn_close = QtGui.QPushButton(_("&Close"), self)
+        btn_close.clicked.connect(self.accept)
+
+        grid = QtGui.QGridLayout()
+        grid.setSpacing(15)
+        grid.addWidget(label_project, 0, 0)
+        grid.addWidget(self.cbox_list, 0, 1, 1, 3)
+        grid.addWidget(label_range, 1, 0)
+        grid.addWidget(self.date_from, 1, 1)
+        grid.addWidget(label_range_to, 1, 2, QtCore.Qt.AlignCenter)
+        grid.addWidget(self.date_to, 1, 3)
+        grid.addWidget(self.table, 2, 0, 1, 4)
+        grid.addWidget(self.heatmap, 3, 0, 1, 4)
+        grid.addWidget(label_note, 4, 0, 1, 4)
+        grid.addWidget(btn_show, 5, 1)
+        grid.addWidget(btn_close, 5, 3)
+        self.setLayout(grid)
+
+        self.resize(760, 560)
+        self.setWindowTitle(_("Statistics"))
+
+    def get_range(self):
+        # [from, to] in seconds, first day of the first month to the last
+        # second of the last one
+        start = QtCore.QDateTime(self.date_from.date(), QtCore.QTime(0, 0),
+                                 QtCore.Qt.UTC)
+        end = self.date_to.date()
+        end = QtCore.QDateTime(QtCore.QDate(end.year(), end.month(), 1),
+                               QtCore.QTime(0, 0), QtCore.Qt.UTC)
+        return start.toTime_t(), end.addMonths(1).toTime_t() - 1
+
+    def refresh(self):
+        index = int(self.cbox_list.currentIndex())
+        project_id = self.parent.get_id_from_cbox(index, self.cbox_list)
+        date_from, date_to = self.get_range()
+
+        try:
+            sketches = self.store.session_stats(project_id, date_from,
+                                                date_to)
+        except sqlite3.Error as e:
+            QtGui.QMessageBox.critical(
+                self,
+                _("Error"),
+                _("Database error:") + " " + e.args[0]
+            )
+            return
+
+        total = merge_sketches(sketches.values())
+        rows = [(name, sketches[name])
+                for name in sorted(sketches, key=lambda x: x.lower())]
+        rows.append((_("< All projects >"), total))
+
+        self.table.setRowCount(len(rows))
+        for row, (name, sketch) in enumerate(rows):
+            summary = sketch.summary()
+            cells = [name, str(summary["sessions"])]
+            cells.extend(format_seconds(summary[column])
+                         for column in self.COLUMNS[1:])
+            cells.append(str(summary["streak_days"]))
+            for column, text in enumerate(cells):
+                item = QtGui.QTableWidgetItem(text)
+                if column:
+                    item.setTextAlignment(QtCore.Qt.AlignRight |
+                                          QtCore.Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+        self.table.resizeColumnsToContents()
+
+        self.show_heatmap(heatmap_rows(total.heatmap))
+
+    def show_heatmap(self, rows):
+        top = max(max(row) for row in rows) or 1
+        base = self.palette().color(QtGui.QPalette.Base)
+        busy = self.palette().color(QtGui.QPalette.Highlight)
+
+        for weekday, row in enumerate(rows):
+            for hour, seconds in enumerate(row):
+                share = float(seconds) / top
+                color = QtGui.QColor(
+                    int(base.red() + (busy.red() - base.red()) * share),
+                    int(base.green() + (busy.green() - base.green()) * share),
+                    int(base.blue() + (busy.blue() - base.blue()) * share)
+                )
+                item = QtGui.QTableWidgetItem()
+                item.setBackground(QtGui.QBrush(color))
+                item.setToolTip(format_seconds(seconds))
+                self.heatmap.setItem(weekday, hour, item)
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from time import time
+from PyQt4 import QtCore
+from timeline import clock
+
+
+class TickScheduler(QtCore.QObject):
+    """
+    Emits ``tick`` on wall-clock second boundaries while started.
+
+    Owns a single-shot QTimer that is connected exactly once and re-armed
+    after every tick, so start/stop cycles never stack connections and the
+    ticks don't drift. In coarse mode (window hidden or minimised) the
+    ticks are spaced out to COARSE_INTERVAL.
+    """
+    FINE_INTERVAL = clock.FINE_INTERVAL
+    COARSE_INTERVAL = clock.COARSE_INTERVAL
+    # fire just after the boundary, so the clock already reads the new second
+    SLACK = 5
+
+    tick = QtCore.pyqtSignal(float)
+
+    def __init__(self, parent=None, clock=time):
+        super(TickScheduler, self).__init__(parent)
+        self.clock = clock
+        self.interval = self.FINE_INTERVAL
+        self.active = False
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.on_timeout)
+
+    def start(self):
+        self.active = True
+        self.schedule()
+
+    def stop(self):
+        self.active = False
+        self.timer.stop()
+
+    def is_active(self):
+        return self.active
+
+    def set_coarse(self, coarse):
+        interval = self.COARSE_INTERVAL if coarse else self.FINE_INTERVAL
+        if interval == self.interval:
+            return
+
+        self.interval = interval
+        if self.active:
+            self.schedule()
+
+    def schedule(self):
+        now = int(self.clock() * 1000)
+        self.timer.start(self.interval - now % self.interval + self.SLACK)
+
+    def on_timeout(self):
+        if not self.active:
+            return
+
+        self.schedule()
+        self.tick.emit(self.clock())
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,10 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+from timeline.cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
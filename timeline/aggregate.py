@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Aggregation engine: clips sessions to a report window and splits them at
+the boundaries of days, ISO weeks, months, quarters or years in a time
+zone.
+
+Intervals are handled as whole arrays. With NumPy available every step of
+a large split is vectorised; without it (and for small inputs) the same
+algorithm runs over ``array`` buffers. NumPy is only imported on first use,
+so importing this module stays cheap for the command line.
+"""
+
+import calendar
+import datetime
+from array import array
+from bisect import bisect_left, bisect_right
+
+numpy = None
+
+try:
+    # array typecode of the 64-bit columns
+    INT64 = array("q").typecode
+except ValueError:
+    # Python 2 has no "q"; its "l" is 64 bits wide on Linux and OS X
+    INT64 = "l"
+
+DAY = 86400
+EPOCH = datetime.datetime(1970, 1, 1)
+
+GRANULARITIES = ("day", "week", "month", "quarter", "year")
+
+# below this many intervals the pure Python path is faster than NumPy's
+# per-call overhead
+NUMPY_MIN_SIZE = 4096
+
+
+def get_numpy():
+    global numpy
+    if numpy is None:
+        try:
+            import numpy as module
+        except ImportError:
+            module = False
+        numpy = module
+    return numpy
+
+
+def to_timestamp(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+
+def get_timezone(name):
+    """
+    tzinfo for an IANA zone name, from zoneinfo (Python 3.9+) or pytz.
+    Raises ValueError for unknown names or when neither is available.
+    """
+    try:
+        from zoneinfo import ZoneInfo
+    except ImportError:
+        ZoneInfo = None
+
+    if ZoneInfo is not None:
+        try:
+            return ZoneInfo(name)
+        except (KeyError, ValueError):
+            raise ValueError("unknown time zone: %s" % name)
+
+    try:
+        import pytz
+    except ImportError:
+        raise ValueError("time zones need zoneinfo or pytz")
+    try:
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        raise ValueError("unknown time zone: %s" % name)
+
+
+def local_timestamp(naive, tz=None):
+    # UTC timestamp of the naive datetime ``naive`` in ``tz`` (None means UTC)
+    if tz is None:
+        return calendar.timegm(naive.timetuple())
+    if hasattr(tz, "localize"):
+        # pytz zones
+        return to_timestamp(tz.localize(naive))
+    return to_timestamp(naive.replace(tzinfo=tz))
+
+
+def timezone_name(tz):
+    # IANA name of a tzinfo from get_timezone, "UTC" for None
+    if tz is None:
+        return "UTC"
+    return getattr(tz, "key", None) or getattr(tz, "zone", None) or str(tz)
+
+
+def timezone_names():
+    # every known IANA zone name, sorted; empty without zoneinfo or pytz
+    try:
+        from zoneinfo import available_timezones
+        return sorted(available_timezones())
+    except ImportError:
+        pass
+    try:
+        import pytz
+        return list(pytz.all_timezones)
+    except ImportError:
+        return []
+
+
+def local_midnight(date, tz=None):
+    # UTC timestamp of 00:00 on ``date`` in ``tz``
+    return local_timestamp(datetime.datetime(date.year, date.month, date.day),
+                           tz)
+
+
+def local_date(timestamp, tz=None):
+    if tz is None:
+        return (EPOCH + datetime.timedelta(seconds=timestamp)).date()
+    return datetime.datetime.fromtimestamp(timestamp, tz).date()
+
+
+def wall_timestamp(timestamp, tz=None):
+    # the wall time ``timestamp`` reads as in UTC, taken in ``tz`` instead
+    if tz is None:
+        return int(timestamp)
+    return local_timestamp(EPOCH + datetime.timedelta(seconds=timestamp), tz)
+
+
+def period_start(date, granularity):
+    # first day of the period holding ``date``; weeks start on Monday
+    if granularity == "day":
+        return date
+    if granularity == "week":
+        return date - datetime.timedelta(days=date.weekday())
+    if granularity == "month":
+        return date.replace(day=1)
+    if granularity == "quarter":
+        return date.replace(month=(date.month - 1) // 3 * 3 + 1, day=1)
+    if granularity == "year":
+        return date.replace(month=1, day=1)
+    raise ValueError("unknown granularity: %s" % granularity)
+
+
+def next_period(date, granularity):
+    # first day of the period after the one starting on ``date``
+    if granularity == "day":
+        return date + datetime.timedelta(days=1)
+    if granularity == "week":
+        return date + datetime.timedelta(days=7)
+
+    months = {"month": 1, "quarter": 3, "year": 12}[granularity]
+    year, month = divmod(date.month - 1 + months, 12)
+    return date.replace(year=date.year + year, month=month + 1, day=1)
+
+
+def period_label(date, granularity):
+    if granularity == "week":
+        year, week, weekday = date.isocalendar()
+        return "%04d-W%02d" % (year, week)
+    if granularity == "month":
+        return "%04d-%02d" % (date.year, date.month)
+    if granularity == "quarter":
+        return "%04d-Q%d" % (date.year, (date.month - 1) // 3 + 1)
+    if granularity == "year":
+        return "%04d" % date.year
+    return "%04d-%02d-%02d" % (date.year, date.month, date.day)
+
+
+def bucket_boundaries(date_from, date_to, granularity="day", tz=None):
+    """
+    Bucket edges for the window [date_from, date_to): the window start, the
+    local midnight starting every period inside it and the window end.
+    Bucket ``i`` is [edges[i], edges[i + 1]) and belongs to the period of
+    ``edges[i]``. Computed once per report, so the cost of a report grows
+    with its number of buckets, not of days.
+    """
+    edges = [int(date_from)]
+    date = period_start(local_date(date_from, tz), granularity)
+
+    while True:
+        date = next_period(date, granularity)
+        midnight = local_midnight(date, tz)
+        if midnight >= date_to:
+            break
+        edges.append(midnight)
+
+    edges.append(int(date_to))
+    return edges
+
+
+def bucket_labels(edges, granularity="day", tz=None):
+    return [
+        period_label(period_start(local_date(edge, tz), granularity),
+                     granularity)
+        for edge in edges[:-1]
+    ]
+
+
+def clip_edges(edges, start, end):
+    """
+    Edges of the buckets met by [start, end), clipped to it, and the index
+    of the first of them in ``edges``.
+    """
+    first = bisect_right(edges, start) - 1
+    last = bisect_left(edges, end)
+    return first, [start] + edges[first + 1:last] + [end]
+
+
+def fold_days(rows, edges):
+    """
+    Sum (day, seconds) rows, ordered by day, into the buckets of ``edges``
+    in one pass. Every day must lie whole inside one bucket.
+    """
+    totals = array(INT64, [0]) * (len(edges) - 1)
+    i = 0
+    last = len(edges) - 2
+
+    for day, seconds in rows:
+        while i < last and day >= edges[i + 1]:
+            i += 1
+        totals[i] += seconds
+
+    return list(totals)
+
+
+def split_intervals(starts, ends, edges):
+    """
+    Seconds of [starts[k], ends[k]) falling into each bucket defined by
+    ``edges``. Returns a list with ``len(edges) - 1`` integers.
+    """
+    if len(edges) < 2:
+        return []
+
+    if len(starts) >= NUMPY_MIN_SIZE and get_numpy():
+        return _split_numpy(starts, ends, edges)
+    return _split_array(starts, ends, edges)
+
+
+def _split_numpy(starts, ends, edges):
+    edges = numpy.asarray(edges, dtype=numpy.int64)
+    buckets = len(edges) - 1
+    widths = numpy.diff(edges)
+
+    starts = numpy.clip(numpy.asarray(starts, dtype=numpy.int64),
+                        edges[0], edges[-1])
+    ends = numpy.clip(numpy.asarray(ends, dtype=numpy.int64),
+                      edges[0], edges[-1])
+    keep = ends > starts
+    starts = starts[keep]
+    ends = ends[keep]
+
+    # bucket holding the first and the last second of every interval
+    first = numpy.searchsorted(edges, starts, side="right") - 1
+    last = numpy.searchsorted(edges, ends, side="left") - 1
+
+    # intervals inside a single bucket (almost all of them)
+    single = first == last
+    totals = numpy.bincount(first[single],
+                            weights=ends[single] - starts[single],
+                            minlength=buckets)
+
+    # multi-day intervals: head and tail parts ...
+    multi = ~single
+    first = first[multi]
+    last = last[multi]
+    totals += numpy.bincount(first, weights=edges[first + 1] - starts[multi],
+                             minlength=buckets)
+    totals += numpy.bincount(last, weights=ends[multi] - edges[last],
+                             minlength=buckets)
+
+    # ... and the fully covered buckets between them, via a difference array
+    cover = numpy.bincount(first + 1, minlength=buckets + 1)
+    cover -= numpy.bincount(last, minlength=buckets + 1)
+    totals += numpy.cumsum(cover[:-1]) * widths
+
+    return [int(x) for x in totals]
+
+
+def _split_array(starts, ends, edges):
+    buckets = len(edges) - 1
+    lo = edges[0]
+    hi = edges[-1]
+    totals = array(INT64, [0]) * buckets
+
+    for start, end in zip(starts, ends):
+        start = lo if start < lo else start
+        end = hi if end > hi else end
+        if end <= start:
+            continue
+
+        first = bisect_right(edges, start) - 1
+        last = bisect_left(edges, end) - 1
+
+        if first == last:
+            totals[first] += end - start
+            continue
+
+        totals[first] += edges[first + 1] - start
+        totals[last] += end - edges[last]
+        for i in range(first + 1, last):
+            totals[i] += edges[i + 1] - edges[i]
+
+    return list(totals)
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
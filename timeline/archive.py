@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Archive tier: sessions older than a cutoff move out of records.db into
+records-archive.db, attached as ``archive`` only when a report reaches
+back that far.
+
+The archive keeps the per-day, per-project totals of the archived days
+and, optionally, the raw sessions packed per project and month into
+columnar blocks (zlib-compressed int64 start deltas and durations). The
+cutoff is moved back to a midnight no session crosses, so every day is
+either entirely live or entirely archived.
+
+WAL makes commits atomic per file only, so a run commits the archive first
+(stamped with a batch number) and then deletes from records.db; a run
+interrupted in between is finished by ``recover``.
+"""
+
+import os
+import sys
+import time
+import zlib
+import struct
+import sqlite3
+import calendar
+from array import array
+from timeline import metrics
+from timeline.aggregate import INT64
+from timeline.migrations import DAY
+from timeline.results import scalar, iter_rows
+
+
+def filename_for(db_filename):
+    return os.path.splitext(db_filename)[0] + "-archive.db"
+
+
+def month_start(timestamp):
+    # start of the UTC month of ``timestamp``
+    t = time.gmtime(timestamp)
+    return calendar.timegm((t.tm_year, t.tm_mon, 1, 0, 0, 0))
+
+
+def pack(values, level=6):
+    # int64 column, little-endian, compressed at zlib ``level``
+    column = array(INT64, values)
+    if column.itemsize != 8:
+        # Python 2 on Windows, where "l" is 32 bits wide
+        return zlib.compress(struct.pack("<%dq" % len(column), *column),
+                             level)
+    if sys.byteorder == "big":
+        column.byteswap()
+    try:
+        return zlib.compress(column.tobytes(), level)
+    except AttributeError:
+        # Python 2
+        return zlib.compress(column.tostring(), level)
+
+
+def unpack(blob):
+    data = zlib.decompress(blob)
+    column = array(INT64)
+    if column.itemsize != 8:
+        column.extend(struct.unpack("<%dq" % (len(data) // 8), data))
+        return column
+    try:
+        column.frombytes(data)
+    except AttributeError:
+        # Python 2
+        column.fromstring(data)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def encode_block(sessions):
+    """
+    (starts, durations) blobs of a list of (start, end) pairs. Starts are
+    stored as deltas of the sorted starts, which compress far better.
+    """
+    sessions = sorted(sessions)
+    deltas = []
+    previous = 0
+    for start, end in sessions:
+        deltas.append(start - previous)
+        previous = start
+    return pack(deltas), pack(end - start for start, end in sessions)
+
+
+def decode_block(starts_blob, durations_blob):
+    # list of (start, end) pairs, by start
+    sessions = []
+    start = 0
+    for delta, duration in zip(unpack(starts_blob), unpack(durations_blob)):
+        start += delta
+        sessions.append((start, start + duration))
+    return sessions
+
+
+class Archiver(object):
+    SQL_CREATE_TOTALS = '''
+        CREATE TABLE IF NOT EXISTS archive.daily_totals (
+            project_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (project_id, day)
+        ) WITHOUT ROWID
+    '''
+    SQL_CREATE_TOTALS_INDEX = '''
+        CREATE INDEX IF NOT EXISTS archive.daily_totals_day
+        ON daily_totals (day, project_id, seconds)
+    '''
+    SQL_CREATE_BLOCKS = '''
+        CREATE TABLE IF NOT EXISTS archive.blocks (
+            project_id INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            starts BLOB NOT NULL,
+            durations BLOB NOT NULL,
+            PRIMARY KEY (project_id, month)
+        )
+    '''
+    SQL_CREATE_STATE = '''
+        CREATE TABLE IF NOT EXISTS archive.state (
+            name TEXT PRIMARY KEY,
+            value INTEGER
+        )
+    '''
+    SQL_GET_STATE = '''
+        SELECT value
+        FROM archive.state
+        WHERE name = :name
+    '''
+    SQL_SET_STATE = '''
+        INSERT OR REPLACE INTO archive.state (name, value)
+        VALUES (:name, :value)
+    '''
+    # earliest start of a session crossing :boundary
+    SQL_CROSSING = '''
+        SELECT MIN(date_start)
+        FROM main.times
+        WHERE
+            date_start < :boundary
+            AND date_start > :boundary - :max_duration
+            AND date_end > :boundary
+    '''
+    SQL_OLD_SESSIONS = '''
+        SELECT
+            project_id,
+            date_start,
+            date_end
+        FROM main.times
+        WHERE date_start < :boundary
+        ORDER BY project_id, date_start
+    '''
+    SQL_GET_BLOCK = '''
+        SELECT
+            starts,
+            durations
+        FROM archive.blocks
+        WHERE
+            project_id = :project_id
+            AND month = :month
+    '''
+    SQL_PUT_BLOCK = '''
+        INSERT OR REPLACE INTO archive.blocks (
+            project_id,
+            month,
+            count,
+            starts,
+            durations
+        ) VALUES (:project_id, :month, :count, :starts, :durations)
+    '''
+    SQL_ARCHIVE_TOTALS = '''
+        INSERT INTO archive.daily_totals (project_id, day, seconds)
+        SELECT
+            project_id,
+            day,
+            seconds
+        FROM main.daily_totals
+        WHERE
+            day < :boundary
+            AND seconds != 0
+        ON CONFLICT (project_id, day)
+        DO UPDATE SET seconds = seconds + excluded.seconds
+    '''
+    SQL_DELETE_SESSIONS = '''
+        DELETE FROM main.times
+        WHERE date_start < :boundary
+    '''
+    SQL_DELETE_TOTALS = '''
+        DELETE FROM main.daily_totals
+        WHERE day < :boundary
+    '''
+    SQL_DELETE_PROJECT_TOTALS = '''
+        DELETE FROM archive.daily_totals
+        WHERE project_id = :id
+    '''
+    SQL_DELETE_PROJECT_BLOCKS = '''
+        DELETE FROM archive.blocks
+        WHERE project_id = :id
+    '''
+    # archived sessions merges and imports look for duplicates among
+    SQL_CREATE_STAGING = '''
+        CREATE TEMP TABLE IF NOT EXISTS archived_times (
+            project_id INTEGER NOT NULL,
+            date_start INTEGER NOT NULL,
+            date_end INTEGER NOT NULL
+        )
+    '''
+    SQL_CREATE_STAGING_INDEX = '''
+        CREATE INDEX IF NOT EXISTS temp.archived_times_start
+        ON archived_times (project_id, date_start, date_end)
+    '''
+    SQL_STAGE = '''
+        INSERT INTO temp.archived_times (project_id, date_start, date_end)
+        VALUES (?, ?, ?)
+    '''
+    SQL_DROP_STAGING = '''
+        DROP TABLE IF EXISTS temp.archived_times
+    '''
+    SQL_BLOCKS = '''
+        SELECT
+            project_id,
+            starts,
+            durations
+        FROM archive.blocks
+        WHERE
+            month >= :month_min
+            AND month < :date_to
+    '''
+    SQL_BLOCKS_PROJECT = '''
+        SELECT
+            project_id,
+            starts,
+            durations
+        FROM archive.blocks
+        WHERE
+            project_id = :project_id
+            AND month >= :month_min
+            AND month < :date_to
+    '''
+
+    # default age in days, and the setting remembering the last one used
+    OLDER_THAN = 365
+    OLDER_THAN_SETTING = "archive_older_than"
+
+    # archive.state names
+    BOUNDARY = "boundary"
+    BATCH = "batch"
+    MAX_DURATION = "max_duration"
+    # 0 once a run kept only the totals
+    RAW = "raw"
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_state(self, name, default=None):
+        row = self.store.db.execute(self.SQL_GET_STATE,
+                                    {"name": name}).fetchone()
+        return row[0] if row is not None else default
+
+    def set_state(self, cur, name, value):
+        cur.execute(self.SQL_SET_STATE, {"name": name, "value": value})
+
+    def create(self):
+        # expects the archive attached, outside of a transaction
+        cur = self.store.db.cursor()
+        with self.store.db:
+            cur.execute(self.SQL_CREATE_TOTALS)
+            cur.execute(self.SQL_CREATE_TOTALS_INDEX)
+            cur.execute(self.SQL_CREATE_BLOCKS)
+            cur.execute(self.SQL_CREATE_STATE)
+
+    def find_boundary(self, cutoff):
+        """
+        The latest UTC midnight at or before ``cutoff`` that no session
+        crosses.
+        """
+        boundary = cutoff // DAY * DAY
+        max_duration = self.store.max_duration()
+        while True:
+            start = scalar(self.store.db.execute(self.SQL_CROSSING, {
+                "boundary": boundary,
+                "max_duration": max_duration
+            }))
+            if start is None:
+                return boundary
+            boundary = start // DAY * DAY
+
+    def recover(self):
+        """
+        Finish a run whose archive commit happened but whose deletion from
+        records.db didn't. Expects the archive attached.
+        """
+        store = self.store
+        batch = self.get_state(self.BATCH, 0)
+        if batch > int(store.get_setting(store.ARCHIVE_BATCH, 0)):
+            self.delete_archived(self.get_state(self.BOUNDARY), batch)
+
+    def archive(self, older_than_days, keep_raw=True, now=None):
+        """
+        Move the sessions that ended more than ``older_than_days`` days ago
+        to the archive, raw sessions too unless ``keep_raw`` is false.
+        Returns counts: ``sessions``, ``blocks`` (written), ``boundary``
+        (first live day).
+        """
+        store = self.store
+        now = time.time() if now is None else now
+        boundary = self.find_boundary(int(now) - older_than_days * DAY)
+
+        store.attach_archive(create=True)
+        self.create()
+        self.recover()
+
+        db = store.db
+        cur = db.cursor()
+        rows = cur.execute(self.SQL_OLD_SESSIONS,
+                           {"boundary": boundary}).fetchall()
+        stats = {"sessions": len(rows), "blocks": 0, "boundary": boundary}
+        if not rows:
+            return stats
+
+        # only archive.* is written: this commit is atomic on its own
+        batch = self.get_state(self.BATCH, 0) + 1
+        with db:
+            if keep_raw:
+                stats["blocks"] = self.write_blocks(cur, rows)
+            cur.execute(self.SQL_ARCHIVE_TOTALS, {"boundary": boundary})
+
+            max_duration = max(end - start for id, start, end in rows)
+            self.set_state(cur, self.MAX_DURATION, max(
+                max_duration, self.get_state(self.MAX_DURATION, 0)
+            ))
+            self.set_state(cur, self.BOUNDARY, max(
+                boundary, self.get_state(self.BOUNDARY, 0)
+            ))
+            self.set_state(cur, self.BATCH, batch)
+            if not keep_raw:
+                self.set_state(cur, self.RAW, 0)
+
+        self.delete_archived(boundary, batch)
+        store.incremental_vacuum()
+        return stats
+
+    def write_blocks(self, cur, rows):
+        # rows ordered by project and start, one block per project and month
+        blocks = {}
+        for project_id, start, end in rows:
+            key = (project_id, month_start(start))
+            blocks.setdefault(key, []).append((start, end))
+
+        for (project_id, month), sessions in blocks.items():
+            params = {"project_id": project_id, "month": month}
+            old = cur.execute(self.SQL_GET_BLOCK, params).fetchone()
+            if old is not None:
+                # sessions imported into an already archived month
+                sessions.extend(decode_block(old[0], old[1]))
+
+            params["count"] = len(sessions)
+            starts, durations = encode_block(sessions)
+            params["starts"] = sqlite3.Binary(starts)
+            params["durations"] = sqlite3.Binary(durations)
+            cur.execute(self.SQL_PUT_BLOCK, params)
+        return len(blocks)
+
+    def delete_archived(self, boundary, batch):
+        # the days before the archive's boundary are read from it from now on
+        store = self.store
+        settings = ((store.ARCHIVE_BEFORE, self.get_state(self.BOUNDARY)),
+                    (store.ARCHIVE_BATCH, batch))
+        cur = store.db.cursor()
+        with store.db:
+            cur.execute(self.SQL_DELETE_SESSIONS, {"boundary": boundary})
+            cur.execute(self.SQL_DELETE_TOTALS, {"boundary": boundary})
+            for name, value in settings:
+                cur.execute(store.SQL_SET_SETTING,
+                            {"name": name, "value": value})
+
+    def delete_project(self, id):
+        cur = self.store.db.cursor()
+        with self.store.db:
+            cur.execute(self.SQL_DELETE_PROJECT_TOTALS, {"id": id})
+            cur.execute(self.SQL_DELETE_PROJECT_BLOCKS, {"id": id})
+
+    def has_raw(self):
+        return bool(self.get_state(self.RAW, 1))
+
+    def max_duration(self):
+        return self.get_state(self.MAX_DURATION, 0)
+
+    def has_session(self, project_id, date_start):
+        # whether the raw blocks hold the session of the project starting
+        # at date_start
+        row = self.store.db.execute(self.SQL_GET_BLOCK, {
+            "project_id": project_id,
+            "month": month_start(date_start)
+        }).fetchone()
+        if row is None:
+            return False
+        return any(start == date_start
+                   for start, end in decode_block(row[0], row[1]))
+
+    def create_staging(self, cur):
+        cur.execute(self.SQL_CREATE_STAGING)
+        cur.execute(self.SQL_CREATE_STAGING_INDEX)
+
+    def drop_staging(self, cur):
+        cur.execute(self.SQL_DROP_STAGING)
+
+    def stage_sessions(self, cur, date_from):
+        """
+        Copy the archived sessions overlapping [date_from, boundary) into
+        ``temp.archived_times`` (see create_staging), for duplicate checks
+        in SQL. Returns the time before which sessions can't be checked
+        because a run kept only their totals: the boundary then, else 0.
+        Expects the archive attached.
+        """
+        boundary = self.store.archive_boundary()
+        if boundary is None or date_from is None:
+            return 0
+        if not self.has_raw():
+            return boundary
+        if date_from < boundary:
+            cur.executemany(self.SQL_STAGE,
+                            self.sessions(0, date_from, boundary))
+        return 0
+
+    def sessions(self, project_id, date_from, date_to):
+        """
+        Yield (project id, start, end) of the archived sessions overlapping
+        [date_from, date_to), project_id 0 for all projects. Nothing
+        without raw blocks.
+        """
+        date_from = int(date_from)
+        date_to = int(date_to)
+        params = {
+            "project_id": project_id,
+            "month_min": month_start(date_from - self.max_duration()),
+            "date_to": date_to
+        }
+
+        cur = self.store.db.cursor()
+        if project_id > 0:
+            cur.execute(self.SQL_BLOCKS_PROJECT, params)
+        else:
+            cur.execute(self.SQL_BLOCKS, params)
+        for id, starts, durations in iter_rows(cur):
+            for start, end in decode_block(starts, durations):
+                if start < date_to and end > date_from:
+                    yield id, start, end
+
+
+metrics.registry.name_statements(Archiver)
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,605 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Headless command line interface: ``python -m timeline <command>``.
+
+Must never import PyQt4 (directly or through the window modules), so it
+starts fast and runs on machines without a display.
+"""
+
+import sys
+import json
+import codecs
+import time
+import sqlite3
+import calendar
+import argparse
+from timeline import paths, aggregate, metrics
+from timeline.storage import TimeStore
+from timeline.journal import SessionJournal
+from timeline.session import SessionTracker
+from timeline.report import WRITERS, TextWriter, format_seconds
+from timeline.importer import Importer, READERS
+from timeline.merge import Merger, MergeError
+from timeline.archive import Archiver
+from timeline.teamreport import TeamReport, find_databases
+from timeline.reportcache import PersistentReportCache
+from timeline.stats import merge_sketches, heatmap_rows
+
+# heatmap cells, from no time to the busiest hour of the week
+SHADES = " .:-=+*#%@"
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+
+def parse_date(text):
+    # YYYY-MM-DD (UTC) to a timestamp, argparse type
+    try:
+        return calendar.timegm(time.strptime(text, "%Y-%m-%d"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid date: %r" % text)
+
+
+def parse_timezone(text):
+    # IANA zone name to a tzinfo, argparse type
+    try:
+        return aggregate.get_timezone(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(e.args[0])
+
+
+class CommandError(Exception):
+    pass
+
+
+class EncodedStream(object):
+    """
+    Python 2 byte stream taking unicode text too, encoded on the way.
+    """
+
+    def __init__(self, stream, encoding):
+        self.stream = stream
+        self.encoding = encoding
+
+    def write(self, text):
+        if not isinstance(text, bytes):
+            text = text.encode(self.encoding, "replace")
+        self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def get_encoding(encoding):
+    # the C locale is taken as UTF-8, as Python 3 does
+    encoding = encoding or "utf-8"
+    if codecs.lookup(encoding).name == "ascii":
+        encoding = "utf-8"
+    return encoding
+
+
+def text_stream(stream):
+    # Python 3's text streams as they are, Python 2's byte streams wrapped
+    if sys.version_info[0] > 2:
+        return stream
+    return EncodedStream(stream, get_encoding(stream.encoding))
+
+
+class Cli(object):
+    def __init__(self, args, out=None):
+        self.args = args
+        self.out = out if out is not None else text_stream(sys.stdout)
+        self.dbfile = args.db if args.db else paths.get_db_filename()
+        self.store = TimeStore(self.dbfile)
+        journal = SessionJournal(SessionJournal.filename_for(self.dbfile))
+        self.tracker = SessionTracker(self.store, journal)
+
+    def close(self):
+        self.tracker.journal.close()
+        self.store.close()
+
+    def write(self, line=""):
+        self.out.write(line + "\n")
+
+    def get_project_id(self, name, create=False):
+        id = self.store.find_project(name)
+        if id is None and create:
+            id = self.store.add_project(name)
+        if id is None:
+            raise CommandError("Unknown project: %s" % name)
+        return id
+
+    # commands
+
+    def cmd_projects(self):
+        for project in self.store.projects():
+            self.write(project.name)
+
+    def cmd_start(self):
+        frame = self.tracker.journal.frame()
+        if frame and not frame[0][4] & SessionJournal.DETACHED:
+            raise CommandError("The timers are run by the GUI")
+
+        id = self.get_project_id(self.args.project, self.args.create)
+        self.tracker.resume(attach=False)
+        if not self.tracker.start(id, time.time(), detached=True):
+            raise CommandError("%s is already running"
+                               % self.store.project_name(id))
+        self.write("Started %s" % self.store.project_name(id))
+
+    def cmd_stop(self):
+        frame = self.tracker.journal.frame()
+        if not frame:
+            raise CommandError("No timer is running")
+
+        if not frame[0][4] & SessionJournal.DETACHED:
+            # ticked by a GUI that is gone: stop at its last heartbeat
+            stopped = self.tracker.recover()
+        else:
+            self.tracker.resume(attach=False)
+            stopped = self.stop_detached()
+
+        for project_id, date_start, date_end in stopped:
+            self.write("Stopped %s after %s" % (
+                self.store.project_name(project_id),
+                format_seconds(date_end - date_start)
+            ))
+
+    def stop_detached(self):
+        now = time.time()
+        if self.args.all:
+            return self.tracker.stop_all(now)
+
+        if self.args.project is not None:
+            id = self.get_project_id(self.args.project)
+            if id not in self.tracker:
+                raise CommandError("%s isn't running"
+                                   % self.store.project_name(id))
+        elif len(self.tracker) == 1:
+            id = self.tracker.project_ids[0]
+        else:
+            raise CommandError("%d timers are running, name a project or "
+                               "use --all" % len(self.tracker))
+
+        date_start, date_end = self.tracker.stop(id, now)
+        return [(id, date_start, date_end)]
+
+    def cmd_status(self):
+        frame = self.tracker.journal.frame()
+        if not frame:
+            self.write("Not running")
+            return
+
+        now = time.time()
+        for rowid, project_id, date_start, date_end, flags in frame:
+            if flags & SessionJournal.DETACHED:
+                date_end = now
+
+            self.write("Running %s for %s" % (
+                self.store.project_name(project_id),
+                format_seconds(date_end - date_start)
+            ))
+
+    def cmd_serve(self):
+        try:
+            from timeline import server
+        except (ImportError, SyntaxError):
+            raise CommandError("serve needs Python 3")
+
+        args = self.args
+        api = server.ApiServer(self.dbfile, readers=args.readers)
+        sys.stderr.write("Serving on %s\n" % (
+            args.socket or "http://%s:%d/" % (args.host, args.port)
+        ))
+        try:
+            api.serve_forever(args.host, args.port, args.socket)
+        except EnvironmentError as e:
+            raise CommandError("Can't serve: %s" % e)
+
+    def get_report_range(self):
+        # [from, to] in seconds, both days included, days in --tz
+        args = self.args
+        date_from = args.date_from
+        if date_from is None:
+            date_from = args.date_to - 6 * 86400
+        return (aggregate.wall_timestamp(date_from, args.tz),
+                aggregate.wall_timestamp(args.date_to + 86400, args.tz) - 1)
+
+    def write_report(self, rows):
+        args = self.args
+        if args.format == "text":
+            zone = None
+            if args.tz is not None:
+                zone = aggregate.timezone_name(args.tz)
+            writer = TextWriter(args.per_day, args.empty, zone=zone)
+        else:
+            writer = WRITERS[args.format](args.empty)
+
+        if args.output and args.output != "-":
+            with open(args.output, "w") as stream:
+                writer.write(rows, stream)
+        else:
+            writer.write(rows, self.out)
+
+    def cmd_report(self):
+        project_id = 0
+        if self.args.project:
+            project_id = self.get_project_id(self.args.project)
+
+        args = self.args
+        date_from, date_to = self.get_report_range()
+        if not args.cache:
+            self.write_report(self.store.iter_report(
+                project_id, date_from, date_to, args.by_project, args.tz,
+                args.granularity
+            ))
+            return
+
+        cache = PersistentReportCache(
+            PersistentReportCache.filename_for(self.dbfile)
+        )
+        try:
+            cache.validate(self.store.write_generation())
+            granularity = args.granularity
+            if args.by_project:
+                granularity += "/project"
+            if args.tz is not None:
+                granularity += "@" + aggregate.timezone_name(args.tz)
+            key = (project_id, date_from, date_to, granularity)
+            rows = cache.get(key)
+            if rows is None:
+                rows = list(self.store.iter_report(
+                    project_id, date_from, date_to, args.by_project, args.tz,
+                    args.granularity
+                ))
+                cache.put(key, rows, cache.generation)
+            stats = cache.stats()
+            metrics.registry.add_source("report_cache", lambda: stats)
+        finally:
+            cache.close()
+        self.write_report(rows)
+
+    def cmd_team_report(self):
+        filenames = find_databases(self.args.databases)
+        if not filenames:
+            raise CommandError("No databases found")
+
+        team = TeamReport(filenames, self.args.jobs)
+        date_from, date_to = self.get_report_range()
+        self.write_report(team.iter_report(
+            self.args.project, date_from, date_to, self.args.by_project,
+            self.args.tz, self.args.granularity
+        ))
+
+        for filename in sorted(team.errors):
+            sys.stderr.write("%s: skipped, %s\n"
+                             % (filename, team.errors[filename]))
+
+    def cmd_import(self):
+        args = self.args
+        interactive = sys.stderr.isatty()
+
+        def progress(done, total):
+            if interactive and total:
+                sys.stderr.write("\r%3d%%" % (100 * done // total))
+
+        importer = Importer(self.store, progress)
+        for filename in args.files:
+            try:
+                stats = importer.import_file(filename, args.format, args.tz)
+            except (EnvironmentError, ValueError) as e:
+                raise CommandError("%s: %s" % (filename, e))
+            finally:
+                if interactive:
+                    sys.stderr.write("\r")
+
+            self.write("%s: imported %d of %d records (%d duplicates, "
+                       "%d invalid, %d new projects)" % (
+                           filename, stats["imported"], stats["read"],
+                           stats["duplicates"], stats["invalid"],
+                           stats["projects"]
+                       ))
+
+    def cmd_merge(self):
+        merger = Merger(self.store)
+        for filename in self.args.files:
+            try:
+                stats = merger.merge(filename)
+            except MergeError as e:
+                raise CommandError(e.args[0])
+
+            self.write("%s: merged %d of %d sessions (%d duplicates, "
+                       "%d invalid, %d new projects)" % (
+                           filename, stats["merged"], stats["read"],
+                           stats["duplicates"], stats["invalid"],
+                           stats["projects"]
+                       ))
+
+    def cmd_delete(self):
+        id = self.get_project_id(self.args.project)
+        if any(record[1] == id for record in self.tracker.journal.frame()):
+            raise CommandError("Stop the running timer first")
+
+        name = self.store.project_name(id)
+        interactive = sys.stderr.isatty()
+
+        def progress(done, total):
+            if interactive and total:
+                sys.stderr.write("\r%3d%%" % (100 * done // total))
+
+        # finish a deletion an earlier run didn't complete
+        self.store.resume_deletion()
+        try:
+            self.store.delete_project(id, progress,
+                                      vacuum=not self.args.no_vacuum)
+        finally:
+            if interactive:
+                sys.stderr.write("\r")
+        self.write("Deleted %s" % name)
+
+    def cmd_archive(self):
+        older_than = self.args.older_than
+        if older_than is None:
+            older_than = int(self.store.get_setting(
+                Archiver.OLDER_THAN_SETTING, Archiver.OLDER_THAN
+            ))
+
+        stats = Archiver(self.store).archive(older_than,
+                                             not self.args.no_raw)
+        self.write("Archived %d sessions before %s (%d monthly blocks)" % (
+            stats["sessions"],
+            time.strftime("%Y-%m-%d", time.gmtime(stats["boundary"])),
+            stats["blocks"]
+        ))
+
+    def cmd_rebuild_totals(self):
+        self.store.rebuild_daily_totals()
+        self.store.rebuild_session_stats()
+        self.write("Daily totals and session statistics rebuilt")
+
+    def cmd_stats(self):
+        args = self.args
+        project_id = 0
+        if args.project:
+            project_id = self.get_project_id(args.project)
+        date_from = args.date_from or 0
+        date_to = args.date_to + 86399
+
+        sketches = self.store.session_stats(project_id, date_from, date_to)
+        projects = [self.stats_entry(name, sketches[name])
+                    for name in sorted(sketches, key=lambda x: x.lower())]
+        total = self.stats_entry(None, merge_sketches(sketches.values()))
+
+        if args.format == "json":
+            json.dump({
+                "from": time.strftime("%Y-%m-%d", time.gmtime(date_from)),
+                "to": time.strftime("%Y-%m-%d", time.gmtime(args.date_to)),
+                "projects": projects,
+                "total": total
+            }, self.out, sort_keys=True)
+            self.write()
+            return
+
+        columns = ("sessions", "seconds", "mean", "median", "p90", "p99",
+                   "longest")
+        self.write("%-20s %8s %11s %9s %9s %9s %9s %9s %7s" % (
+            "Project", "Sessions", "Total", "Mean", "Median", "P90", "P99",
+            "Longest", "Streak"
+        ))
+        for entry in projects + [total]:
+            if entry is total:
+                self.write("-" * 97)
+            values = [entry[column] for column in columns]
+            self.write("%-20s %8d %11s %9s %9s %9s %9s %9s %7s" % tuple(
+                [(entry["project"] or "All projects")[:20], values[0]] +
+                [format_seconds(value) for value in values[1:]] +
+                ["%dd" % entry["streak_days"]]
+            ))
+
+        if args.heatmap:
+            self.write()
+            self.write_heatmap(total["heatmap"])
+        self.write()
+        self.write("Sessions count in the UTC month they started, "
+                   "hours are in UTC")
+
+    def stats_entry(self, name, sketch):
+        entry = sketch.summary()
+        start = entry["streak_start"]
+        entry.update({
+            "project": name,
+            "streak_start": time.strftime("%Y-%m-%d", time.gmtime(start))
+            if start is not None else None,
+            "heatmap": heatmap_rows(sketch.heatmap)
+        })
+        return entry
+
+    def write_heatmap(self, rows):
+        top = max(max(row) for row in rows)
+        hours = "".join("%-3d" % hour for hour in range(24))
+        self.write(("    " + hours).rstrip())
+        for weekday, row in zip(WEEKDAYS, rows):
+            cells = []
+            for seconds in row:
+                shade = 0
+                if seconds:
+                    shade = 1 + seconds * (len(SHADES) - 2) // top
+                cells.append(SHADES[shade] * 2 + " ")
+            self.write(("%s %s" % (weekday, "".join(cells))).rstrip())
+
+
+def add_report_arguments(cmd, today):
+    cmd.add_argument("--from", dest="date_from", type=parse_date,
+                     metavar="YYYY-MM-DD",
+                     help="first day (default: 6 days before --to)")
+    cmd.add_argument("--to", dest="date_to", type=parse_date, default=today,
+                     metavar="YYYY-MM-DD", help="last day (default: today)")
+    cmd.add_argument("--project", help="project name (default: all)")
+    cmd.add_argument("--granularity", choices=aggregate.GRANULARITIES,
+                     default="day", help="length of the periods time is "
+                     "totalled by; weeks are ISO weeks (default: day)")
+    cmd.add_argument("--tz", type=parse_timezone, metavar="ZONE",
+                     help="time zone of the days and periods "
+                     "(default: UTC)")
+    cmd.add_argument("--per-day", action="store_true",
+                     help="show time per period within range")
+    cmd.add_argument("--empty", action="store_true",
+                     help="show periods without time")
+    cmd.add_argument("--by-project", action="store_true",
+                     help="split every period by project")
+    cmd.add_argument("--format", choices=sorted(WRITERS), default="text")
+    cmd.add_argument("--output", metavar="FILE",
+                     help="write to FILE instead of standard output")
+
+
+def get_parser():
+    today = calendar.timegm(time.gmtime()) // 86400 * 86400
+
+    parser = argparse.ArgumentParser(
+        prog="python -m timeline",
+        description="Time-Line command line interface"
+    )
+    parser.add_argument("--db", help="database file (default: %s)"
+                        % paths.get_db_filename(create=False))
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write database metrics as JSON to FILE "
+                        "(- for stderr) on exit")
+    parser.add_argument("--slow-ms", type=float, metavar="MS",
+                        default=metrics.Metrics.SLOW_MS,
+                        help="log statements slower than MS with their "
+                        "query plan in the metrics (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    commands.add_parser("projects", help="list projects")
+
+    cmd = commands.add_parser("start", help="start the timer for a project, "
+                              "alongside those already running")
+    cmd.add_argument("project")
+    cmd.add_argument("--create", action="store_true",
+                     help="create the project if it doesn't exist")
+
+    cmd = commands.add_parser("stop", help="stop and save a running timer")
+    cmd.add_argument("project", nargs="?",
+                     help="project to stop, needed when several run")
+    cmd.add_argument("--all", action="store_true",
+                     help="stop every running timer")
+
+    commands.add_parser("status", help="show the running timers")
+
+    cmd = commands.add_parser("report", help="show spent time")
+    add_report_arguments(cmd, today)
+    cmd.add_argument("--cache", action="store_true",
+                     help="reuse results of earlier runs while the records "
+                     "are unchanged")
+
+    cmd = commands.add_parser("team-report", help="show spent time summed "
+                              "over several databases, read in place")
+    cmd.add_argument("databases", nargs="+", metavar="PATH",
+                     help="records.db files or directories of *.db files")
+    cmd.add_argument("--jobs", type=int, metavar="N",
+                     help="worker processes (default: one per core)")
+    add_report_arguments(cmd, today)
+
+    cmd = commands.add_parser("import", help="load records from CSV or "
+                              "iCalendar files")
+    cmd.add_argument("files", nargs="+", metavar="FILE")
+    cmd.add_argument("--format", choices=sorted(READERS),
+                     help="file format (default: from the extension)")
+    cmd.add_argument("--tz", type=parse_timezone, metavar="ZONE",
+                     help="time zone of times without an offset "
+                     "(default: UTC)")
+
+    cmd = commands.add_parser("merge", help="add the records of other "
+                              "records.db files, skipping overlaps")
+    cmd.add_argument("files", nargs="+", metavar="FILE")
+
+    cmd = commands.add_parser("delete", help="delete a project and its "
+                              "records, in batches")
+    cmd.add_argument("project")
+    cmd.add_argument("--no-vacuum", action="store_true",
+                     help="keep the freed space in the file")
+
+    cmd = commands.add_parser("archive", help="move old sessions into "
+                              "the archive database")
+    cmd.add_argument("--older-than", type=int, metavar="DAYS",
+                     help="archive sessions that ended more than DAYS days "
+                     "ago (default: the last value used, or %d)"
+                     % Archiver.OLDER_THAN)
+    cmd.add_argument("--no-raw", action="store_true",
+                     help="keep only daily totals, not the sessions")
+
+    commands.add_parser("rebuild-totals",
+                        help="recompute daily totals and session statistics "
+                        "from the raw records")
+
+    cmd = commands.add_parser("stats", help="show session counts, lengths, "
+                              "streaks and busy hours")
+    cmd.add_argument("--from", dest="date_from", type=parse_date,
+                     metavar="YYYY-MM-DD",
+                     help="first month (default: the first records)")
+    cmd.add_argument("--to", dest="date_to", type=parse_date, default=today,
+                     metavar="YYYY-MM-DD", help="last month (default: today)")
+    cmd.add_argument("--project", help="project name (default: all)")
+    cmd.add_argument("--heatmap", action="store_true",
+                     help="show the time per weekday and hour")
+    cmd.add_argument("--format", choices=("text", "json"), default="text")
+
+    cmd = commands.add_parser("serve", help="serve the JSON API for scripts "
+                              "and editor plugins (Python 3)")
+    cmd.add_argument("--host", default="127.0.0.1",
+                     help="address to listen on (default: %(default)s)")
+    cmd.add_argument("--port", type=int, default=8765,
+                     help="port to listen on (default: %(default)s)")
+    cmd.add_argument("--socket", metavar="PATH",
+                     help="listen on a Unix socket instead")
+    cmd.add_argument("--readers", type=int, default=4, metavar="N",
+                     help="read-only connections (default: %(default)s)")
+
+    return parser
+
+
+def write_metrics(filename):
+    text = json.dumps(metrics.registry.snapshot(), indent=2, sort_keys=True)
+    if filename == "-":
+        sys.stderr.write(text + "\n")
+    else:
+        with open(filename, "w") as f:
+            f.write(text + "\n")
+
+
+def decode_args(argv):
+    # Python 2 passes the arguments as bytes in the file system encoding
+    encoding = get_encoding(sys.getfilesystemencoding())
+    return [arg.decode(encoding) if isinstance(arg, bytes) else arg
+            for arg in argv]
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    args = get_parser().parse_args(decode_args(argv))
+    metrics.registry.configure(args.slow_ms)
+
+    try:
+        cli = Cli(args)
+    except sqlite3.Error as e:
+        sys.stderr.write("Database error: %s\n" % e.args[0])
+        return 1
+
+    try:
+        getattr(cli, "cmd_" + args.command.replace("-", "_"))()
+    except CommandError as e:
+        text_stream(sys.stderr).write("%s\n" % e.args[0])
+        return 1
+    except sqlite3.Error as e:
+        sys.stderr.write("Database error: %s\n" % e.args[0])
+        return 1
+    finally:
+        cli.close()
+        if args.metrics:
+            write_metrics(args.metrics)
+
+    return 0
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
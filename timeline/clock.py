@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Clocks for the timer logic.
+
+Whatever reads the time takes a clock: a callable returning seconds since
+the epoch, ``time.time`` unless told otherwise. SimulatedClock only moves
+when it is told to, so the session state machine can be driven through
+hours of simulated time in milliseconds (see timeline.replay).
+"""
+
+# tick spacing of the TickScheduler, in ms: every second while the display
+# is visible, every 30 seconds while it is hidden or minimised
+FINE_INTERVAL = 1000
+COARSE_INTERVAL = 30000
+
+
+def next_tick(now, interval):
+    # time of the first tick after ``now`` of a clock ticking on
+    # ``interval`` ms boundaries
+    now = int(now * 1000)
+    return (now + interval - now % interval) / 1000.0
+
+
+class SimulatedClock(object):
+    def __init__(self, now=0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def set(self, now):
+        if now < self.now:
+            raise ValueError("the clock can't go back from %s to %s"
+                             % (self.now, now))
+        self.now = now
+
+    def advance(self, seconds):
+        self.set(self.now + seconds)
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
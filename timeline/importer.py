@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Bulk import of time records from other trackers.
+
+Readers turn CSV files and iCalendar VEVENTs into (project name, start, end)
+records. The Importer maps names to projects (creating missing ones),
+drops invalid and duplicate intervals and loads everything in one
+transaction: batches go into a temporary table with ``executemany``, then
+a single INSERT ... SELECT moves the new rows into ``times`` and one more
+``executemany`` adds their per-day sums to the daily totals. When the
+import is at least as large as the table, the secondary indexes are
+dropped first and built once at the end, which is much cheaper than
+updating them row by row.
+"""
+
+import io
+import os
+import re
+import csv
+import datetime
+from timeline import aggregate
+from timeline import archive
+from timeline import metrics
+from timeline.migrations import DAY
+from timeline.projects import nocase
+from timeline.results import scalar, iter_rows
+
+ISO_TIME = re.compile(
+    r"^(\d{4})-?(\d\d)-?(\d\d)[T ](\d\d):?(\d\d)(?::?(\d\d)(?:[.,]\d+)?)?"
+    r"\s*(Z|[+-]\d\d(?::?\d\d)?)?$"
+)
+ICS_DURATION = re.compile(
+    r"^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$"
+)
+
+CSV_COLUMNS = {
+    "project": ("project", "name", "task"),
+    "start": ("start", "date_start", "begin", "from"),
+    "end": ("end", "date_end", "stop", "to"),
+    "duration": ("duration", "seconds")
+}
+
+
+class FormatError(ValueError):
+    pass
+
+
+def parse_time(text, tz=None):
+    """
+    UTC timestamp of a Unix timestamp or an ISO 8601 date and time. Times
+    without an offset are in ``tz`` (None means UTC).
+    """
+    try:
+        return int(text)
+    except ValueError:
+        pass
+
+    match = ISO_TIME.match(text.strip())
+    if match is None:
+        raise ValueError("invalid time: %r" % text)
+
+    year, month, day, hour, minute, second, offset = match.groups()
+    naive = datetime.datetime(int(year), int(month), int(day), int(hour),
+                              int(minute), int(second or 0))
+    if offset is None:
+        return aggregate.local_timestamp(naive, tz)
+
+    timestamp = aggregate.local_timestamp(naive)
+    if offset != "Z":
+        sign = -1 if offset[0] == "-" else 1
+        digits = offset[1:].replace(":", "")
+        minutes = int(digits[:2]) * 60 + int(digits[2:] or 0)
+        timestamp -= sign * minutes * 60
+    return timestamp
+
+
+def read_csv(lines, tz=None):
+    """
+    Yield (name, start, end) from CSV lines with a header row naming a
+    project column and a start column plus an end or duration column.
+    Rows that can't be parsed yield (name, None, None).
+    """
+    reader = csv.reader(lines)
+    try:
+        header = [column.strip().lower() for column in next(reader)]
+    except StopIteration:
+        return
+
+    columns = {}
+    for key, names in CSV_COLUMNS.items():
+        for name in names:
+            if name in header:
+                columns[key] = header.index(name)
+                break
+
+    if ("project" not in columns or "start" not in columns or
+            ("end" not in columns and "duration" not in columns)):
+        raise FormatError("CSV needs project, start and end (or duration) "
+                          "columns")
+
+    for row in reader:
+        if not row:
+            continue
+        try:
+            name = row[columns["project"]]
+            start = parse_time(row[columns["start"]], tz)
+            if "end" in columns and row[columns["end"]].strip():
+                end = parse_time(row[columns["end"]], tz)
+            else:
+                end = start + int(float(row[columns["duration"]]))
+        except (IndexError, KeyError, ValueError):
+            yield None, None, None
+            continue
+        yield name, start, end
+
+
+def unfold_ics(lines):
+    # RFC 5545 long lines continue on lines starting with a space or tab
+    current = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def unescape_ics(text):
+    return re.sub(r"\\([\\;,nN])",
+                  lambda m: "\n" if m.group(1) in "nN" else m.group(1), text)
+
+
+def parse_ics_time(params, value, tz=None):
+    if "VALUE=DATE" in params:
+        # all-day events aren't time records
+        raise ValueError("date without time: %r" % value)
+
+    for param in params:
+        if param.startswith("TZID="):
+            tz = aggregate.get_timezone(param[5:].strip('"'))
+    return parse_time(value, tz)
+
+
+def parse_ics_duration(text):
+    match = ICS_DURATION.match(text.strip())
+    if match is None:
+        raise ValueError("invalid duration: %r" % text)
+
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    total = (int(weeks or 0) * 7 * DAY + int(days or 0) * DAY +
+             int(hours or 0) * 3600 + int(minutes or 0) * 60 +
+             int(seconds or 0))
+    return -total if sign == "-" else total
+
+
+def read_ics(lines, tz=None):
+    """
+    Yield (name, start, end) for every VEVENT, named after its SUMMARY.
+    Floating times are in ``tz`` (None means UTC). Events that can't be
+    parsed yield (name, None, None).
+    """
+    event = None
+    for line in unfold_ics(lines):
+        if line == "BEGIN:VEVENT":
+            event = {}
+            continue
+        if event is None:
+            continue
+        if line == "END:VEVENT":
+            try:
+                name = unescape_ics(event["SUMMARY"][1])
+                start = parse_ics_time(event["DTSTART"][0],
+                                       event["DTSTART"][1], tz)
+                if "DTEND" in event:
+                    end = parse_ics_time(event["DTEND"][0],
+                                         event["DTEND"][1], tz)
+                else:
+                    end = start + parse_ics_duration(event["DURATION"][1])
+            except (KeyError, ValueError):
+                yield None, None, None
+            else:
+                yield name, start, end
+            event = None
+            continue
+
+        key, sep, value = line.partition(":")
+        if not sep:
+            continue
+        params = key.split(";")
+        event[params[0].upper()] = (params[1:], value)
+
+
+READERS = {
+    "csv": read_csv,
+    "ics": read_ics
+}
+
+
+def add_parts(totals, project_id, start, end, sign=1):
+    # seconds of [start, end) per (project, UTC day), like update_totals
+    while start < end:
+        day = start - start % DAY
+        part_end = min(end, day + DAY)
+        key = (project_id, day)
+        totals[key] = totals.get(key, 0) + sign * (part_end - start)
+        start = part_end
+
+
+def get_format(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in (".ics", ".ical", ".ifb"):
+        return "ics"
+    return "csv"
+
+
+class Importer(object):
+    """
+    Loads (name, start, end) records into a TimeStore in one transaction.
+
+    Intervals must be non-empty and positive; a session is identified by
+    project and start (like journal folding), so rows repeating one already
+    in the file, the database or its archive are skipped. Importing the
+    same file twice adds nothing the second time.
+    """
+    BATCH_SIZE = 50000
+
+    SQL_CREATE_STAGING = '''
+        CREATE TEMP TABLE IF NOT EXISTS import_times (
+            project_id INTEGER,
+            date_start INTEGER,
+            date_end INTEGER
+        )
+    '''
+    SQL_STAGE = '''
+        INSERT INTO import_times (project_id, date_start, date_end)
+        VALUES (?, ?, ?)
+    '''
+    # sessions in times or in the archive (staged in temp.archived_times);
+    # before :archived_before the archive can't tell and all are skipped
+    SQL_STAGED_EXISTING = '''
+        SELECT project_id, date_start, date_end
+        FROM import_times
+        WHERE
+            date_start < :archived_before
+            OR EXISTS (
+                SELECT 1
+                FROM times
+                WHERE
+                    times.project_id = import_times.project_id
+                    AND times.date_start = import_times.date_start
+            )
+            OR EXISTS (
+                SELECT 1
+                FROM temp.archived_times a
+                WHERE
+                    a.project_id = import_times.project_id
+                    AND a.date_start = import_times.date_start
+            )
+    '''
+    SQL_UNSTAGE_EXISTING = '''
+        DELETE FROM import_times
+        WHERE
+            date_start < :archived_before
+            OR EXISTS (
+                SELECT 1
+                FROM times
+                WHERE
+                    times.project_id = import_times.project_id
+                    AND times.date_start = import_times.date_start
+            )
+            OR EXISTS (
+                SELECT 1
+                FROM temp.archived_times a
+                WHERE
+                    a.project_id = import_times.project_id
+                    AND a.date_start = import_times.date_start
+            )
+    '''
+    SQL_FIRST_STAGED_START = '''
+        SELECT MIN(date_start) FROM import_times
+    '''
+    SQL_LAST_ROWID = '''
+        SELECT MAX(rowid) FROM times
+    '''
+    SQL_INDEXES = '''
+        SELECT name, sql
+        FROM sqlite_master
+        WHERE
+            type = 'index'
+            AND tbl_name IN ('times', 'daily_totals')
+            AND sql IS NOT NULL
+    '''
+    SQL_INSERT_STAGED = '''
+        INSERT INTO times (project_id, date_start, date_end, duration)
+        SELECT project_id, date_start, date_end, date_end - date_start
+        FROM import_times
+    '''
+    SQL_DROP_STAGING = '''
+        DROP TABLE IF EXISTS temp.import_times
+    '''
+
+    def __init__(self, store, progress=None, batch_size=BATCH_SIZE):
+        self.store = store
+        self.progress = progress
+        self.batch_size = batch_size
+        self.projects = None
+        self.stats = None
+        self.totals = None
+
+    def load_projects(self):
+        self.projects = {}
+        for id, name in self.store.project_rows():
+            self.projects[nocase(name)] = id
+
+    def get_project_id(self, cur, name):
+        key = nocase(name)
+        id = self.projects.get(key)
+        if id is None:
+            cur.execute(self.store.SQL_ADD_PROJECT, {"name": name})
+            id = self.projects[key] = cur.lastrowid
+            self.stats["projects"] += 1
+        return id
+
+    def stage(self, cur, records, done=None, total=None):
+        # the hot loop: locals only, raw name -> id saves folding the case
+        # of every row
+        stats = self.stats
+        totals = self.totals
+        ids = {}
+        seen = set()
+        batch = []
+        read = invalid = 0
+
+        for name, start, end in records:
+            read += 1
+            if not name or start is None or end <= start or start < 0:
+                invalid += 1
+                continue
+
+            id = ids.get(name)
+            if id is None:
+                if not name.strip():
+                    invalid += 1
+                    continue
+                id = ids[name] = self.get_project_id(cur, name.strip())
+
+            key = (id, start)
+            if key in seen:
+                continue
+            seen.add(key)
+            batch.append((id, start, end))
+
+            day = start - start % DAY
+            if end <= day + DAY:
+                key = (id, day)
+                totals[key] = totals.get(key, 0) + end - start
+            else:
+                add_parts(totals, id, start, end)
+
+            if len(batch) >= self.batch_size:
+                stats["read"], stats["invalid"] = read, invalid
+                self.flush(cur, batch, done, total)
+                batch = []
+
+        stats["read"], stats["invalid"] = read, invalid
+        self.flush(cur, batch, done, total)
+        return len(seen)
+
+    def flush(self, cur, batch, done=None, total=None):
+        if batch:
+            cur.executemany(self.SQL_STAGE, batch)
+        if self.progress is not None:
+            self.progress(done() if done is not None else self.stats["read"],
+                          total or 0)
+
+    def run(self, records, done=None, total=None):
+        """
+        Import ``records`` and return counts: ``read``, ``imported``,
+        ``invalid``, ``duplicates`` and ``projects`` (created). ``done``
+        and ``total`` measure progress (default: records read, unknown).
+        Nothing is written if an error interrupts the import.
+        """
+        self.stats = {"read": 0, "imported": 0, "invalid": 0,
+                      "duplicates": 0, "projects": 0}
+        self.totals = {}
+        self.load_projects()
+
+        db = self.store.db
+        cur = db.cursor()
+        archiver = archive.Archiver(self.store)
+        # archived sessions are duplicates too; the archive can't be
+        # attached within the transaction
+        archived = self.store.reaches_archive(0)
+        cur.execute(self.SQL_CREATE_STAGING)
+        archiver.create_staging(cur)
+        # Python 2 commits before DDL such as DROP INDEX, which would leave
+        # a failed import half written and without its indexes: the
+        # transaction is managed by hand
+        isolation_level = db.isolation_level
+        db.isolation_level = None
+        try:
+            cur.execute("BEGIN")
+            staged = self.stage(cur, records, done, total)
+
+            # sessions the database already has
+            params = {"archived_before": 0}
+            if archived:
+                params["archived_before"] = archiver.stage_sessions(
+                    cur, scalar(cur.execute(self.SQL_FIRST_STAGED_START))
+                )
+            for row in iter_rows(cur.execute(self.SQL_STAGED_EXISTING,
+                                             params)):
+                add_parts(self.totals, row[0], row[1], row[2], -1)
+            cur.execute(self.SQL_UNSTAGE_EXISTING, params)
+            staged -= cur.rowcount
+
+            indexes = []
+            existing = scalar(cur.execute(self.SQL_LAST_ROWID))
+            if staged >= (existing or 0):
+                indexes = cur.execute(self.SQL_INDEXES).fetchall()
+                for name, sql in indexes:
+                    cur.execute('DROP INDEX "%s"' % name)
+
+            cur.execute(self.SQL_INSERT_STAGED)
+            self.stats["imported"] = cur.rowcount
+            self.store.add_session_stats_since(existing)
+            cur.executemany(self.store.SQL_ROLLUP_ADD, (
+                {"p_id": key[0], "day": key[1], "seconds": seconds}
+                for key, seconds in self.totals.items() if seconds
+            ))
+
+            for name, sql in indexes:
+                cur.execute(sql)
+            if self.stats["imported"]:
+                self.store.bump_generation(cur)
+            db.commit()
+        except Exception:
+            db.rollback()
+            # names created in the rolled back transaction don't exist
+            self.projects = None
+            raise
+        finally:
+            db.isolation_level = isolation_level
+            self.totals = None
+            cur.execute(self.SQL_DROP_STAGING)
+            archiver.drop_staging(cur)
+
+        stats = self.stats
+        stats["duplicates"] = (stats["read"] - stats["invalid"] -
+                               stats["imported"])
+        return stats
+
+    def import_file(self, filename, format=None, tz=None):
+        # progress in bytes read out of the file size
+        format = format or get_format(filename)
+        with io.open(filename, "r", encoding="utf-8-sig", newline="") as f:
+            return self.run(READERS[format](f, tz), f.buffer.tell,
+                            os.path.getsize(filename))
+
+
+metrics.registry.name_statements(Importer)
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
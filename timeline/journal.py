@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Append-only journal for the running sessions.
+
+Instead of updating their rows in ``times`` (and syncing the database) on
+every heartbeat, the running sessions are journaled here in small
+fixed-size records. Starting or stopping a timer appends a frame: one
+record per running session, the last one flagged FRAME_END. A heartbeat
+appends a single TICK record that moves the end of every session of the
+frame before it, so its cost doesn't grow with the number of timers. The
+journal is folded into the database on stop, every ``flush_interval``
+seconds and on the next start after a crash.
+"""
+
+import os
+import struct
+import zlib
+
+
+class SessionJournal(object):
+    # rowid, project_id, date_start, date_end, flags + crc32 of those
+    RECORD = struct.Struct("<qqqqII")
+    PAYLOAD = struct.Struct("<qqqqI")
+
+    # started without a process that ticks it (e.g. from the command line),
+    # the session is open-ended until stopped
+    DETACHED = 1
+    # a session record of a frame, and the last record of a frame; records
+    # without FRAME were written by versions running a single timer
+    FRAME = 2
+    FRAME_END = 4
+    # heartbeat, only date_end is used
+    TICK = 8
+
+    # size past which a new frame starts the journal over
+    MAX_SIZE = 65536
+
+    def __init__(self, filename, sync=False):
+        self.filename = filename
+        self.sync = sync
+        self.file = open(filename, "ab+")
+        self.trim()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def trim(self):
+        # drop a partial record left by a crash, appends stay aligned
+        size = self.RECORD.size
+        self.file.seek(0, os.SEEK_END)
+        length = self.file.tell()
+        if length % size:
+            self.file.truncate(length // size * size)
+
+    def pack(self, rowid, project_id, date_start, date_end, flags=0):
+        payload = self.PAYLOAD.pack(
+            int(rowid), int(project_id), int(date_start), int(date_end),
+            int(flags)
+        )
+        crc = zlib.crc32(payload) & 0xffffffff
+        return payload + struct.pack("<I", crc)
+
+    def write(self, data):
+        self.file.write(data)
+        self.file.flush()
+
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+    def append(self, rowid, project_id, date_start, date_end, flags=0):
+        self.write(self.pack(rowid, project_id, date_start, date_end, flags))
+
+    def append_frame(self, sessions, date_end, flags=0):
+        """
+        Append the set of running sessions, (rowid, project_id, date_start)
+        tuples all ending at ``date_end``, in a single write. An empty set
+        empties the journal.
+        """
+        if not sessions:
+            self.reset()
+            return
+
+        flags |= self.FRAME
+        last = len(sessions) - 1
+        data = b"".join(
+            self.pack(rowid, project_id, date_start, date_end,
+                      flags | self.FRAME_END if i == last else flags)
+            for i, (rowid, project_id, date_start) in enumerate(sessions)
+        )
+
+        # the frame holds the whole state, what is before it is history
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() + len(data) > self.MAX_SIZE:
+            self.reset()
+        self.write(data)
+
+    def tick(self, date_end):
+        self.append(0, 0, 0, date_end, self.TICK)
+
+    def records(self, reverse=False):
+        # intact records, oldest first; torn or partial writes are skipped
+        size = self.RECORD.size
+        self.file.seek(0)
+        data = self.file.read()
+
+        offsets = range(0, len(data) // size * size, size)
+        for offset in reversed(offsets) if reverse else offsets:
+            chunk = data[offset:offset + size]
+            record = self.RECORD.unpack(chunk)
+            if zlib.crc32(chunk[:-4]) & 0xffffffff == record[-1]:
+                yield record[:-1]
+
+    def frame(self):
+        """
+        Return the sessions of the last complete frame as a list of
+        (rowid, project_id, date_start, date_end, flags), date_end moved
+        up to the last tick after it. Empty when nothing is running.
+        Reads backwards from the end, only as far as that frame.
+        """
+        sessions = []
+        date_end = 0
+
+        for record in self.records(reverse=True):
+            flags = record[4]
+            if flags & self.FRAME:
+                if flags & self.FRAME_END and sessions:
+                    # end of the frame before
+                    break
+                if flags & self.FRAME_END or sessions:
+                    sessions.append(record)
+                # else: a frame torn by a crash
+            elif sessions:
+                break
+            elif flags & self.TICK:
+                date_end = max(date_end, record[3])
+            else:
+                # single timer record of an older version
+                sessions.append(record)
+                break
+
+        return [
+            (rowid, project_id, date_start, max(end, date_end), flags)
+            for rowid, project_id, date_start, end, flags
+            in reversed(sessions)
+        ]
+
+    def reset(self):
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.flush()
+
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+    @staticmethod
+    def filename_for(db_filename):
+        return os.path.splitext(db_filename)[0] + ".journal"
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Merging records.db files from several machines into one.
+
+Every source is ATTACHed to the target connection and merged with a few
+set-based statements in one transaction: missing projects are created,
+source project ids are remapped through a temporary table joined on the
+case-insensitive name, and sessions are copied unless the target already
+has an overlapping (or identical) session of the same project, archived
+ones included. Merging a file a second time therefore adds nothing.
+"""
+
+import os
+from timeline import archive
+from timeline import metrics
+from timeline.migrations import DAY
+from timeline.results import scalar
+
+
+class MergeError(Exception):
+    pass
+
+
+class Merger(object):
+    SQL_ATTACH = '''
+        ATTACH DATABASE :filename AS source
+    '''
+    SQL_DETACH = '''
+        DETACH DATABASE source
+    '''
+    SQL_SOURCE_TABLES = '''
+        SELECT COUNT(*)
+        FROM source.sqlite_master
+        WHERE
+            type = 'table'
+            AND name IN ('times', 'projects')
+    '''
+    # one row per name, older files may still have case duplicates
+    SQL_ADD_PROJECTS = '''
+        INSERT INTO main.projects (name)
+        SELECT MIN(s.name)
+        FROM source.projects s
+        WHERE
+            TRIM(s.name) != ''
+            AND NOT EXISTS (
+                SELECT 1
+                FROM main.projects p
+                WHERE p.name = s.name COLLATE NOCASE
+            )
+        GROUP BY s.name COLLATE NOCASE
+    '''
+    SQL_MAP_PROJECTS = '''
+        CREATE TEMP TABLE merge_projects AS
+        SELECT
+            s.rowid AS source_id,
+            p.rowid AS id
+        FROM source.projects s
+        JOIN main.projects p ON p.name = s.name COLLATE NOCASE
+    '''
+    SQL_DROP_MAP = '''
+        DROP TABLE IF EXISTS temp.merge_projects
+    '''
+    SQL_COUNT_SOURCE = '''
+        SELECT
+            COUNT(*),
+            TOTAL(s.date_end > s.date_start AND m.id IS NOT NULL)
+        FROM source.times s
+        LEFT JOIN temp.merge_projects m ON m.source_id = s.project_id
+    '''
+    SQL_LAST_ROWID = '''
+        SELECT IFNULL(MAX(rowid), 0) FROM main.times
+    '''
+    SQL_FIRST_SOURCE_START = '''
+        SELECT MIN(date_start) FROM source.times
+    '''
+    # a target session overlaps [s.date_start, s.date_end) when it starts
+    # before the end and ends after the start; no session is longer than
+    # :max_duration, which bounds the index range to scan. Archived
+    # sessions are looked for in temp.archived_times; before
+    # :archived_before the archive can't tell and nothing is merged
+    SQL_MERGE_TIMES = '''
+        INSERT INTO main.times (project_id, date_start, date_end, duration)
+        SELECT
+            m.id,
+            s.date_start,
+            s.date_end,
+            s.date_end - s.date_start
+        FROM source.times s
+        JOIN temp.merge_projects m ON m.source_id = s.project_id
+        WHERE
+            s.date_end > s.date_start
+            AND s.date_start >= :archived_before
+            AND NOT EXISTS (
+                SELECT 1
+                FROM main.times t
+                WHERE
+                    t.project_id = m.id
+                    AND t.date_start > s.date_start - :max_duration
+                    AND t.date_start < s.date_end
+                    AND t.date_end > s.date_start
+            )
+            AND NOT EXISTS (
+                SELECT 1
+                FROM temp.archived_times a
+                WHERE
+                    a.project_id = m.id
+                    AND a.date_start > s.date_start - :max_duration
+                    AND a.date_start < s.date_end
+                    AND a.date_end > s.date_start
+            )
+        ORDER BY m.id, s.date_start
+    '''
+    # SQL_REBUILD_DAILY_TOTALS over the merged rows, added to the totals
+    SQL_ROLLUP_MERGED = '''
+        INSERT INTO main.daily_totals (project_id, day, seconds)
+        SELECT
+            project_id,
+            part_start / %(day)d * %(day)d AS day,
+            SUM(MIN(part_end, (part_start / %(day)d + 1) * %(day)d)
+                - part_start)
+        FROM (
+            WITH RECURSIVE parts(project_id, part_start, part_end) AS (
+                SELECT project_id, date_start, date_end
+                FROM main.times
+                WHERE rowid > :last_rowid
+                UNION ALL
+                SELECT
+                    project_id,
+                    (part_start / %(day)d + 1) * %(day)d,
+                    part_end
+                FROM parts
+                WHERE (part_start / %(day)d + 1) * %(day)d < part_end
+            )
+            SELECT * FROM parts
+        )
+        GROUP BY project_id, day
+        ON CONFLICT (project_id, day)
+        DO UPDATE SET seconds = seconds + excluded.seconds
+    ''' % {"day": DAY}
+
+    def __init__(self, store):
+        self.store = store
+        self.archiver = archive.Archiver(store)
+
+    def merge(self, filename):
+        """
+        Merge the records.db ``filename`` into the store. Returns counts:
+        ``read`` (source sessions), ``merged``, ``duplicates`` (overlapping
+        ones), ``invalid`` (empty, negative or without a project) and
+        ``projects`` (created).
+        """
+        if not os.path.isfile(filename):
+            raise MergeError("No such file: %s" % filename)
+        if (os.path.exists(self.store.filename) and
+                os.path.samefile(filename, self.store.filename)):
+            raise MergeError("Can't merge a database into itself")
+
+        db = self.store.db
+        cur = db.cursor()
+        # ATTACH and DETACH can't run inside a transaction
+        cur.execute(self.SQL_ATTACH, {"filename": filename})
+        try:
+            if scalar(cur.execute(self.SQL_SOURCE_TABLES)) != 2:
+                raise MergeError("Not a Time-Line database: %s" % filename)
+
+            # archived sessions are duplicates too; the archive can't be
+            # attached within the transaction either
+            self.store.reaches_archive(0)
+            self.archiver.create_staging(cur)
+            with db:
+                stats = self.merge_source(cur)
+        finally:
+            cur.execute(self.SQL_DROP_MAP)
+            self.archiver.drop_staging(cur)
+            cur.execute(self.SQL_DETACH)
+
+        return stats
+
+    def merge_source(self, cur):
+        # expects an open transaction, the source and any archive attached
+        # and temp.archived_times created
+        cur.execute(self.SQL_ADD_PROJECTS)
+        projects = cur.rowcount
+        cur.execute(self.SQL_MAP_PROJECTS)
+        read, valid = cur.execute(self.SQL_COUNT_SOURCE).fetchone()
+
+        max_duration = self.store.max_duration()
+        archived_before = 0
+        if self.store.archive_attached:
+            max_duration = max(max_duration, self.archiver.max_duration())
+            archived_before = self.archiver.stage_sessions(
+                cur, scalar(cur.execute(self.SQL_FIRST_SOURCE_START))
+            )
+
+        last_rowid = scalar(cur.execute(self.SQL_LAST_ROWID))
+        cur.execute(self.SQL_MERGE_TIMES, {
+            "max_duration": max_duration,
+            "archived_before": archived_before
+        })
+        merged = cur.rowcount
+        cur.execute(self.SQL_ROLLUP_MERGED, {"last_rowid": last_rowid})
+        if merged:
+            self.store.add_session_stats_since(last_rowid)
+            self.store.bump_generation(cur)
+
+        return {
+            "read": read,
+            "merged": merged,
+            "duplicates": int(valid) - merged,
+            "invalid": read - int(valid),
+            "projects": projects
+        }
+
+
+metrics.registry.name_statements(Merger)
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Database instrumentation.
+
+TimeStore connections are InstrumentedConnection objects: every statement,
+fetch, commit and rollback on them is timed into the process-wide
+``registry``. Per statement it keeps call and row counts and a latency
+histogram; statements slower than the configured threshold go to the slow
+query log with their EXPLAIN QUERY PLAN. ``registry.snapshot()`` returns
+everything as a JSON-ready dict (Help > Diagnostics, ``--metrics``).
+"""
+
+import re
+import time
+import logging
+import sqlite3
+import threading
+from collections import deque
+from timeit import default_timer
+
+logger = logging.getLogger("timeline.db")
+
+WHITESPACE = re.compile(r"\s+")
+# statements EXPLAIN QUERY PLAN can describe
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+# histogram bucket i counts latencies below 2 ** i microseconds
+BUCKETS = 25
+
+
+def normalize(sql):
+    return WHITESPACE.sub(" ", sql).strip()
+
+
+class Histogram(object):
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        micros = int(seconds * 1000000)
+        self.buckets[min(micros.bit_length(), BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        # upper bound of the bucket holding the given fraction, in ms
+        wanted = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                return (2 ** i) / 1000.0
+        return 0.0
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "histogram_us": dict(
+                ("<%d" % 2 ** i, count)
+                for i, count in enumerate(self.buckets) if count
+            )
+        }
+
+
+class StatementStats(Histogram):
+    def __init__(self):
+        super(StatementStats, self).__init__()
+        self.rows = 0
+        self.errors = 0
+
+    def snapshot(self):
+        result = super(StatementStats, self).snapshot()
+        result["rows"] = self.rows
+        result["errors"] = self.errors
+        return result
+
+
+class Metrics(object):
+    """
+    Thread-safe collector shared by every instrumented connection of the
+    process. ``slow_ms`` of None disables the slow query log.
+    """
+    SLOW_MS = 100
+    SLOW_LOG_SIZE = 50
+    # labels remembered by statement text, normalizing is the costly part
+    MAX_SEEN = 1000
+
+    def __init__(self, slow_ms=SLOW_MS):
+        self.lock = threading.Lock()
+        self.slow_ms = slow_ms
+        self.labels = {}
+        self.seen = {}
+        self.sources = {}
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.statements = {}
+            self.commits = Histogram()
+            self.rollbacks = 0
+            self.syncs = 0
+            self.lock_errors = 0
+            self.errors = 0
+            self.slow = deque(maxlen=self.SLOW_LOG_SIZE)
+
+    def configure(self, slow_ms=SLOW_MS):
+        self.slow_ms = slow_ms
+
+    def name_statements(self, cls):
+        # label the SQL_* constants of a class by name instead of text
+        for name in dir(cls):
+            if name.startswith("SQL_"):
+                sql = getattr(cls, name)
+                self.labels[normalize(sql)] = "%s.%s" % (cls.__name__, name)
+        self.seen.clear()
+
+    def add_source(self, name, stats):
+        # extra counters (e.g. cache hits) included in snapshots
+        self.sources[name] = stats
+
+    def label(self, sql):
+        label = self.seen.get(sql)
+        if label is None:
+            text = normalize(sql)
+            label = self.labels.get(text, text[:200])
+            if len(self.seen) < self.MAX_SEEN:
+                self.seen[sql] = label
+        return label
+
+    def statement(self, sql, seconds, rows=0, error=None):
+        label = self.label(sql)
+        with self.lock:
+            stats = self.statements.get(label)
+            if stats is None:
+                stats = self.statements[label] = StatementStats()
+            stats.add(seconds)
+            stats.rows += max(rows, 0)
+            if error is not None:
+                stats.errors += 1
+                self.errors += 1
+                if is_lock_error(error):
+                    self.lock_errors += 1
+        return label
+
+    def fetched(self, sql, rows):
+        label = self.label(sql)
+        with self.lock:
+            stats = self.statements.get(label)
+            if stats is not None:
+                stats.rows += rows
+
+    def commit(self, seconds, synced):
+        with self.lock:
+            self.commits.add(seconds)
+            if synced:
+                self.syncs += 1
+
+    def rollback(self):
+        with self.lock:
+            self.rollbacks += 1
+
+    def is_slow(self, seconds):
+        return self.slow_ms is not None and seconds * 1000 >= self.slow_ms
+
+    def slow_query(self, label, sql, seconds, plan):
+        entry = {
+            "time": int(time.time()),
+            "statement": label,
+            "ms": round(seconds * 1000, 3),
+            "plan": plan
+        }
+        with self.lock:
+            self.slow.append(entry)
+        logger.info("slow query (%.1f ms): %s %s", seconds * 1000, label,
+                    plan)
+
+    def snapshot(self):
+        with self.lock:
+            result = {
+                "since": int(self.started),
+                "statements": dict(
+                    (label, stats.snapshot())
+                    for label, stats in self.statements.items()
+                ),
+                "commits": self.commits.snapshot(),
+                "rollbacks": self.rollbacks,
+                "syncs": self.syncs,
+                "errors": self.errors,
+                "lock_errors": self.lock_errors,
+                "slow_ms": self.slow_ms,
+                "slow_queries": list(self.slow)
+            }
+        for name, stats in self.sources.items():
+            result[name] = stats()
+        return result
+
+
+def is_lock_error(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+registry = Metrics()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor timing execute/executemany into the connection's metrics. Rows
+    are the rowcount of writes plus what fetchmany/fetchall return; rows
+    read with fetchone or by iterating stay uncounted, those loops are the
+    hot paths and run at C speed.
+    """
+
+    def run(self, method, sql, params):
+        metrics = self.connection.metrics
+        start = default_timer()
+        try:
+            method(sql, params)
+        except sqlite3.Error as e:
+            metrics.statement(sql, default_timer() - start, 0, e)
+            raise
+        seconds = default_timer() - start
+
+        label = metrics.statement(sql, seconds, self.rowcount)
+        if metrics.is_slow(seconds):
+            metrics.slow_query(label, sql, seconds,
+                               self.connection.explain(sql))
+        self.last_sql = sql
+        return self
+
+    def execute(self, sql, params=()):
+        return self.run(super(InstrumentedCursor, self).execute, sql, params)
+
+    def executemany(self, sql, params):
+        return self.run(super(InstrumentedCursor, self).executemany, sql,
+                        params)
+
+    def count(self, rows):
+        sql = getattr(self, "last_sql", None)
+        if sql is not None and rows:
+            self.connection.metrics.fetched(sql, rows)
+
+    def fetchmany(self, *args):
+        rows = super(InstrumentedCursor, self).fetchmany(*args)
+        self.count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super(InstrumentedCursor, self).fetchall()
+        self.count(len(rows))
+        return rows
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Connection whose cursors (including the ``execute`` shortcuts) are
+    InstrumentedCursors and whose commits, explicit or through ``with``,
+    are timed. Pass as ``factory`` to sqlite3.connect.
+    """
+    metrics = registry
+    # commits that sync the log to disk; in WAL mode with synchronous =
+    # NORMAL syncs only happen at checkpoints
+    sync_on_commit = True
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super(InstrumentedConnection, self).cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, params):
+        return self.cursor().executemany(sql, params)
+
+    def pending(self):
+        # whether a transaction is open. Python 2 has no in_transaction;
+        # its sqlite3 only opens one for a write, so there rows changed
+        # since the last commit or rollback tell
+        try:
+            return self.in_transaction
+        except AttributeError:
+            return self.total_changes != self.__dict__.get("settled", 0)
+
+    def commit(self):
+        in_transaction = self.pending()
+        start = default_timer()
+        super(InstrumentedConnection, self).commit()
+        self.settled = self.total_changes
+        if in_transaction:
+            self.metrics.commit(default_timer() - start, self.sync_on_commit)
+
+    def rollback(self):
+        if self.pending():
+            self.metrics.rollback()
+        super(InstrumentedConnection, self).rollback()
+        self.settled = self.total_changes
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # the context manager commits in C, bypassing commit() above
+        # (Python 2 calls the methods, which count themselves)
+        if not hasattr(self, "in_transaction"):
+            return super(InstrumentedConnection, self).__exit__(
+                exc_type, exc_value, traceback
+            )
+
+        in_transaction = self.in_transaction
+        start = default_timer()
+        result = super(InstrumentedConnection, self).__exit__(
+            exc_type, exc_value, traceback
+        )
+        if in_transaction:
+            if exc_type is None:
+                self.metrics.commit(default_timer() - start,
+                                    self.sync_on_commit)
+            else:
+                self.metrics.rollback()
+        return result
+
+    def explain(self, sql):
+        # EXPLAIN QUERY PLAN with the parameters left unbound (NULL)
+        if not normalize(sql).upper().startswith(EXPLAINABLE):
+            return None
+        try:
+            cur = super(InstrumentedConnection, self).cursor()
+            rows = cur.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+        except sqlite3.Error:
+            return None
+        return [row[-1] for row in rows]
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Versioned schema migrations for records.db.
+
+The schema version is stored in ``PRAGMA user_version``. Every step upgrades
+the database by exactly one version inside its own transaction, so an
+interrupted upgrade leaves the file at the last completed version and is
+resumed on the next start.
+"""
+
+import sqlite3
+from timeline.results import scalar
+
+DAY = 86400
+
+# splits every session at UTC midnight and sums the parts per project and day
+SQL_REBUILD_DAILY_TOTALS = '''
+    INSERT INTO daily_totals (project_id, day, seconds)
+    SELECT
+        project_id,
+        part_start / %(day)d * %(day)d AS day,
+        SUM(MIN(part_end, (part_start / %(day)d + 1) * %(day)d) - part_start)
+    FROM (
+        WITH RECURSIVE parts(project_id, part_start, part_end) AS (
+            SELECT project_id, date_start, date_end
+            FROM times
+            WHERE date_end > date_start
+            UNION ALL
+            SELECT
+                project_id,
+                (part_start / %(day)d + 1) * %(day)d,
+                part_end
+            FROM parts
+            WHERE (part_start / %(day)d + 1) * %(day)d < part_end
+        )
+        SELECT * FROM parts
+    )
+    GROUP BY project_id, day
+''' % {"day": DAY}
+
+
+def migration_0001_base_tables(cur):
+    # the original (unversioned) layout, kept as-is so existing files match
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS times (
+            project_id INTEGER,
+            date_start INTEGER,
+            date_end INTEGER,
+            duration INTEGER
+        )
+    ''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS projects (
+            name VARCHAR(255)
+        )
+    ''')
+
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            name VARCHAR(255),
+            value VARCHAR(255)
+        )
+    ''')
+
+
+def migration_0002_indexes(cur):
+    # unique indexes below would fail on duplicates left by older versions:
+    # keep the most recent value of every setting ...
+    cur.execute('''
+        DELETE FROM settings
+        WHERE rowid NOT IN (
+            SELECT MAX(rowid)
+            FROM settings
+            GROUP BY name COLLATE NOCASE
+        )
+    ''')
+
+    # ... and fold case-insensitive duplicate projects into the oldest one
+    cur.execute('''
+        UPDATE times
+        SET project_id = (
+            SELECT MIN(p2.rowid)
+            FROM projects AS p1, projects AS p2
+            WHERE
+                p1.rowid = times.project_id
+                AND p2.name = p1.name COLLATE NOCASE
+        )
+        WHERE project_id IN (
+            SELECT rowid
+            FROM projects
+        )
+    ''')
+
+    cur.execute('''
+        DELETE FROM projects
+        WHERE rowid NOT IN (
+            SELECT MIN(rowid)
+            FROM projects
+            GROUP BY name COLLATE NOCASE
+        )
+    ''')
+
+    # report filter (project + range) and project deletion
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS times_project_start
+        ON times (project_id, date_start)
+    ''')
+
+    # report over all projects
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS times_start_end
+        ON times (date_start, date_end)
+    ''')
+
+    cur.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS settings_name
+        ON settings (name COLLATE NOCASE)
+    ''')
+
+    cur.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS projects_name
+        ON projects (name COLLATE NOCASE)
+    ''')
+
+
+def migration_0003_daily_totals(cur):
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            project_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (project_id, day)
+        ) WITHOUT ROWID
+    ''')
+
+    # covering index for reports over all projects
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS daily_totals_day
+        ON daily_totals (day, project_id, seconds)
+    ''')
+
+    cur.execute("DELETE FROM daily_totals")
+    cur.execute(SQL_REBUILD_DAILY_TOTALS)
+
+
+def migration_0004_duration_index(cur):
+    # MAX(duration) bounds how far back a session overlapping a range can
+    # start, so range scans on date_start get a lower bound too
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS times_duration
+        ON times (duration)
+    ''')
+
+
+def migration_0005_write_generation(cur):
+    # bumped in every transaction that changes times, so caches of derived
+    # results can tell whether they are still current
+    cur.execute('''
+        INSERT OR IGNORE INTO settings (name, value)
+        VALUES ('write_generation', 0)
+    ''')
+
+
+def migration_0006_foreign_keys(cur):
+    # SQLite can't add constraints to existing tables: build new ones with
+    # explicit INTEGER PRIMARY KEYs (same values as the old rowids, which
+    # the journal and the caches refer to, and which VACUUM would otherwise
+    # renumber) and cascading references to projects, then swap them in.
+    # Rows of projects that no longer exist are dropped on the way.
+    cur.execute('''
+        CREATE TABLE projects_new (
+            id INTEGER PRIMARY KEY,
+            name VARCHAR(255)
+        )
+    ''')
+    cur.execute('''
+        INSERT INTO projects_new (id, name)
+        SELECT rowid, name
+        FROM projects
+    ''')
+
+    cur.execute('''
+        CREATE TABLE times_new (
+            id INTEGER PRIMARY KEY,
+            project_id INTEGER NOT NULL
+                REFERENCES projects (id) ON DELETE CASCADE,
+            date_start INTEGER,
+            date_end INTEGER,
+            duration INTEGER
+        )
+    ''')
+    cur.execute('''
+        INSERT INTO times_new (id, project_id, date_start, date_end, duration)
+        SELECT t.rowid, t.project_id, t.date_start, t.date_end, t.duration
+        FROM times AS t
+        JOIN projects_new AS p ON p.id = t.project_id
+        ORDER BY t.rowid
+    ''')
+
+    cur.execute('''
+        CREATE TABLE daily_totals_new (
+            project_id INTEGER NOT NULL
+                REFERENCES projects (id) ON DELETE CASCADE,
+            day INTEGER NOT NULL,
+            seconds INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (project_id, day)
+        ) WITHOUT ROWID
+    ''')
+    cur.execute('''
+        INSERT INTO daily_totals_new (project_id, day, seconds)
+        SELECT t.project_id, t.day, t.seconds
+        FROM daily_totals AS t
+        JOIN projects_new AS p ON p.id = t.project_id
+    ''')
+
+    # foreign keys are off while migrating, so nothing cascades here
+    for table in ("times", "daily_totals", "projects"):
+        cur.execute("DROP TABLE %s" % table)
+        cur.execute("ALTER TABLE %s_new RENAME TO %s" % (table, table))
+
+    # the indexes went with the old tables
+    cur.execute('''
+        CREATE UNIQUE INDEX projects_name
+        ON projects (name COLLATE NOCASE)
+    ''')
+    cur.execute('''
+        CREATE INDEX times_project_start
+        ON times (project_id, date_start)
+    ''')
+    cur.execute('''
+        CREATE INDEX times_start_end
+        ON times (date_start, date_end)
+    ''')
+    cur.execute('''
+        CREATE INDEX times_duration
+        ON times (duration)
+    ''')
+    cur.execute('''
+        CREATE INDEX daily_totals_day
+        ON daily_totals (day, project_id, seconds)
+    ''')
+
+
+def migration_0007_session_stats(cur):
+    # per project and month sketches of the session lengths (see
+    # stats.SessionSketch); TimeStore fills the table from the sessions
+    # when it was just created
+    cur.execute('''
+        CREATE TABLE session_stats (
+            project_id INTEGER NOT NULL
+                REFERENCES projects (id) ON DELETE CASCADE,
+            month INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            total_sq INTEGER NOT NULL,
+            longest INTEGER NOT NULL,
+            buckets BLOB NOT NULL,
+            heatmap BLOB NOT NULL,
+            days INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (project_id, month)
+        ) WITHOUT ROWID
+    ''')
+    cur.execute('''
+        CREATE INDEX session_stats_month
+        ON session_stats (month)
+    ''')
+
+
+# ordered list of steps, step N upgrades the schema to version N
+MIGRATIONS = [
+    migration_0001_base_tables,
+    migration_0002_indexes,
+    migration_0003_daily_totals,
+    migration_0004_duration_index,
+    migration_0005_write_generation,
+    migration_0006_foreign_keys,
+    migration_0007_session_stats,
+]
+
+# the version creating session_stats
+SESSION_STATS_VERSION = 7
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# PRAGMA auto_vacuum value
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def get_version(db):
+    return int(scalar(db.execute("PRAGMA user_version")))
+
+
+def migrate(db, target=SCHEMA_VERSION):
+    """
+    Upgrade ``db`` (a sqlite3 connection) to ``target``.
+    Returns the list of applied versions.
+    """
+    version = get_version(db)
+
+    if version > SCHEMA_VERSION:
+        raise sqlite3.DatabaseError(
+            "Database schema version %d is newer than supported (%d)"
+            % (version, SCHEMA_VERSION)
+        )
+
+    if version == 0:
+        # only effective on a brand new file
+        db.execute('PRAGMA encoding="UTF-8"')
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+    applied = []
+    cur = db.cursor()
+
+    for number in range(version + 1, target + 1):
+        try:
+            cur.execute("BEGIN")
+            MIGRATIONS[number - 1](cur)
+            # PRAGMA can't take bound parameters
+            cur.execute("PRAGMA user_version = %d" % number)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        applied.append(number)
+
+    enable_incremental_vacuum(db)
+
+    return applied
+
+
+def enable_incremental_vacuum(db):
+    # lets deletions give pages back to the file system in small steps;
+    # older files only switch with a full VACUUM, which can't run in a
+    # transaction and so isn't a migration step
+    mode = int(scalar(db.execute("PRAGMA auto_vacuum")))
+    if mode != AUTO_VACUUM_INCREMENTAL:
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("VACUUM")
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Location of records.db without Qt. Mirrors where QSettings (IniFormat,
+UserScope) puts the application's settings file.
+"""
+
+import os
+import sys
+
+APP_NAME = "Time-Line"
+DB_NAME = "records.db"
+
+
+def get_config_dir():
+    if sys.platform.startswith("win"):
+        base = os.environ.get("APPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CONFIG_HOME") or \
+            os.path.join(os.path.expanduser("~"), ".config")
+
+    return os.path.join(base, APP_NAME)
+
+
+def get_db_filename(create=True):
+    dir = get_config_dir()
+    db = os.path.join(dir, DB_NAME)
+
+    if create:
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+
+        if not os.path.exists(db):
+            with open(db, 'a'):
+                os.utime(db, None)
+
+    return db
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
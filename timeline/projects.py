@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+In-memory project list shared by every view of the projects table.
+
+Loaded once, kept sorted case-insensitively and updated in place with
+binary-search insertion and removal; views subscribe as listeners.
+The sorted keys double as a prefix search index, and a trigram index for
+fuzzy matching is built on first use and kept in sync from then on.
+"""
+
+import heapq
+from bisect import bisect_left
+from itertools import islice
+
+# sorts after any character a name can contain
+KEY_END = u"\uffff"
+
+# what COLLATE NOCASE folds: ASCII letters only
+ASCII_LOWER = dict((code, code + 32) for code in range(ord("A"), ord("Z") + 1))
+
+
+def sort_key(name):
+    try:
+        return name.casefold()
+    except AttributeError:
+        # Python 2
+        return name.lower()
+
+
+def nocase(name):
+    # the name as the projects_name unique index compares it
+    try:
+        return name.translate(ASCII_LOWER)
+    except TypeError:
+        # Python 2 byte string
+        return name.lower()
+
+
+def trigrams(key):
+    padded = "  " + key + " "
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class ProjectList(object):
+    # names scored per fuzzy search
+    MAX_CANDIDATES = 500
+
+    def __init__(self):
+        self.keys = []
+        self.names = []
+        self.ids = []
+        self.by_id = {}
+        self.listeners = []
+        # trigram -> set of ids, None until the first fuzzy search
+        self.grams = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self, rows):
+        """
+        Replace the contents with (id, name) rows, in any order.
+        """
+        rows = sorted(rows, key=lambda row: sort_key(row[1]))
+
+        for listener in self.listeners:
+            listener.projects_resetting()
+
+        self.ids = [row[0] for row in rows]
+        self.names = [row[1] for row in rows]
+        self.keys = [sort_key(name) for name in self.names]
+        self.by_id = dict(zip(self.ids, self.names))
+        self.grams = None
+
+        for listener in self.listeners:
+            listener.projects_reset()
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def find(self, name):
+        """
+        Position of the name the database would take for ``name``, or -1.
+        Names are sorted on their full case folding but, like COLLATE
+        NOCASE, only match ignoring the case of ASCII letters: 'Ärger'
+        and 'ärger' are two projects.
+        """
+        key = sort_key(name)
+        name = nocase(name)
+        index = bisect_left(self.keys, key)
+        while index < len(self.keys) and self.keys[index] == key:
+            if nocase(self.names[index]) == name:
+                return index
+            index += 1
+        return -1
+
+    def index_of(self, id):
+        if id not in self.by_id:
+            return -1
+
+        # among the names sorting the same, the one with this id
+        key = sort_key(self.by_id[id])
+        index = bisect_left(self.keys, key)
+        while index < len(self.keys) and self.keys[index] == key:
+            if self.ids[index] == id:
+                return index
+            index += 1
+        return -1
+
+    def name_of(self, id):
+        return self.by_id.get(id)
+
+    # search
+
+    def prefix(self, text, limit=10):
+        """
+        Up to ``limit`` (id, name) pairs whose name starts with ``text``,
+        case-insensitively, in list order.
+        """
+        key = sort_key(text)
+        start = bisect_left(self.keys, key)
+        end = min(bisect_left(self.keys, key + KEY_END), start + limit)
+        return list(zip(self.ids[start:end], self.names[start:end]))
+
+    def fuzzy(self, text, limit=10):
+        """
+        Up to ``limit`` (id, name) pairs sharing the most trigrams with
+        ``text`` (at least half of them), best first.
+        """
+        if self.grams is None:
+            self.grams = {}
+            for id, key in zip(self.ids, self.keys):
+                for gram in trigrams(key):
+                    self.grams.setdefault(gram, set()).add(id)
+
+        empty = set()
+        postings = sorted((self.grams.get(gram, empty)
+                           for gram in trigrams(sort_key(text))), key=len)
+        # a name sharing at least half the trigrams is in one of the
+        # rarest len - need + 1 postings, the common ones only score
+        need = (len(postings) + 1) // 2
+        candidates = set()
+        for posting in postings[:len(postings) - need + 1]:
+            room = self.MAX_CANDIDATES - len(candidates)
+            if room <= 0:
+                break
+            # trigrams half the names share don't single out anything,
+            # keep the keystroke cost bounded
+            candidates.update(islice(posting, room))
+
+        scores = {}
+        for id in candidates:
+            score = sum(1 for posting in postings if id in posting)
+            if score >= need:
+                scores[id] = score
+
+        # ties go to the shorter name
+        best = heapq.nlargest(
+            limit, scores,
+            key=lambda id: (scores[id], -len(self.by_id[id]))
+        )
+        return [(id, self.by_id[id]) for id in best]
+
+    def search(self, text, limit=10):
+        # prefix matches first, topped up with fuzzy ones
+        result = self.prefix(text, limit)
+        if len(result) < limit and len(text) >= 2:
+            seen = set(id for id, name in result)
+            for id, name in self.fuzzy(text, limit):
+                if id not in seen and len(result) < limit:
+                    result.append((id, name))
+        return result
+
+    def add(self, id, name):
+        key = sort_key(name)
+        index = bisect_left(self.keys, key)
+
+        for listener in self.listeners:
+            listener.project_inserting(index)
+
+        self.keys.insert(index, key)
+        self.names.insert(index, name)
+        self.ids.insert(index, id)
+        self.by_id[id] = name
+        if self.grams is not None:
+            for gram in trigrams(key):
+                self.grams.setdefault(gram, set()).add(id)
+
+        for listener in self.listeners:
+            listener.project_inserted(index)
+        return index
+
+    def remove(self, id):
+        index = self.index_of(id)
+        if index < 0:
+            return -1
+
+        name = self.names[index]
+
+        for listener in self.listeners:
+            listener.project_removing(index)
+
+        del self.keys[index]
+        del self.names[index]
+        del self.ids[index]
+        del self.by_id[id]
+        if self.grams is not None:
+            for gram in trigrams(sort_key(name)):
+                self.grams[gram].discard(id)
+
+        for listener in self.listeners:
+            listener.project_removed(index)
+        return index
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
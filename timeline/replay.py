@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Accelerated replay of the timers, without Qt or a display.
+
+A Replay drives SessionTracker the way MainWindow does: timers start and
+stop at the clock's time, every tick of the TickScheduler is a heartbeat,
+and the first launch after a crash recovers the journal. It runs on a
+SimulatedClock and a database of its own, from a scripted or recorded
+stream of events, and counts the journal writes, statements and commits
+the timers cost.
+
+Between events the clock jumps from one due heartbeat to the next, as the
+ticks in between could only redraw the display, so a year of timers
+replays in seconds. ``exact`` runs every tick instead, to check that
+skipping them changes nothing.
+
+Scripts have one event per line, ``#`` starting a comment:
+
+    0      start  Writing
+    +25m   start  Email
+    +5m    stop   Email
+    +2h    hide
+    +30m   show
+    +1h    crash
+    +10m   launch
+    9h     stop-all
+
+Times are from the start of the replay, or after the event before with
+``+``, in seconds or with s, m, h and d units (``1h30m``). ``hide`` and
+``show`` switch between coarse and per-second ticks (``show`` ticks at
+once, as restoring a minimised window does), ``crash`` kills the
+application, ``launch`` starts it again and ``quit`` closes it, stopping
+the timers.
+Any other event launches the application if it isn't running. At the end
+the application is quit, after a last launch when it had crashed.
+
+    python -m timeline.replay week.txt [--exact] [--db replayed.db]
+    python -m timeline.replay --sessions records.db
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import heapq
+import shutil
+import calendar
+import tempfile
+import argparse
+from collections import namedtuple
+from timeit import default_timer
+from timeline import metrics
+from timeline.clock import SimulatedClock, FINE_INTERVAL, COARSE_INTERVAL, \
+    next_tick
+from timeline.storage import TimeStore
+from timeline.journal import SessionJournal
+from timeline.session import SessionTracker
+from timeline.results import first
+
+Event = namedtuple("Event", ["time", "action", "project"])
+
+ACTIONS = ("start", "stop", "stop-all", "hide", "show", "crash", "launch",
+           "quit")
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+PART = re.compile(r"(\d+(?:\.\d*)?)([smhd]?)", re.I)
+DURATION = re.compile(r"^(?:\d+(?:\.\d*)?[smhd]?)+$", re.I)
+WRITES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+# 2020-01-06, a Monday
+START = 1578268800
+
+
+class ScriptError(ValueError):
+    pass
+
+
+def parse_seconds(text):
+    # 90, 1.5h or 1h30m
+    if not DURATION.match(text):
+        raise ScriptError("invalid time: %r" % text)
+    return int(round(sum(float(number) * UNITS[unit.lower() or "s"]
+                         for number, unit in PART.findall(text))))
+
+
+def parse_script(lines, start=START):
+    # Events of the lines of a script, at absolute times from ``start``
+    now = start
+    for number, line in enumerate(lines, 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+
+        fields = line.split(None, 2)
+        try:
+            if fields[0].startswith("+"):
+                at = now + parse_seconds(fields[0][1:])
+            else:
+                at = start + parse_seconds(fields[0])
+            if len(fields) < 2 or fields[1] not in ACTIONS:
+                raise ScriptError("expected one of %s" % ", ".join(ACTIONS))
+            project = fields[2] if len(fields) > 2 else None
+            if fields[1] in ("start", "stop") and not project:
+                raise ScriptError("%s needs a project" % fields[1])
+            if at < now:
+                raise ScriptError("events must be in order")
+        except ScriptError as e:
+            raise ScriptError("line %d: %s" % (number, e.args[0]))
+
+        now = at
+        yield Event(at, fields[1], project)
+
+
+def recorded_events(store):
+    """
+    Events starting and stopping the sessions of a database as they were
+    recorded, oldest first. A stop comes before a start at the same time.
+    """
+    stops = []
+    cur = store.db.cursor().execute(Replay.SQL_RECORDED)
+    for name, date_start, date_end in cur:
+        while stops and stops[0][0] <= date_start:
+            date_stop, stop = heapq.heappop(stops)
+            yield Event(date_stop, "stop", stop)
+        yield Event(date_start, "start", name)
+        heapq.heappush(stops, (max(date_end, date_start), name))
+
+    while stops:
+        date_stop, stop = heapq.heappop(stops)
+        yield Event(date_stop, "stop", stop)
+
+
+class CountingJournal(SessionJournal):
+    def __init__(self, filename, sync=False):
+        self.writes = 0
+        self.bytes = 0
+        self.resets = 0
+        super(CountingJournal, self).__init__(filename, sync)
+
+    def write(self, data):
+        self.writes += 1
+        self.bytes += len(data)
+        super(CountingJournal, self).write(data)
+
+    def reset(self):
+        self.resets += 1
+        super(CountingJournal, self).reset()
+
+
+class Replay(object):
+    SQL_TOTALS = '''
+        SELECT COUNT(*), TOTAL(duration)
+        FROM times
+    '''
+    SQL_RECORDED = '''
+        SELECT p.name, t.date_start, t.date_end
+        FROM times AS t
+        JOIN projects AS p ON p.id = t.project_id
+        ORDER BY t.date_start
+    '''
+
+    def __init__(self, filename, start=START, exact=False, hidden=False):
+        self.filename = filename
+        self.clock = SimulatedClock(start)
+        self.exact = exact
+        self.hidden = hidden
+        self.interval = COARSE_INTERVAL if hidden else FINE_INTERVAL
+
+        self.store = TimeStore(filename)
+        # statements of the replay only, named like the global ones
+        self.metrics = metrics.Metrics(slow_ms=None)
+        self.metrics.labels = metrics.registry.labels
+        self.store.db.metrics = self.metrics
+        self.totals = first(self.store.db.execute(self.SQL_TOTALS))
+
+        self.project_ids = {}
+        self.journal = None
+        self.tracker = None
+        self.crashed = False
+        # {project_id: date_start} of the timers the user has running
+        self.started = {}
+
+        self.events = 0
+        self.ignored = 0
+        self.launches = 0
+        self.crashes = 0
+        self.ticks = 0
+        self.heartbeats = 0
+        self.expected = 0
+        self.journal_writes = 0
+        self.journal_bytes = 0
+        self.journal_resets = 0
+        self.wall = 0.0
+        self.date_from = start
+
+    def close(self):
+        if self.tracker is not None:
+            self.quit()
+        self.store.close()
+
+    # the application
+
+    def launch(self):
+        # what MainWindow.init_app and resume_state do
+        self.launches += 1
+        self.journal = CountingJournal(
+            SessionJournal.filename_for(self.filename)
+        )
+        self.tracker = SessionTracker(self.store, self.journal)
+        self.tracker.recover()
+        self.tracker.resume()
+        self.crashed = False
+        self.interval = COARSE_INTERVAL if self.hidden else FINE_INTERVAL
+
+    def shut_down(self):
+        self.journal_writes += self.journal.writes
+        self.journal_bytes += self.journal.bytes
+        self.journal_resets += self.journal.resets
+        self.journal.close()
+        self.journal = None
+        self.tracker = None
+
+    def quit(self):
+        # closeEvent: stop every timer
+        self.stop_all()
+        self.shut_down()
+
+    def crash(self):
+        # killed: the running timers stay in the journal, what the user
+        # meant to record runs up to now
+        self.crashes += 1
+        self.stop_expected(self.started)
+        self.shut_down()
+        self.crashed = True
+
+    def stop_expected(self, project_ids):
+        now = int(self.clock())
+        for project_id in list(project_ids):
+            self.expected += now - self.started.pop(project_id)
+
+    def get_project_id(self, name):
+        id = self.project_ids.get(name)
+        if id is None:
+            id = self.store.find_project(name)
+            if id is None:
+                id = self.store.add_project(name)
+            self.project_ids[name] = id
+        return id
+
+    def start(self, name):
+        id = self.get_project_id(name)
+        if not self.tracker.start(id, self.clock()):
+            return False
+        self.started[id] = int(self.clock())
+        return True
+
+    def stop(self, name):
+        id = self.get_project_id(name)
+        if self.tracker.stop(id, self.clock()) is None:
+            return False
+        self.stop_expected([id])
+        return True
+
+    def stop_all(self):
+        self.tracker.stop_all(self.clock())
+        self.stop_expected(self.started)
+
+    def tick(self):
+        # MainWindow.update_timer, without the display
+        self.ticks += 1
+        if self.tracker.heartbeat(self.clock()):
+            self.heartbeats += 1
+
+    # the replay
+
+    def advance(self, until):
+        """
+        Run the ticks due before ``until``, then move the clock there.
+        Unless ``exact``, only the ticks at which a heartbeat is due run.
+        """
+        while self.tracker is not None and self.tracker.running:
+            at = next_tick(self.clock(), self.interval)
+            if not self.exact:
+                due = self.tracker.date_end + self.tracker.HEARTBEAT_INTERVAL
+                at = max(at, next_tick(due - 0.001, self.interval))
+            if at >= until:
+                break
+            self.clock.set(at)
+            self.tick()
+        self.clock.set(until)
+
+    def apply(self, event):
+        self.events += 1
+        self.advance(event.time)
+
+        action = event.action
+        if action == "launch":
+            if self.tracker is not None:
+                self.ignored += 1
+            else:
+                self.launch()
+            return
+        if self.tracker is None:
+            if action in ("crash", "quit"):
+                self.ignored += 1
+                return
+            self.launch()
+
+        if action == "start":
+            done = self.start(event.project)
+        elif action == "stop":
+            done = self.stop(event.project)
+        elif action == "stop-all":
+            done = self.tracker.running
+            self.stop_all()
+        elif action == "hide":
+            self.hidden = True
+            self.interval = COARSE_INTERVAL
+            done = True
+        elif action == "show":
+            self.hidden = False
+            self.interval = FINE_INTERVAL
+            if self.tracker.running:
+                self.tick()
+            done = True
+        elif action == "crash":
+            self.crash()
+            done = True
+        elif action == "quit":
+            self.quit()
+            done = True
+        else:
+            raise ScriptError("unknown action: %s" % action)
+
+        if not done:
+            self.ignored += 1
+
+    def run(self, events):
+        start = default_timer()
+        for event in events:
+            if not self.events:
+                # the replay starts with its first event
+                self.clock.set(event.time)
+                self.date_from = event.time
+            self.apply(event)
+
+        # the next start folds what a crash left
+        if self.crashed:
+            self.launch()
+        if self.tracker is not None:
+            self.quit()
+        self.wall += default_timer() - start
+
+    def result(self):
+        sessions, seconds = first(self.store.db.execute(self.SQL_TOTALS))
+        sessions -= self.totals[0]
+        seconds = int(seconds - self.totals[1])
+
+        snapshot = self.metrics.snapshot()
+        texts = dict((label, text)
+                     for text, label in self.metrics.labels.items())
+        statements = snapshot["statements"]
+        writes = [label for label in statements if texts.get(
+            label, label
+        ).split(None, 1)[0].upper() in WRITES]
+
+        database = {
+            "statements": sum(stats["count"] for stats in statements.values()),
+            "writes": sum(statements[label]["count"] for label in writes),
+            "rows_written": sum(statements[label]["rows"] for label in writes),
+            "commits": snapshot["commits"]["count"],
+            "syncs": snapshot["syncs"],
+            "rollbacks": snapshot["rollbacks"],
+            "by_statement": dict((label, stats["count"])
+                                 for label, stats in statements.items())
+        }
+        journal = {
+            "writes": self.journal_writes,
+            "bytes": self.journal_bytes,
+            "resets": self.journal_resets
+        }
+
+        hours = (self.clock() - self.date_from) / 3600.0
+        timer_hours = self.expected / 3600.0
+
+        def per_timer_hour(count):
+            return round(count / timer_hours, 3) if timer_hours else None
+
+        return {
+            "events": self.events,
+            "ignored": self.ignored,
+            "launches": self.launches,
+            "crashes": self.crashes,
+            "exact": self.exact,
+            "ticks": self.ticks,
+            "heartbeats": self.heartbeats,
+            "sessions": sessions,
+            "seconds": {
+                "expected": self.expected,
+                "saved": seconds,
+                "lost": self.expected - seconds
+            },
+            "simulated_hours": round(hours, 3),
+            "timer_hours": round(timer_hours, 3),
+            "journal": journal,
+            "database": database,
+            "per_timer_hour": {
+                "journal_writes": per_timer_hour(journal["writes"]),
+                "database_writes": per_timer_hour(database["writes"]),
+                "commits": per_timer_hour(database["commits"])
+            },
+            "wall_seconds": round(self.wall, 3),
+            "simulated_hours_per_second":
+                round(hours / self.wall) if self.wall else None
+        }
+
+
+def parse_start(text):
+    # YYYY-MM-DD (UTC) to a timestamp, argparse type
+    try:
+        return calendar.timegm(time.strptime(text, "%Y-%m-%d"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid date: %r" % text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m timeline.replay",
+        description="Replay timer events on a simulated clock and count "
+        "the writes they cost, results as JSON"
+    )
+    parser.add_argument("script", nargs="?",
+                        help="event script (- for standard input)")
+    parser.add_argument("--sessions", metavar="DB",
+                        help="replay the sessions recorded in a database "
+                        "instead, read in place")
+    parser.add_argument("--db", metavar="FILE",
+                        help="database to replay into, kept afterwards "
+                        "(default: a temporary one)")
+    parser.add_argument("--start", type=parse_start, default=START,
+                        metavar="YYYY-MM-DD",
+                        help="day the script's times count from "
+                        "(default: 2020-01-06)")
+    parser.add_argument("--exact", action="store_true",
+                        help="run every tick instead of the due heartbeats")
+    parser.add_argument("--hidden", action="store_true",
+                        help="start with the window hidden (coarse ticks)")
+    parser.add_argument("--output", metavar="FILE",
+                        help="write JSON to FILE instead of stdout")
+    args = parser.parse_args(argv)
+    if (args.script is None) == (args.sessions is None):
+        parser.error("give either a script or --sessions")
+
+    tmpdir = None
+    source = None
+    try:
+        filename = args.db
+        if filename is None:
+            tmpdir = tempfile.mkdtemp()
+            filename = os.path.join(tmpdir, "replay.db")
+
+        start = args.start
+        if args.sessions is not None:
+            source = TimeStore(args.sessions, readonly=True)
+            events = recorded_events(source)
+            start = 0
+        elif args.script == "-":
+            events = parse_script(sys.stdin, start)
+        else:
+            with open(args.script) as stream:
+                events = list(parse_script(stream, start))
+
+        replay = Replay(filename, start, args.exact, args.hidden)
+        try:
+            replay.run(events)
+            result = replay.result()
+        finally:
+            replay.close()
+    except ScriptError as e:
+        sys.stderr.write("%s\n" % e.args[0])
+        return 1
+    finally:
+        if source is not None:
+            source.close()
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(result, stream, indent=2, sort_keys=True)
+    else:
+        json.dump(result, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    return 0
+
+metrics.registry.name_statements(Replay)
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
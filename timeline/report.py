@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Report writers. Each writer consumes (period, project, seconds) rows as they
+are produced by TimeStore.iter_report and writes them to a stream right
+away, so memory use doesn't depend on the size of the report.
+"""
+
+import csv
+import json
+
+
+def format_seconds(seconds=0):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%02d:%02d:%02d" % (hours, minutes, seconds)
+
+
+class TextWriter(object):
+    # same layout as the "Show Times" window
+    LABELS = {
+        "none": "none",
+        "total": "Total time:",
+        "utc": "Dates are in UTC",
+        "zone": "Dates are in %s"
+    }
+
+    def __init__(self, show_days=True, show_empty=True, labels=None,
+                 zone=None):
+        self.show_days = show_days
+        self.show_empty = show_empty
+        self.labels = dict(self.LABELS)
+        self.labels.update(labels or {})
+        # IANA name of the report's time zone, None for UTC
+        self.zone = zone
+
+    def write(self, rows, stream):
+        total = 0
+
+        for day, project, seconds in rows:
+            total += seconds
+            if not self.show_days:
+                continue
+
+            if seconds:
+                if project is not None:
+                    day += ": " + project
+                stream.write(day + ": " + format_seconds(seconds) + "\n")
+            elif self.show_empty:
+                stream.write(day + ": " + self.labels["none"] + "\n")
+
+        if self.show_days:
+            stream.write("-" * 36 + "\n")
+
+        stream.write(self.labels["total"] + " " + format_seconds(total) +
+                     "\n\n")
+        if self.zone is None:
+            stream.write(self.labels["utc"] + "\n")
+        else:
+            stream.write(self.labels["zone"] % self.zone + "\n")
+        return total
+
+
+class CsvWriter(object):
+    def __init__(self, show_empty=False):
+        self.show_empty = show_empty
+
+    def write(self, rows, stream):
+        total = 0
+        writer = csv.writer(stream, lineterminator="\n")
+        writer.writerow(["day", "project", "seconds"])
+
+        for day, project, seconds in rows:
+            total += seconds
+            if seconds or self.show_empty:
+                writer.writerow([day, project or "", seconds])
+        return total
+
+
+class JsonLinesWriter(object):
+    def __init__(self, show_empty=False):
+        self.show_empty = show_empty
+
+    def write(self, rows, stream):
+        total = 0
+
+        for day, project, seconds in rows:
+            total += seconds
+            if seconds or self.show_empty:
+                stream.write(json.dumps({
+                    "day": day,
+                    "project": project,
+                    "seconds": seconds
+                }) + "\n")
+        return total
+
+
+WRITERS = {
+    "text": TextWriter,
+    "csv": CsvWriter,
+    "json": JsonLinesWriter
+}
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Caches of report rows, keyed by (project_id, date_from, date_to,
+granularity).
+
+Entries belong to the database's write generation (see
+TimeStore.write_generation): ``validate`` with the current generation
+drops everything computed before the last write, so a hit is always the
+result a fresh query would give. The rows are the day totals of
+TimeStore.iter_report, so every presentation option (per day, empty days,
+format) renders from one entry.
+"""
+
+import os
+import json
+import sqlite3
+from collections import OrderedDict
+from timeline import metrics
+from timeline.metrics import InstrumentedConnection
+from timeline.results import scalar
+
+# rough size of a cached (day, name, seconds) row, without the name
+ROW_BYTES = 160
+
+
+def rows_size(rows):
+    return sum(ROW_BYTES + len(row[1] or "") for row in rows)
+
+
+class ReportCache(object):
+    """
+    In-memory LRU cache holding at most ``max_bytes`` of rows.
+    """
+    MAX_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def validate(self, generation):
+        if generation != self.generation:
+            if self.entries:
+                self.invalidations += 1
+            self.clear()
+            self.generation = generation
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def get(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        # most recently used last
+        self.entries[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, rows, generation):
+        # rows computed at an older generation are already stale
+        if generation != self.generation:
+            return
+
+        rows = list(rows)
+        size = rows_size(rows)
+        if size > self.max_bytes:
+            return
+
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+
+        self.entries[key] = (rows, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            key, entry = self.entries.popitem(last=False)
+            self.size -= entry[1]
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+
+class PersistentReportCache(object):
+    """
+    The same cache in a small SQLite file next to the database, so
+    separate command line runs share it. Keeps the ``max_entries`` most
+    recently used entries.
+    """
+    MAX_ENTRIES = 64
+
+    SQL_CREATE = '''
+        CREATE TABLE IF NOT EXISTS reports (
+            project_id INTEGER NOT NULL,
+            date_from INTEGER NOT NULL,
+            date_to INTEGER NOT NULL,
+            granularity TEXT NOT NULL,
+            generation INTEGER NOT NULL,
+            used INTEGER NOT NULL,
+            rows TEXT NOT NULL,
+            PRIMARY KEY (project_id, date_from, date_to, granularity)
+        )
+    '''
+    SQL_INVALIDATE = '''
+        DELETE FROM reports
+        WHERE generation != :generation
+    '''
+    SQL_GET = '''
+        SELECT rows
+        FROM reports
+        WHERE
+            project_id = :project_id
+            AND date_from = :date_from
+            AND date_to = :date_to
+            AND granularity = :granularity
+    '''
+    SQL_TOUCH = '''
+        UPDATE reports
+        SET used = (SELECT IFNULL(MAX(used), 0) + 1 FROM reports)
+        WHERE
+            project_id = :project_id
+            AND date_from = :date_from
+            AND date_to = :date_to
+            AND granularity = :granularity
+    '''
+    SQL_PUT = '''
+        INSERT OR REPLACE INTO reports (
+            project_id,
+            date_from,
+            date_to,
+            granularity,
+            generation,
+            used,
+            rows
+        ) VALUES (
+            :project_id,
+            :date_from,
+            :date_to,
+            :granularity,
+            :generation,
+            (SELECT IFNULL(MAX(used), 0) + 1 FROM reports),
+            :rows
+        )
+    '''
+    SQL_TRIM = '''
+        DELETE FROM reports
+        WHERE used <= (
+            SELECT used
+            FROM reports
+            ORDER BY used DESC
+            LIMIT 1 OFFSET :max_entries
+        )
+    '''
+
+    def __init__(self, filename, max_entries=MAX_ENTRIES):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        self.db = sqlite3.connect(filename, factory=InstrumentedConnection)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.sync_on_commit = False
+        with self.db:
+            self.db.execute(self.SQL_CREATE)
+
+    @staticmethod
+    def filename_for(db_filename):
+        return os.path.splitext(db_filename)[0] + ".cache"
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def key_params(self, key):
+        return {
+            "project_id": key[0],
+            "date_from": key[1],
+            "date_to": key[2],
+            "granularity": key[3]
+        }
+
+    def validate(self, generation):
+        if generation != self.generation:
+            with self.db:
+                cur = self.db.execute(self.SQL_INVALIDATE,
+                                      {"generation": generation})
+            if cur.rowcount > 0:
+                self.invalidations += 1
+            self.generation = generation
+
+    def get(self, key):
+        params = self.key_params(key)
+        result = self.db.execute(self.SQL_GET, params).fetchone()
+        if result is None:
+            self.misses += 1
+            return None
+
+        with self.db:
+            self.db.execute(self.SQL_TOUCH, params)
+        self.hits += 1
+        return [tuple(row) for row in json.loads(result[0])]
+
+    def put(self, key, rows, generation):
+        if generation != self.generation:
+            return
+
+        params = self.key_params(key)
+        params["generation"] = generation
+        params["rows"] = json.dumps(list(rows), separators=(",", ":"))
+        with self.db:
+            self.db.execute(self.SQL_PUT, params)
+            self.db.execute(self.SQL_TRIM,
+                            {"max_entries": self.max_entries})
+
+    def stats(self):
+        return {
+            "entries": scalar(self.db.execute("SELECT COUNT(*) FROM reports")),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations
+        }
+
+
+metrics.registry.name_statements(PersistentReportCache)
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Reading query results without materialising them.
+
+Rows stream from the cursor in ``fetchmany`` batches, so a large result
+never sits in memory whole, and come as plain tuples or as namedtuples
+(``row.name`` or ``row[1]``) built in C by ``map(Row._make, batch)``
+instead of a dict per row. Every helper takes an executed cursor, which
+``cursor.execute`` returns:
+
+    id = scalar(cur.execute(SQL_FIND_PROJECT, params))
+"""
+
+# rows fetched per round trip into SQLite
+BATCH = 1024
+
+
+def scalar(cur, default=None):
+    # first column of the first row, ``default`` without rows
+    row = cur.fetchone()
+    return row[0] if row is not None else default
+
+
+def first(cur, row_type=None):
+    # first row, None without rows
+    row = cur.fetchone()
+    if row is None or row_type is None:
+        return row
+    return row_type._make(row)
+
+
+def iter_rows(cur, row_type=None, batch=BATCH):
+    """
+    Lazily yield the rows of ``cur``, as ``row_type`` (a namedtuple class)
+    when given. The cursor must not run another statement until the
+    generator is exhausted, so long-lived iterations get their own cursor.
+    """
+    while True:
+        rows = cur.fetchmany(batch)
+        if not rows:
+            return
+        if row_type is not None:
+            rows = map(row_type._make, rows)
+        for row in rows:
+            yield row
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,580 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Local HTTP/JSON API for scripts and editor plugins (Python 3, asyncio).
+
+    GET  /projects
+    POST /projects           {"name": "..."}
+    GET  /timers
+    POST /timers/start       {"project": "...", "create": false}
+    POST /timers/stop        {"project": "..."} or {"all": true}
+    POST /timers/heartbeat
+    GET  /report?from=YYYY-MM-DD&to=YYYY-MM-DD&project=...&by_project=1
+                 &tz=ZONE&granularity=day|week|month|quarter|year
+
+Reads run on a small pool of threads, each with its own read-only
+connection. Writes are queued to a single writer task, which hands them in
+order to one ``Writer``: its own TimeStore and SessionTracker when run
+standalone (``python -m timeline serve``), the GUI's when embedded in it.
+Listens on the loopback interface or a Unix socket; there is no
+authentication. Against web pages (cross-site requests, DNS rebinding)
+requests with an Origin header or a Host other than the loopback one are
+refused, and POST bodies must be sent as application/json, which a page
+can't do without the browser asking first.
+"""
+
+import json
+import time
+import signal
+import sqlite3
+import asyncio
+import calendar
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from timeline import metrics, aggregate
+from timeline.storage import TimeStore
+from timeline.journal import SessionJournal
+from timeline.session import SessionTracker
+
+try:
+    from urllib.parse import urlsplit, parse_qsl
+except ImportError:
+    # Python 2
+    from urlparse import urlsplit, parse_qsl
+
+HOST = "127.0.0.1"
+PORT = 8765
+READERS = 4
+# pending connections, hundreds of clients may connect at once
+BACKLOG = 1024
+# most write jobs handed to the writer at once
+WRITE_BATCH = 256
+# largest request body accepted
+MAX_BODY = 65536
+# Host header names accepted, besides the address listened on
+LOOPBACK_HOSTS = ("localhost", "127.0.0.1", "[::1]")
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    415: "Unsupported Media Type",
+    500: "Internal Server Error"
+}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super(ApiError, self).__init__(message)
+        self.status = status
+
+
+def host_name(host):
+    # the Host header without its port, "[::1]" kept in brackets
+    if host.startswith("["):
+        return host.partition("]")[0].lower() + "]"
+    return host.partition(":")[0].lower()
+
+
+def run_jobs(jobs, store, tracker):
+    # (error, result) of every job(store, tracker), in order
+    outcomes = []
+    for job in jobs:
+        try:
+            outcomes.append((None, job(store, tracker)))
+        except Exception as e:
+            outcomes.append((e, None))
+    return outcomes
+
+
+class Writer(object):
+    """
+    The standalone writer: one thread owning the writable connection and
+    the session tracker. Its timers are detached, like those started from
+    the command line, and both see each other's through the journal.
+    """
+    detached = True
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.store = None
+        self.tracker = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.executor.submit(self.open).result()
+
+    def open(self):
+        self.store = TimeStore(self.filename)
+        journal = SessionJournal(SessionJournal.filename_for(self.filename))
+        self.tracker = SessionTracker(self.store, journal)
+
+    def run(self, jobs):
+        # timers may have been started or stopped from the command line
+        self.tracker.sync()
+        return run_jobs(jobs, self.store, self.tracker)
+
+    def submit(self, jobs):
+        # concurrent.futures.Future of run_jobs(jobs, store, tracker)
+        return self.executor.submit(self.run, jobs)
+
+    def close(self):
+        self.executor.submit(self.shutdown).result()
+        self.executor.shutdown()
+
+    def shutdown(self):
+        self.tracker.journal.close()
+        self.store.close()
+
+
+class ReaderPool(object):
+    """
+    Threads running read jobs, each on its own read-only connection opened
+    on first use.
+    """
+
+    def __init__(self, filename, size=READERS):
+        self.filename = filename
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=size)
+
+    def get_store(self):
+        store = getattr(self.local, "store", None)
+        if store is None:
+            store = self.local.store = TimeStore(self.filename,
+                                                 readonly=True)
+        return store
+
+    def get_journal(self):
+        journal = getattr(self.local, "journal", None)
+        if journal is None:
+            journal = self.local.journal = SessionJournal(
+                SessionJournal.filename_for(self.filename)
+            )
+        return journal
+
+    def submit(self, job):
+        return self.executor.submit(lambda: job(self))
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def parse_day(text, name):
+    # YYYY-MM-DD (UTC) to a timestamp
+    try:
+        return calendar.timegm(time.strptime(text, "%Y-%m-%d"))
+    except ValueError:
+        raise ApiError(400, "invalid %s: %r" % (name, text))
+
+
+def get_project_id(store, name, create=False):
+    if not name:
+        raise ApiError(400, "project is required")
+    id = store.find_project(name)
+    if id is None and create:
+        id = store.add_project(name)
+    if id is None:
+        raise ApiError(404, "unknown project: %s" % name)
+    return id
+
+
+class ApiServer(object):
+    def __init__(self, filename, writer=None, readers=READERS):
+        self.filename = filename
+        self.writer = writer if writer is not None else Writer(filename)
+        self.readers = ReaderPool(filename, readers)
+        self.queue = None
+        self.server = None
+        self.writer_task = None
+        self.loop = None
+        self.thread = None
+        self.connections = set()
+        self.hosts = LOOPBACK_HOSTS
+        self.latency = {}
+        self.errors = 0
+        self.routes = {
+            ("GET", "/projects"): self.get_projects,
+            ("POST", "/projects"): self.add_project,
+            ("GET", "/timers"): self.get_timers,
+            ("POST", "/timers/start"): self.start_timer,
+            ("POST", "/timers/stop"): self.stop_timer,
+            ("POST", "/timers/heartbeat"): self.heartbeat,
+            ("GET", "/report"): self.get_report
+        }
+
+    def stats(self):
+        # request latencies by route, a metrics source
+        result = dict(
+            ("%s %s" % route, histogram.snapshot())
+            for route, histogram in list(self.latency.items())
+        )
+        result["errors"] = self.errors
+        return result
+
+    # reads, on the reader pool
+
+    def read(self, job):
+        return asyncio.wrap_future(self.readers.submit(job))
+
+    async def get_projects(self, query, body):
+        rows = await self.read(lambda pool: [
+            project._asdict() for project in pool.get_store().projects()
+        ])
+        return {"projects": rows}
+
+    async def get_timers(self, query, body):
+        def job(pool):
+            now = int(time.time())
+            frame = pool.get_journal().frame()
+            names = {}
+            if frame:
+                names = dict(pool.get_store().project_rows())
+            return [{
+                "project_id": project_id,
+                "project": names.get(project_id),
+                "start": date_start,
+                "seconds": now - date_start
+            } for rowid, project_id, date_start, date_end, flags in frame]
+
+        return {"timers": await self.read(job)}
+
+    async def get_report(self, query, body):
+        date_to = parse_day(query.get("to", time.strftime("%Y-%m-%d",
+                                                          time.gmtime())),
+                            "to")
+        if "from" in query:
+            date_from = parse_day(query["from"], "from")
+        else:
+            date_from = date_to - 6 * aggregate.DAY
+
+        tz = None
+        if query.get("tz"):
+            try:
+                tz = aggregate.get_timezone(query["tz"])
+            except ValueError as e:
+                raise ApiError(400, e.args[0])
+        date_from = aggregate.wall_timestamp(date_from, tz)
+        date_to = aggregate.wall_timestamp(date_to + aggregate.DAY, tz) - 1
+
+        granularity = query.get("granularity", "day")
+        if granularity not in aggregate.GRANULARITIES:
+            raise ApiError(400, "unknown granularity: %s" % granularity)
+        by_project = query.get("by_project") in ("1", "true")
+
+        def job(pool):
+            store = pool.get_store()
+            project_id = 0
+            if query.get("project"):
+                project_id = get_project_id(store, query["project"])
+            return [
+                {"day": day, "project": project, "seconds": seconds}
+                for day, project, seconds in store.iter_report(
+                    project_id, date_from, date_to, by_project, tz,
+                    granularity
+                )
+            ]
+
+        rows = await self.read(job)
+        return {
+            "rows": rows,
+            "total": sum(row["seconds"] for row in rows)
+        }
+
+    # writes, queued to the single writer task
+
+    async def write(self, job):
+        future = self.loop.create_future()
+        await self.queue.put((job, future))
+        return await future
+
+    async def run_writer(self):
+        # everything queued meanwhile goes to the writer in one hand-over
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty() and len(batch) < WRITE_BATCH:
+                batch.append(self.queue.get_nowait())
+
+            try:
+                outcomes = await asyncio.wrap_future(
+                    self.writer.submit([job for job, future in batch])
+                )
+            except Exception as e:
+                outcomes = [(e, None)] * len(batch)
+
+            for (job, future), (error, result) in zip(batch, outcomes):
+                if future.cancelled():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    async def add_project(self, query, body):
+        name = (body.get("name") or "").strip()
+        if not name:
+            raise ApiError(400, "name is required")
+
+        def job(store, tracker):
+            if store.find_project(name) is not None:
+                raise ApiError(409, "project exists: %s" % name)
+            return store.add_project(name)
+
+        return {"id": await self.write(job), "name": name}
+
+    async def start_timer(self, query, body):
+        detached = self.writer.detached
+
+        def job(store, tracker):
+            id = get_project_id(store, body.get("project"),
+                                body.get("create", False))
+            if not tracker.start(id, time.time(), detached):
+                raise ApiError(409, "already running: %s"
+                               % store.project_name(id))
+            return {"project_id": id, "start": tracker.date_start(id)}
+
+        return await self.write(job)
+
+    async def stop_timer(self, query, body):
+        def job(store, tracker):
+            now = time.time()
+            if body.get("all"):
+                stopped = tracker.stop_all(now)
+            else:
+                id = get_project_id(store, body.get("project"))
+                result = tracker.stop(id, now)
+                if result is None:
+                    raise ApiError(409, "not running: %s"
+                                   % store.project_name(id))
+                stopped = [(id,) + result]
+            return [{
+                "project_id": project_id,
+                "start": date_start,
+                "end": date_end,
+                "seconds": date_end - date_start
+            } for project_id, date_start, date_end in stopped]
+
+        return {"stopped": await self.write(job)}
+
+    async def heartbeat(self, query, body):
+        def job(store, tracker):
+            tracker.tick(time.time())
+            return len(tracker)
+
+        return {"running": await self.write(job)}
+
+    # HTTP
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        if handler is None:
+            if any(path == url.path for m, path in self.routes):
+                raise ApiError(405, "method not allowed")
+            raise ApiError(404, "not found")
+
+        try:
+            body = json.loads(body.decode("utf-8")) if body else {}
+        except ValueError:
+            raise ApiError(400, "invalid JSON")
+        if not isinstance(body, dict):
+            raise ApiError(400, "expected a JSON object")
+
+        return (method, url.path), await handler(dict(parse_qsl(url.query)),
+                                                 body)
+
+    async def read_request(self, reader):
+        # (method, target, headers, body), None at the end of the stream
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            raise ApiError(400, "bad request line")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        self.check_headers(method, headers)
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise ApiError(400, "bad Content-Length")
+        if length < 0:
+            raise ApiError(400, "bad Content-Length")
+        if length > MAX_BODY:
+            raise ApiError(413, "request body too large")
+        body = await reader.readexactly(length) if length else b""
+        if version == "HTTP/1.0":
+            headers.setdefault("connection", "close")
+        return method, target, headers, body
+
+    def check_headers(self, method, headers):
+        # browsers send Origin with cross-site requests and can be made to
+        # send any Host through DNS rebinding; neither comes from a script
+        if "origin" in headers:
+            raise ApiError(403, "cross-origin requests are refused")
+        if "host" in headers and host_name(headers["host"]) not in self.hosts:
+            raise ApiError(403, "unknown host")
+        if method == "POST":
+            media_type = headers.get("content-type", "").partition(";")[0]
+            if media_type.strip().lower() != "application/json":
+                raise ApiError(415, "expected Content-Type: application/json")
+
+    async def handle(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                start = time.time()
+                route = None
+                keep_alive = False
+                try:
+                    request = await self.read_request(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    keep_alive = headers.get("connection") != "close"
+                    route, result = await self.dispatch(method, target, body)
+                    status = 200
+                except ApiError as e:
+                    status, result = e.status, {"error": e.args[0]}
+                except sqlite3.Error as e:
+                    status = 500
+                    result = {"error": "database error: %s" % e.args[0]}
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    status = 500
+                    result = {"error": "internal error: %s" % e}
+
+                if status != 200:
+                    self.errors += 1
+                self.respond(writer, status, result, keep_alive)
+                await writer.drain()
+                if route is not None:
+                    self.record(route, time.time() - start)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    def respond(self, writer, status, result, keep_alive):
+        body = json.dumps(result, separators=(",", ":")).encode("utf-8")
+        writer.write((
+            "HTTP/1.1 %d %s\r\n"
+            "Content-Type: application/json\r\n"
+            "Content-Length: %d\r\n"
+            "Connection: %s\r\n\r\n" % (
+                status, REASONS[status], len(body),
+                "keep-alive" if keep_alive else "close"
+            )
+        ).encode("latin-1") + body)
+
+    def record(self, route, seconds):
+        histogram = self.latency.get(route)
+        if histogram is None:
+            histogram = self.latency[route] = metrics.Histogram()
+        histogram.add(seconds)
+
+    # life cycle
+
+    async def start(self, host=HOST, port=PORT, path=None):
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue()
+        self.writer_task = self.loop.create_task(self.run_writer())
+        if path is None:
+            # the address listened on is accepted as Host too
+            name = "[%s]" % host if ":" in host else host
+            self.hosts = LOOPBACK_HOSTS + (name.lower(),)
+        if path is not None:
+            self.server = await asyncio.start_unix_server(
+                self.handle, path, backlog=BACKLOG
+            )
+        else:
+            self.server = await asyncio.start_server(
+                self.handle, host, port, backlog=BACKLOG
+            )
+        metrics.registry.add_source("api", self.stats)
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            # idle keep-alive connections would hold wait_closed up
+            for writer in list(self.connections):
+                writer.close()
+            await self.server.wait_closed()
+            self.writer_task.cancel()
+
+    def serve_forever(self, host=HOST, port=PORT, path=None):
+        # standalone: blocks until interrupted
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            # stop cleanly when run as a service too
+            loop.add_signal_handler(signal.SIGTERM, loop.stop)
+        except (NotImplementedError, AttributeError):
+            pass
+        try:
+            loop.run_until_complete(self.start(host, port, path))
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(self.stop())
+            loop.close()
+            self.close()
+
+    def start_thread(self, host=HOST, port=PORT, path=None):
+        """
+        Serve from a daemon thread with its own event loop, for embedding.
+        Raises the error of the bind, if any.
+        """
+        started = threading.Event()
+        errors = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.start(host, port, path))
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+        self.thread = threading.Thread(target=run, name="timeline-api")
+        self.thread.daemon = True
+        self.thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+
+    def stop_thread(self):
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.thread = None
+        self.close()
+
+    def close(self):
+        self.readers.close()
+        if isinstance(self.writer, Writer):
+            self.writer.close()
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
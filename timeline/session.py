@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Running sessions state machine, shared by the GUI and headless callers.
+Heartbeats go to the SessionJournal; TimeStore only sees the sessions when
+the journal is folded.
+
+Any number of timers run at once, one per project. They share the end of
+the last tick, so the active set is three parallel int64 arrays (rowid,
+project, start) plus one ``date_end``: a tick moves every timer by
+rewriting that one value and journaling one record, and a flush folds them
+all in one transaction.
+"""
+
+from array import array
+from timeline.aggregate import INT64
+
+
+class SessionTracker(object):
+    # seconds between folds of the journal into the database
+    DEFAULT_FLUSH_INTERVAL = 900
+    # seconds between the heartbeats of a per-second clock
+    HEARTBEAT_INTERVAL = 60
+
+    def __init__(self, store, journal, flush_interval=None):
+        self.store = store
+        self.journal = journal
+
+        if flush_interval is None:
+            flush_interval = store.get_setting(
+                "journal_flush_interval", self.DEFAULT_FLUSH_INTERVAL
+            )
+        self.flush_interval = int(flush_interval)
+
+        self.detached = False
+        self.date_end = 0
+        self.last_flush = 0
+        self.clear()
+
+    def clear(self):
+        self.rowids = array(INT64)
+        self.project_ids = array(INT64)
+        self.date_starts = array(INT64)
+
+    def __len__(self):
+        return len(self.project_ids)
+
+    def __contains__(self, project_id):
+        return project_id in self.project_ids
+
+    @property
+    def running(self):
+        return len(self.project_ids) > 0
+
+    def sessions(self):
+        # the running set as (project_id, date_start), by start
+        return list(zip(self.project_ids, self.date_starts))
+
+    def date_start(self, project_id):
+        return self.date_starts[self.project_ids.index(project_id)]
+
+    def folds(self, date_end=None):
+        # the running set as fold_sessions wants it
+        date_end = self.date_end if date_end is None else date_end
+        return [
+            (rowid, project_id, date_start, date_end)
+            for rowid, project_id, date_start in zip(
+                self.rowids, self.project_ids, self.date_starts
+            )
+        ]
+
+    def unsaved(self, date_end=None):
+        """
+        (project_id, start, end) of the running time the database doesn't
+        hold yet, up to ``date_end`` (default: the last tick). Reports can
+        add it to their results instead of flushing, which would change
+        the write generation and void every cached report.
+        """
+        date_end = self.date_end if date_end is None else int(date_end)
+        parts = []
+        for rowid, project_id, date_start in zip(
+                self.rowids, self.project_ids, self.date_starts):
+            if rowid:
+                session = self.store.get_session(rowid)
+                if session is not None:
+                    date_start = max(date_start, session.date_end)
+            if date_start < date_end:
+                parts.append((project_id, date_start, date_end))
+        return parts
+
+    def load(self, frame):
+        self.clear()
+        for rowid, project_id, date_start, date_end, flags in frame:
+            self.rowids.append(rowid)
+            self.project_ids.append(project_id)
+            self.date_starts.append(date_start)
+        self.date_end = max(record[3] for record in frame)
+        self.detached = bool(frame[0][4] & self.journal.DETACHED)
+
+    def recover(self):
+        """
+        Fold the sessions left in the journal by a crash or a kill.
+        Returns a list of (project_id, date_start, date_end), empty when
+        there was nothing to fold. Detached sessions are still running and
+        are left alone.
+        """
+        frame = self.journal.frame()
+        if not frame or frame[0][4] & self.journal.DETACHED:
+            return []
+
+        self.store.fold_sessions([record[:4] for record in frame],
+                                 stopped=True)
+        self.journal.reset()
+        return [record[1:4] for record in frame]
+
+    def resume(self, attach=True):
+        """
+        Load the sessions found in the journal as the running ones.
+        With ``attach`` the caller takes over ticking detached sessions.
+        """
+        frame = self.journal.frame()
+        if not frame:
+            self.clear()
+            return False
+
+        self.load(frame)
+        self.detached = self.detached and not attach
+        self.last_flush = self.date_end
+        return True
+
+    def sync(self):
+        """
+        Reload the running sessions from the journal, which another process
+        may have changed since, keeping the flush schedule.
+        """
+        last_flush = self.last_flush
+        if self.resume(attach=False) and last_flush:
+            self.last_flush = last_flush
+
+    def append(self):
+        self.journal.append_frame(
+            list(zip(self.rowids, self.project_ids, self.date_starts)),
+            self.date_end,
+            self.journal.DETACHED if self.detached else 0
+        )
+
+    def start(self, project_id, now, detached=False):
+        # returns False when the project's timer is already running
+        if not self.running:
+            # timers another process (the command line) put in the journal
+            # meanwhile keep running alongside
+            self.sync()
+        if project_id in self.project_ids:
+            return False
+
+        if not self.running:
+            self.detached = detached
+            self.last_flush = int(now)
+            self.journal.reset()
+
+        self.rowids.append(0)
+        self.project_ids.append(project_id)
+        self.date_starts.append(int(now))
+        self.date_end = int(now)
+        self.append()
+        return True
+
+    def tick(self, now):
+        if not self.running:
+            return
+
+        self.date_end = int(now)
+
+        if self.date_end - self.last_flush >= self.flush_interval:
+            self.flush()
+        else:
+            self.journal.tick(self.date_end)
+
+    def heartbeat(self, now):
+        """
+        ``tick`` for clocks ticking more often than HEARTBEAT_INTERVAL,
+        only once that long has passed since the journal last moved (a
+        start, stop, tick or flush). Returns True when it ticked.
+        """
+        if not self.running:
+            return False
+        if int(now) - self.date_end < self.HEARTBEAT_INTERVAL:
+            return False
+
+        self.tick(now)
+        return True
+
+    def flush(self):
+        if not self.running:
+            return
+
+        self.rowids = array(INT64, self.store.fold_sessions(self.folds()))
+        self.last_flush = self.date_end
+        self.journal.reset()
+        self.append()
+
+    def stop(self, project_id, now):
+        """
+        Stop and save the timer of one project. Returns (date_start,
+        date_end) or None when it isn't running.
+        """
+        if project_id not in self.project_ids:
+            return None
+
+        i = self.project_ids.index(project_id)
+        date_start = self.date_starts[i]
+        self.date_end = int(now)
+        self.store.fold_session(self.rowids[i], project_id, date_start,
+                                self.date_end, stopped=True)
+        self.remove(i)
+        return date_start, self.date_end
+
+    def stop_all(self, now):
+        # stop every timer in one transaction, returns their (project_id,
+        # date_start, date_end)
+        if not self.running:
+            return []
+
+        self.date_end = int(now)
+        stopped = self.folds()
+        self.store.fold_sessions(stopped, stopped=True)
+        self.journal.reset()
+        self.clear()
+        return [record[1:] for record in stopped]
+
+    def remove(self, i):
+        del self.rowids[i]
+        del self.project_ids[i]
+        del self.date_starts[i]
+        self.append()
+
+    def abort(self, project_id=None):
+        # forget a running session (all without a project) without writing
+        if project_id is None:
+            self.journal.reset()
+            self.clear()
+        elif project_id in self.project_ids:
+            self.remove(self.project_ids.index(project_id))
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Session length statistics, kept per project and UTC month.
+
+Each (project, month) row is a SessionSketch of the sessions started in
+that month: count, sum and sum of squares of the lengths, the longest one,
+a log-bucketed quantile sketch and the seconds spent per hour of the week,
+plus a bitmask of the days of the month with time, for streaks. All of it
+is mergeable, so a session is added once when it stops and any range of
+months is summarised by merging its rows, without reading ``times``.
+
+The quantile sketch keeps one counter per bucket (g^(i-1), g^i] of
+lengths, g = (1 + ACCURACY) / (1 - ACCURACY): any quantile comes back
+within ACCURACY of the true length, and a project needs a few hundred
+counters at most whatever its number of sessions.
+"""
+
+import math
+from array import array
+from operator import add
+from timeline.aggregate import INT64
+from timeline.archive import month_start, pack, unpack
+
+HOUR = 3600
+DAY = 86400
+WEEK = 7 * 24 * HOUR
+HOURS = 7 * 24
+# 1970-01-01 was a Thursday, hours of the week count from Monday 00:00
+WEEK_OFFSET = 3 * 24
+
+# relative error of quantiles
+ACCURACY = 0.02
+GAMMA = (1 + ACCURACY) / (1 - ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+# zlib level of the stored columns, rewritten whenever a session stops
+PACK_LEVEL = 1
+
+
+def bucket_of(seconds):
+    if seconds <= 1:
+        return 0
+    return int(math.ceil(math.log(seconds) / LOG_GAMMA))
+
+
+def bucket_value(index):
+    # middle of the bucket, in relative terms; bucket 0 holds the sessions
+    # of 0 and 1 second, shown as 1 unless all of them are empty
+    return 2 * GAMMA ** index / (GAMMA + 1) if index > 0 else 1
+
+
+class SessionSketch(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.total_sq = 0
+        self.longest = 0
+        # {bucket index: sessions}
+        self.buckets = {}
+        # seconds per hour of the week, UTC, Monday 00:00 first
+        self.heatmap = array(INT64, [0]) * HOURS
+        # bit N set when day N after 1970-01-01 has time
+        self.days = 0
+
+    def add(self, date_start, date_end):
+        self.add_sessions([(int(date_start), int(date_end))])
+
+    def add_sessions(self, sessions):
+        # add() of integer (date_start, date_end) pairs, the running
+        # figures kept in locals meanwhile
+        count, total, total_sq = self.count, self.total, self.total_sq
+        longest = self.longest
+        buckets = self.buckets
+        heatmap = self.heatmap
+
+        for date_start, date_end in sessions:
+            seconds = date_end - date_start
+            if seconds < 0:
+                continue
+
+            count += 1
+            total += seconds
+            total_sq += seconds * seconds
+            if seconds > longest:
+                longest = seconds
+            index = bucket_of(seconds)
+            buckets[index] = buckets.get(index, 0) + 1
+
+            weeks, rest = divmod(seconds, WEEK)
+            if weeks:
+                for hour in range(HOURS):
+                    heatmap[hour] += weeks * HOUR
+            date_end = date_start + rest
+            hour = date_start // HOUR
+            while date_start < date_end:
+                hour_end = min(date_end, (hour + 1) * HOUR)
+                heatmap[(hour + WEEK_OFFSET) % HOURS] += hour_end - date_start
+                date_start = hour_end
+                hour += 1
+
+        self.count, self.total, self.total_sq = count, total, total_sq
+        self.longest = longest
+
+    def merge(self, other):
+        self.merge_counts(other)
+        self.heatmap = array(INT64, map(add, self.heatmap, other.heatmap))
+        return self
+
+    def merge_counts(self, other):
+        # merge everything but the heatmap
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.longest = max(self.longest, other.longest)
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.days |= other.days
+
+    def mean(self):
+        return float(self.total) / self.count if self.count else 0.0
+
+    def stddev(self):
+        if self.count < 2:
+            return 0.0
+        mean = self.mean()
+        variance = float(self.total_sq) / self.count - mean * mean
+        return math.sqrt(max(variance, 0.0))
+
+    def quantile(self, q):
+        """
+        Length of the session at quantile ``q`` (0 to 1), within ACCURACY,
+        0 without sessions.
+        """
+        if not self.count:
+            return 0
+
+        # nearest rank
+        rank = max(1, int(math.ceil(q * self.count)))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return int(round(min(bucket_value(index), self.longest)))
+        return self.longest
+
+    def streak(self):
+        """
+        Longest run of consecutive days with time: (first day, number of
+        days), (None, 0) without days.
+        """
+        if not self.days:
+            return None, 0
+
+        # after N steps, bit d is left when days d to d + N all have time
+        days = self.days
+        length = 1
+        while True:
+            longer = days & (days >> 1)
+            if not longer:
+                break
+            days = longer
+            length += 1
+        first = (days & -days).bit_length() - 1
+        return first * DAY, length
+
+    def summary(self):
+        streak_start, streak_days = self.streak()
+        return {
+            "sessions": self.count,
+            "seconds": self.total,
+            "mean": int(round(self.mean())),
+            "stddev": int(round(self.stddev())),
+            "median": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "longest": self.longest,
+            "streak_days": streak_days,
+            "streak_start": streak_start
+        }
+
+    # storage
+
+    def to_row(self, month):
+        # (count, total, total_sq, longest, buckets, heatmap, days) columns
+        # of the row of ``month``, whose days it must only have
+        buckets = []
+        for index in sorted(self.buckets):
+            buckets.append(index)
+            buckets.append(self.buckets[index])
+        return (self.count, self.total, self.total_sq, self.longest,
+                pack(buckets, PACK_LEVEL), pack(self.heatmap, PACK_LEVEL),
+                self.days >> month // DAY)
+
+    @classmethod
+    def from_row(cls, month, row):
+        sketch = cls()
+        sketch.count, sketch.total, sketch.total_sq, sketch.longest = row[:4]
+        buckets = unpack(row[4])
+        sketch.buckets = dict(zip(buckets[::2], buckets[1::2]))
+        sketch.heatmap = unpack(row[5])
+        sketch.days = row[6] << month // DAY
+        return sketch
+
+
+def sketch_sessions(sessions):
+    """
+    {(project_id, month): SessionSketch} of (project_id, start, end) rows.
+    A session counts in the month it started; the days it has time in are
+    marked in the months they belong to.
+    """
+    # sessions grouped by (project_id, month) first, each sketch then
+    # adds its own in one go
+    started = {}
+    days = {}
+    # month starts by day and the month after each, computed once
+    months = {}
+    next_months = {}
+
+    for project_id, date_start, date_end in sessions:
+        date_start = int(date_start)
+        date_end = int(date_end)
+        day = date_start // DAY
+        month = months.get(day)
+        if month is None:
+            month = months[day] = month_start(date_start)
+        key = (project_id, month)
+        pairs = started.get(key)
+        if pairs is None:
+            pairs = started[key] = []
+        pairs.append((date_start, date_end))
+
+        # the UTC days [date_start, date_end) has time in, per month
+        if date_end <= date_start:
+            continue
+        while True:
+            next_month = next_months.get(month)
+            if next_month is None:
+                next_month = next_months[month] = month_start(month + 32 * DAY)
+            last = (min(date_end, next_month) - 1) // DAY
+            days[key] = days.get(key, 0) | (
+                ((1 << (last - day + 1)) - 1) << day
+            )
+            if date_end <= next_month:
+                break
+            month = next_month
+            day = month // DAY
+            key = (project_id, month)
+
+    sketches = {}
+    for key in set(started) | set(days):
+        sketch = sketches[key] = SessionSketch()
+        sketch.add_sessions(started.get(key, ()))
+        sketch.days = days.get(key, 0)
+    return sketches
+
+
+def merge_sketches(sketches):
+    """
+    A new SessionSketch of ``sketches`` merged. The heatmaps are summed
+    hour by hour over all of them at once, several times faster than
+    merging them one by one.
+    """
+    out = SessionSketch()
+    heatmaps = [out.heatmap]
+    for sketch in sketches:
+        out.merge_counts(sketch)
+        heatmaps.append(sketch.heatmap)
+    out.heatmap = array(INT64, map(sum, zip(*heatmaps)))
+    return out
+
+
+def heatmap_rows(heatmap):
+    # the hours of the week as 7 rows (Monday first) of 24 hours
+    return [list(heatmap[day * 24:day * 24 + 24]) for day in range(7)]
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,1264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Qt-free storage engine. TimeStore owns the single connection to records.db
+and is the only place that talks SQL; the windows call its methods.
+"""
+
+import os
+import sqlite3
+from array import array
+from itertools import chain, groupby
+from operator import itemgetter
+from collections import namedtuple
+from timeline import migrations
+from timeline import aggregate
+from timeline import metrics
+from timeline import archive
+from timeline import stats
+from timeline.metrics import InstrumentedConnection
+from timeline.results import scalar, first, iter_rows
+
+Project = namedtuple("Project", ["id", "name"])
+Session = namedtuple("Session", ["project_id", "date_start", "date_end"])
+
+
+def day_parts(date_start, date_end):
+    # (day, seconds) of [date_start, date_end) split at UTC midnights
+    date_start = int(date_start)
+    date_end = int(date_end)
+
+    while date_start < date_end:
+        day = date_start // migrations.DAY * migrations.DAY
+        part_end = min(date_end, day + migrations.DAY)
+        yield day, part_end - date_start
+        date_start = part_end
+
+
+def readonly_uri(filename):
+    # imported here, urllib.request adds some 30 ms to every start
+    try:
+        from urllib.request import pathname2url
+    except ImportError:
+        # Python 2
+        from urllib import pathname2url
+    return "file:%s?mode=ro" % pathname2url(os.path.abspath(filename))
+
+
+def merge_periods(rows):
+    # report rows with a period split over consecutive parts, summed back
+    for label, group in groupby(rows, itemgetter(0)):
+        totals = {}
+        for row in group:
+            totals[row[1]] = totals.get(row[1], 0) + row[2]
+        if len(totals) > 1:
+            # named rows and the empty marker of a part without time
+            totals.pop(None, None)
+        for name in sorted(totals, key=lambda x: (x or "").lower()):
+            yield label, name, totals[name]
+
+
+class TimeStore(object):
+    # negative value is in KiB
+    CACHE_SIZE = -8192
+    WRITE_GENERATION = "write_generation"
+    # id of the project being deleted, so an interrupted deletion resumes
+    DELETING_PROJECT = "deleting_project"
+    # sessions deleted per transaction
+    DELETE_BATCH = 20000
+    # pages given back to the file system per incremental vacuum step
+    VACUUM_PAGES = 1024
+    # from this many (project, month) statistics rows on, the stored ones
+    # are read with one scan of their months instead of a lookup each
+    STATS_RANGE_MIN = 64
+    # first day that isn't archived, and the last completed archive run
+    ARCHIVE_BEFORE = "archive_before"
+    ARCHIVE_BATCH = "archive_batch"
+
+    # sqlite3 keeps compiled statements in a per-connection LRU cache keyed
+    # by the SQL text, so every query lives in a constant and is reused.
+    SQL_PROJECTS = '''
+        SELECT
+            rowid AS id,
+            name AS name
+        FROM projects
+        ORDER BY name COLLATE NOCASE ASC
+    '''
+    SQL_FIND_PROJECT = '''
+        SELECT rowid
+        FROM projects
+        WHERE name = :name COLLATE NOCASE
+        LIMIT 1
+    '''
+    SQL_PROJECT_ROWS = '''
+        SELECT
+            rowid,
+            name
+        FROM projects
+        ORDER BY name COLLATE NOCASE ASC
+    '''
+    SQL_PROJECT_NAME = '''
+        SELECT name
+        FROM projects
+        WHERE rowid = :id
+    '''
+    SQL_ADD_PROJECT = '''
+        INSERT INTO projects (name)
+        VALUES (:name)
+    '''
+    SQL_COUNT_PROJECT_TIMES = '''
+        SELECT COUNT(*)
+        FROM times
+        WHERE project_id = :id
+    '''
+    # start of the last session in the next batch to delete
+    SQL_DELETE_CUT = '''
+        SELECT date_start
+        FROM times
+        WHERE project_id = :id
+        ORDER BY date_start
+        LIMIT 1 OFFSET :offset
+    '''
+    # SQL_REBUILD_DAILY_TOTALS over the batch, taken out of the totals
+    SQL_ROLLUP_SUBTRACT = '''
+        INSERT INTO daily_totals (project_id, day, seconds)
+        SELECT
+            project_id,
+            part_start / %(day)d * %(day)d AS day,
+            -SUM(MIN(part_end, (part_start / %(day)d + 1) * %(day)d)
+                 - part_start)
+        FROM (
+            WITH RECURSIVE parts(project_id, part_start, part_end) AS (
+                SELECT project_id, date_start, date_end
+                FROM times
+                WHERE
+                    project_id = :id
+                    AND date_start <= :cut
+                    AND date_end > date_start
+                UNION ALL
+                SELECT
+                    project_id,
+                    (part_start / %(day)d + 1) * %(day)d,
+                    part_end
+                FROM parts
+                WHERE (part_start / %(day)d + 1) * %(day)d < part_end
+            )
+            SELECT * FROM parts
+        )
+        GROUP BY project_id, day
+        ON CONFLICT (project_id, day)
+        DO UPDATE SET seconds = seconds + excluded.seconds
+    ''' % {"day": migrations.DAY}
+    SQL_DELETE_TIMES_UNTIL = '''
+        DELETE FROM times
+        WHERE
+            project_id = :id
+            AND date_start <= :cut
+    '''
+    # cascades to the project's times and daily_totals
+    SQL_DELETE_PROJECT = '''
+        DELETE FROM projects
+        WHERE id = :id
+    '''
+    SQL_GET_SETTING = '''
+        SELECT value
+        FROM settings
+        WHERE name = :name COLLATE NOCASE
+        LIMIT 1
+    '''
+    SQL_SET_SETTING = '''
+        INSERT OR REPLACE INTO settings (
+            name,
+            value
+        ) VALUES (:name, :value)
+    '''
+    SQL_DELETE_SETTING = '''
+        DELETE FROM settings
+        WHERE name = :name COLLATE NOCASE
+    '''
+    SQL_BUMP_GENERATION = '''
+        UPDATE settings
+        SET value = value + 1
+        WHERE name = :name COLLATE NOCASE
+    '''
+    SQL_START_SESSION = '''
+        INSERT INTO times (
+            project_id,
+            date_start,
+            date_end,
+            duration
+        ) VALUES (:p_id, :date_start, :date_end, :duration)
+    '''
+    SQL_UPDATE_SESSION = '''
+        UPDATE times
+        SET
+            date_end = :date_end,
+            duration = :date_end - date_start
+        WHERE rowid = :id
+    '''
+    SQL_GET_SESSION = '''
+        SELECT
+            project_id,
+            date_start,
+            date_end
+        FROM times
+        WHERE rowid = :id
+    '''
+    SQL_FIND_SESSION = '''
+        SELECT rowid
+        FROM times
+        WHERE
+            project_id = :p_id
+            AND date_start = :date_start
+        LIMIT 1
+    '''
+    SQL_ROLLUP_ADD = '''
+        INSERT INTO daily_totals (
+            project_id,
+            day,
+            seconds
+        ) VALUES (:p_id, :day, :seconds)
+        ON CONFLICT (project_id, day)
+        DO UPDATE SET seconds = seconds + excluded.seconds
+    '''
+    SQL_CLEAR_TOTALS = '''
+        DELETE FROM daily_totals
+    '''
+    SQL_TOTALS = '''
+        SELECT
+            day,
+            SUM(seconds)
+        FROM daily_totals
+        WHERE
+            day >= :date_from
+            AND day < :date_to
+        GROUP BY day
+        ORDER BY day
+    '''
+    SQL_TOTALS_PROJECT = '''
+        SELECT
+            day,
+            seconds
+        FROM daily_totals
+        WHERE
+            project_id = :project_id
+            AND day >= :date_from
+            AND day < :date_to
+        ORDER BY day
+    '''
+    SQL_MAX_DURATION = '''
+        SELECT MAX(duration)
+        FROM times
+    '''
+    SQL_SESSIONS = '''
+        SELECT
+            date_start,
+            date_end
+        FROM times
+        WHERE
+            date_start >= :date_min
+            AND date_start < :date_to
+            AND date_end > :date_from
+    '''
+    SQL_SESSIONS_PROJECT = '''
+        SELECT
+            date_start,
+            date_end
+        FROM times
+        WHERE
+            project_id = :project_id
+            AND date_start >= :date_min
+            AND date_start < :date_to
+            AND date_end > :date_from
+    '''
+    SQL_SESSIONS_NAMED = '''
+        SELECT
+            p.name,
+            t.date_start,
+            t.date_end
+        FROM times AS t
+        JOIN projects AS p ON p.rowid = t.project_id
+        WHERE
+            t.date_start >= :date_min
+            AND t.date_start < :date_to
+            AND t.date_end > :date_from
+    '''
+    SQL_SESSIONS_NAMED_PROJECT = '''
+        SELECT
+            p.name,
+            t.date_start,
+            t.date_end
+        FROM times AS t
+        JOIN projects AS p ON p.rowid = t.project_id
+        WHERE
+            t.project_id = :project_id
+            AND t.date_start >= :date_min
+            AND t.date_start < :date_to
+            AND t.date_end > :date_from
+    '''
+    SQL_TOTALS_NAMED = '''
+        SELECT
+            t.day,
+            p.name,
+            t.seconds
+        FROM daily_totals AS t
+        JOIN projects AS p ON p.rowid = t.project_id
+        WHERE
+            t.day >= :date_from
+            AND t.day < :date_to
+            AND t.seconds > 0
+        ORDER BY t.day, p.name COLLATE NOCASE
+    '''
+    SQL_TOTALS_NAMED_PROJECT = '''
+        SELECT
+            t.day,
+            p.name,
+            t.seconds
+        FROM daily_totals AS t
+        JOIN projects AS p ON p.rowid = t.project_id
+        WHERE
+            t.project_id = :project_id
+            AND t.day >= :date_from
+            AND t.day < :date_to
+            AND t.seconds > 0
+        ORDER BY t.day
+    '''
+    SQL_ATTACH_ARCHIVE = '''
+        ATTACH DATABASE :filename AS archive
+    '''
+    # the SQL_TOTALS* queries over live and archived days: the same day is
+    # only on both sides when older sessions were imported after archiving
+    SQL_TOTALS_ARCHIVED = '''
+        SELECT
+            day,
+            SUM(seconds)
+        FROM (
+            SELECT day, seconds
+            FROM main.daily_totals
+            WHERE
+                day >= :date_from
+                AND day < :date_to
+            UNION ALL
+            SELECT day, seconds
+            FROM archive.daily_totals
+            WHERE
+                day >= :date_from
+                AND day < :date_to
+        )
+        GROUP BY day
+        ORDER BY day
+    '''
+    SQL_TOTALS_PROJECT_ARCHIVED = '''
+        SELECT
+            day,
+            SUM(seconds)
+        FROM (
+            SELECT day, seconds
+            FROM main.daily_totals
+            WHERE
+                project_id = :project_id
+                AND day >= :date_from
+                AND day < :date_to
+            UNION ALL
+            SELECT day, seconds
+            FROM archive.daily_totals
+            WHERE
+                project_id = :project_id
+                AND day >= :date_from
+                AND day < :date_to
+        )
+        GROUP BY day
+        ORDER BY day
+    '''
+    SQL_TOTALS_NAMED_ARCHIVED = '''
+        SELECT
+            t.day,
+            p.name,
+            SUM(t.seconds) AS seconds
+        FROM (
+            SELECT project_id, day, seconds
+            FROM main.daily_totals
+            WHERE
+                day >= :date_from
+                AND day < :date_to
+            UNION ALL
+            SELECT project_id, day, seconds
+            FROM archive.daily_totals
+            WHERE
+                day >= :date_from
+                AND day < :date_to
+        ) AS t
+        JOIN projects AS p ON p.id = t.project_id
+        GROUP BY t.day, t.project_id
+        HAVING SUM(t.seconds) > 0
+        ORDER BY t.day, p.name COLLATE NOCASE
+    '''
+    SQL_TOTALS_NAMED_PROJECT_ARCHIVED = '''
+        SELECT
+            t.day,
+            p.name,
+            SUM(t.seconds) AS seconds
+        FROM (
+            SELECT project_id, day, seconds
+            FROM main.daily_totals
+            WHERE
+                project_id = :project_id
+                AND day >= :date_from
+                AND day < :date_to
+            UNION ALL
+            SELECT project_id, day, seconds
+            FROM archive.daily_totals
+            WHERE
+                project_id = :project_id
+                AND day >= :date_from
+                AND day < :date_to
+        ) AS t
+        JOIN projects AS p ON p.id = t.project_id
+        GROUP BY t.day
+        HAVING SUM(t.seconds) > 0
+        ORDER BY t.day
+    '''
+    SQL_GET_STATS = '''
+        SELECT count, total, total_sq, longest, buckets, heatmap, days
+        FROM session_stats
+        WHERE
+            project_id = :p_id
+            AND month = :month
+    '''
+    SQL_GET_STATS_RANGE = '''
+        SELECT
+            project_id,
+            month,
+            count,
+            total,
+            total_sq,
+            longest,
+            buckets,
+            heatmap,
+            days
+        FROM session_stats
+        WHERE
+            month >= :month_from
+            AND month <= :month_to
+    '''
+    SQL_PUT_STATS = '''
+        INSERT OR REPLACE INTO session_stats (
+            project_id,
+            month,
+            count,
+            total,
+            total_sq,
+            longest,
+            buckets,
+            heatmap,
+            days
+        ) VALUES (
+            :p_id,
+            :month,
+            :count,
+            :total,
+            :total_sq,
+            :longest,
+            :buckets,
+            :heatmap,
+            :days
+        )
+    '''
+    SQL_CLEAR_STATS = '''
+        DELETE FROM session_stats
+        WHERE month >= :month_from
+    '''
+    SQL_STATS = '''
+        SELECT
+            p.name,
+            s.month,
+            s.count,
+            s.total,
+            s.total_sq,
+            s.longest,
+            s.buckets,
+            s.heatmap,
+            s.days
+        FROM session_stats AS s
+        JOIN projects AS p ON p.id = s.project_id
+        WHERE
+            s.month >= :month_from
+            AND s.month < :date_to
+    '''
+    SQL_STATS_PROJECT = '''
+        SELECT
+            p.name,
+            s.month,
+            s.count,
+            s.total,
+            s.total_sq,
+            s.longest,
+            s.buckets,
+            s.heatmap,
+            s.days
+        FROM session_stats AS s
+        JOIN projects AS p ON p.id = s.project_id
+        WHERE
+            s.project_id = :project_id
+            AND s.month >= :month_from
+            AND s.month < :date_to
+    '''
+    SQL_SESSIONS_SINCE = '''
+        SELECT project_id, date_start, date_end
+        FROM times
+        WHERE rowid > :last_rowid
+    '''
+
+    def __init__(self, filename, journal_mode="WAL", readonly=False):
+        self.filename = filename
+        self.readonly = readonly
+        self.archive_attached = False
+        self.uri = False
+
+        if readonly:
+            self.open_readonly()
+            return
+
+        self.db = sqlite3.connect(filename, factory=InstrumentedConnection)
+        self.db_cur = self.db.cursor()
+
+        self.db_cur.execute("PRAGMA journal_mode = %s" % journal_mode)
+        # with WAL, NORMAL only syncs on checkpoints and is still durable
+        # against application crashes
+        self.db_cur.execute("PRAGMA synchronous = NORMAL")
+        self.db.sync_on_commit = journal_mode.upper() != "WAL"
+        self.db_cur.execute("PRAGMA cache_size = %d" % self.CACHE_SIZE)
+        self.db_cur.execute("PRAGMA temp_store = MEMORY")
+
+        applied = migrations.migrate(self.db)
+        # off while migrating, tables are rebuilt by dropping them
+        self.db_cur.execute("PRAGMA foreign_keys = ON")
+        if migrations.SESSION_STATS_VERSION in applied:
+            self.rebuild_session_stats()
+
+    def open_readonly(self):
+        # a read-only URI never creates, migrates or locks the file for
+        # writing, so databases of other users can be read in place
+        try:
+            self.db = sqlite3.connect(readonly_uri(self.filename), uri=True,
+                                      factory=InstrumentedConnection)
+            self.uri = True
+        except TypeError:
+            # Python 2 has no URI filenames: open the file itself, which
+            # mustn't be created, and refuse writes on the connection
+            if not os.path.isfile(self.filename):
+                raise sqlite3.OperationalError("unable to open database file")
+            self.db = sqlite3.connect(self.filename,
+                                      factory=InstrumentedConnection)
+            self.db.execute("PRAGMA query_only = ON")
+        self.db_cur = self.db.cursor()
+
+        version = migrations.get_version(self.db)
+        if version != migrations.SCHEMA_VERSION:
+            self.close()
+            raise sqlite3.DatabaseError(
+                "schema version %d instead of %d, open it with this version "
+                "of Time-Line once" % (version, migrations.SCHEMA_VERSION)
+            )
+        self.db_cur.execute("PRAGMA cache_size = %d" % self.CACHE_SIZE)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    # projects
+
+    def projects(self):
+        # lazy Project rows by name, on a cursor of their own
+        return iter_rows(self.db.cursor().execute(self.SQL_PROJECTS),
+                         Project)
+
+    def find_project(self, name):
+        return scalar(self.db_cur.execute(self.SQL_FIND_PROJECT,
+                                          {"name": name}))
+
+    def project_rows(self):
+        # lean (id, name) tuples, in index order
+        return iter_rows(self.db.cursor().execute(self.SQL_PROJECT_ROWS))
+
+    def project_name(self, id):
+        return scalar(self.db_cur.execute(self.SQL_PROJECT_NAME, {"id": id}))
+
+    def add_project(self, name):
+        with self.db:
+            self.db_cur.execute(self.SQL_ADD_PROJECT, {"name": name})
+        return self.db_cur.lastrowid
+
+    def delete_project(self, id, progress=None, batch_size=DELETE_BATCH,
+                       vacuum=True):
+        """
+        Delete a project and all its records. Sessions go in transactions of
+        at most about ``batch_size`` rows, oldest first, each taking its
+        share out of the daily totals: other connections never wait for
+        more than one batch, and the totals match the remaining sessions
+        after every commit. The project row goes last and cascades to the
+        rest. ``progress(done, total)`` is called after every batch; an
+        interrupted deletion is finished by ``resume_deletion``. Returns
+        ``id``.
+        """
+        total = scalar(self.db_cur.execute(self.SQL_COUNT_PROJECT_TIMES,
+                                           {"id": id}))
+        self.set_setting(self.DELETING_PROJECT, id)
+
+        done = 0
+        while True:
+            cut = scalar(self.db_cur.execute(self.SQL_DELETE_CUT, {
+                "id": id,
+                "offset": batch_size - 1
+            }))
+            if cut is None:
+                break
+
+            params = {"id": id, "cut": cut}
+            with self.db:
+                self.db_cur.execute(self.SQL_ROLLUP_SUBTRACT, params)
+                self.db_cur.execute(self.SQL_DELETE_TIMES_UNTIL, params)
+                done += self.db_cur.rowcount
+                self.bump_generation()
+            if progress is not None:
+                progress(min(done, total), total)
+
+        # archived records first, the marker covers a crash in between
+        if self.archive_boundary() is not None:
+            self.attach_archive()
+            archive.Archiver(self).delete_project(id)
+
+        with self.db:
+            self.db_cur.execute(self.SQL_DELETE_PROJECT, {"id": id})
+            self.db_cur.execute(self.SQL_DELETE_SETTING, {
+                "name": self.DELETING_PROJECT
+            })
+            self.bump_generation()
+        if progress is not None:
+            progress(total, total)
+
+        if vacuum:
+            self.incremental_vacuum()
+        return id
+
+    def resume_deletion(self, progress=None):
+        # finish a deletion interrupted by a crash, returns the project id
+        id = self.get_setting(self.DELETING_PROJECT)
+        if id is not None:
+            return self.delete_project(int(id), progress)
+        return None
+
+    def incremental_vacuum(self, pages=VACUUM_PAGES):
+        """
+        Give free pages back to the file system, ``pages`` per transaction.
+        Does nothing on files without auto_vacuum = INCREMENTAL.
+        """
+        free = scalar(self.db_cur.execute("PRAGMA freelist_count"))
+        while free > 0:
+            # the pragma works while its result rows are stepped through
+            for row in self.db_cur.execute("PRAGMA incremental_vacuum(%d)"
+                                           % pages):
+                pass
+            left = scalar(self.db_cur.execute("PRAGMA freelist_count"))
+            if left >= free:
+                break
+            free = left
+
+    # settings
+
+    def get_setting(self, name, default=None):
+        return scalar(self.db_cur.execute(self.SQL_GET_SETTING,
+                                          {"name": name}), default)
+
+    def set_setting(self, name, value):
+        with self.db:
+            self.db_cur.execute(self.SQL_SET_SETTING, {
+                "name": name,
+                "value": value
+            })
+
+    # write generation
+
+    def write_generation(self):
+        """
+        Number of committed transactions that changed ``times``, from any
+        connection. Results computed at one generation stay valid until
+        it changes.
+        """
+        return int(self.get_setting(self.WRITE_GENERATION, 0))
+
+    def bump_generation(self, cur=None):
+        # expects an open transaction, the one writing to times
+        cur = cur if cur is not None else self.db_cur
+        cur.execute(self.SQL_BUMP_GENERATION,
+                    {"name": self.WRITE_GENERATION})
+
+    # sessions
+
+    def start_session(self, project_id, date_start, date_end=None):
+        date_end = date_end if date_end is not None else date_start
+
+        with self.db:
+            rowid = self.insert_session(project_id, date_start, date_end)
+        return rowid
+
+    def heartbeat(self, rowid, date_end):
+        with self.db:
+            self.update_session(rowid, date_end)
+
+    def stop_session(self, rowid, date_end):
+        self.heartbeat(rowid, date_end)
+
+    def get_session(self, rowid):
+        return first(self.db_cur.execute(self.SQL_GET_SESSION, {"id": rowid}),
+                     Session)
+
+    def fold_session(self, rowid, project_id, date_start, date_end,
+                     stopped=False):
+        """
+        Write a journaled session into ``times`` and return its rowid.
+        Without a known rowid the row is looked up by project and start, so
+        folding the same journal record twice is harmless, even once the
+        session was archived (nothing is written and 0 returned then). A
+        ``stopped`` session is final and goes into the session statistics
+        too.
+        """
+        archived = not rowid and self.reaches_archive(date_start)
+        with self.db:
+            if not rowid:
+                rowid = self.find_session(project_id, date_start)
+            if not rowid and archived and self.archived_session(project_id,
+                                                                date_start):
+                return 0
+
+            if rowid:
+                self.update_session(rowid, date_end)
+            else:
+                rowid = self.insert_session(project_id, date_start, date_end)
+
+            if stopped:
+                self.add_session_stats([(project_id, date_start, date_end)])
+
+        return rowid
+
+    def fold_sessions(self, sessions, stopped=False):
+        """
+        Fold several journaled sessions, (rowid, project_id, date_start,
+        date_end) tuples, in one transaction and return their rowids in the
+        same order. Known rows are updated with one executemany and their
+        totals adjusted with another, so a flush costs a single commit
+        however many timers run. Rows already folded up to their date_end
+        are left alone, so a repeated flush writes nothing and keeps the
+        write generation. ``stopped`` as for fold_session.
+        """
+        rowids = []
+        updates = []
+        deltas = {}
+        folded = []
+
+        archived = any(not session[0] and self.reaches_archive(session[2])
+                       for session in sessions)
+        with self.db:
+            for session in sessions:
+                rowid, project_id, date_start, date_end = session
+                if not rowid:
+                    rowid = self.find_session(project_id, date_start)
+                if not rowid and archived and self.archived_session(
+                        project_id, date_start):
+                    rowids.append(0)
+                    continue
+
+                folded.append(session)
+                if not rowid:
+                    rowids.append(
+                        self.insert_session(project_id, date_start, date_end)
+                    )
+                    continue
+
+                rowids.append(rowid)
+                old = first(self.db_cur.execute(self.SQL_GET_SESSION,
+                                                {"id": rowid}))
+                if old is None:
+                    continue
+
+                old_project_id, old_start, old_end = old
+                date_end = int(date_end)
+                if date_end == old_end:
+                    # folded already, a write would only void the caches
+                    continue
+                updates.append({"date_end": date_end, "id": rowid})
+                if date_end >= old_end:
+                    parts, sign = day_parts(old_end, date_end), 1
+                else:
+                    parts, sign = day_parts(date_end, old_end), -1
+                for day, seconds in parts:
+                    key = (old_project_id, day)
+                    deltas[key] = deltas.get(key, 0) + sign * seconds
+
+            if updates:
+                self.db_cur.executemany(self.SQL_UPDATE_SESSION, updates)
+                self.db_cur.executemany(self.SQL_ROLLUP_ADD, [
+                    {"p_id": project_id, "day": day, "seconds": seconds}
+                    for (project_id, day), seconds in deltas.items()
+                    if seconds
+                ])
+                self.bump_generation()
+
+            if stopped:
+                self.add_session_stats(session[1:] for session in folded)
+
+        return rowids
+
+    # the helpers below expect an open transaction
+
+    def find_session(self, project_id, date_start):
+        # rowid of the session of the project starting at date_start, or 0
+        return scalar(self.db_cur.execute(self.SQL_FIND_SESSION, {
+            "p_id": project_id,
+            "date_start": int(date_start)
+        }), 0)
+
+    def archived_session(self, project_id, date_start):
+        # whether the session of the project starting at date_start was
+        # folded and archived already; expects the archive attached
+        return archive.Archiver(self).has_session(project_id,
+                                                  int(date_start))
+
+    def insert_session(self, project_id, date_start, date_end):
+        self.db_cur.execute(self.SQL_START_SESSION, {
+            "p_id": project_id,
+            "date_start": int(date_start),
+            "date_end": int(date_end),
+            "duration": int(date_end) - int(date_start)
+        })
+        rowid = self.db_cur.lastrowid
+        self.update_totals(project_id, date_start, date_end)
+        self.bump_generation()
+        return rowid
+
+    def update_session(self, rowid, date_end):
+        old = first(self.db_cur.execute(self.SQL_GET_SESSION, {"id": rowid}),
+                    Session)
+        if old is None:
+            return
+
+        self.db_cur.execute(self.SQL_UPDATE_SESSION, {
+            "date_end": int(date_end),
+            "id": rowid
+        })
+        self.bump_generation()
+
+        if int(date_end) >= old.date_end:
+            self.update_totals(old.project_id, old.date_end, date_end)
+        else:
+            self.update_totals(old.project_id, date_end, old.date_end, -1)
+
+    # daily totals
+
+    def update_totals(self, project_id, date_start, date_end, sign=1):
+        for day, seconds in day_parts(date_start, date_end):
+            self.db_cur.execute(self.SQL_ROLLUP_ADD, {
+                "p_id": project_id,
+                "day": day,
+                "seconds": sign * seconds
+            })
+
+    def rebuild_daily_totals(self):
+        with self.db:
+            self.db_cur.execute(self.SQL_CLEAR_TOTALS)
+            self.db_cur.execute(migrations.SQL_REBUILD_DAILY_TOTALS)
+            self.bump_generation()
+
+    # session statistics
+
+    def add_session_stats(self, sessions):
+        # merge (project_id, date_start, date_end) sessions into the
+        # per-month sketches and write them back with one executemany;
+        # expects an open transaction
+        sketches = stats.sketch_sessions(sessions)
+        for key, row in self.stored_stats(sketches):
+            sketches[key].merge(stats.SessionSketch.from_row(key[1], row))
+
+        rows = []
+        for (project_id, month), sketch in sketches.items():
+            count, total, total_sq, longest, buckets, heatmap, days = \
+                sketch.to_row(month)
+            rows.append({
+                "p_id": project_id,
+                "month": month,
+                "count": count,
+                "total": total,
+                "total_sq": total_sq,
+                "longest": longest,
+                "buckets": sqlite3.Binary(buckets),
+                "heatmap": sqlite3.Binary(heatmap),
+                "days": days
+            })
+        if rows:
+            self.db_cur.executemany(self.SQL_PUT_STATS, rows)
+
+    def stored_stats(self, keys):
+        # ((project_id, month), row) of the stored sketches among ``keys``:
+        # a few are looked up one by one, more with one scan of their months
+        if len(keys) < self.STATS_RANGE_MIN:
+            for project_id, month in keys:
+                row = first(self.db_cur.execute(self.SQL_GET_STATS, {
+                    "p_id": project_id,
+                    "month": month
+                }))
+                if row is not None:
+                    yield (project_id, month), row
+            return
+
+        months = [month for project_id, month in keys]
+        for row in self.db.cursor().execute(self.SQL_GET_STATS_RANGE, {
+                "month_from": min(months),
+                "month_to": max(months)
+        }):
+            if (row[0], row[1]) in keys:
+                yield (row[0], row[1]), row[2:]
+
+    def add_session_stats_since(self, last_rowid):
+        # statistics of the sessions inserted after ``last_rowid`` in bulk;
+        # expects an open transaction
+        self.add_session_stats(iter_rows(self.db.cursor().execute(
+            self.SQL_SESSIONS_SINCE, {"last_rowid": last_rowid or 0}
+        )))
+
+    def rebuild_session_stats(self):
+        """
+        Recompute the session statistics from the raw sessions, archived
+        ones included. When the archive only kept daily totals, the months
+        up to the one of its boundary keep the statistics they had.
+        """
+        month_from = 0
+        sessions = iter_rows(self.db.cursor().execute(
+            self.SQL_SESSIONS_SINCE, {"last_rowid": 0}
+        ))
+
+        boundary = self.archive_boundary()
+        if boundary is not None:
+            self.attach_archive()
+            archiver = archive.Archiver(self)
+            if archiver.has_raw():
+                sessions = chain(sessions, archiver.sessions(0, 0, boundary))
+            else:
+                month_from = archive.month_start(
+                    archive.month_start(boundary) + 32 * aggregate.DAY
+                )
+                sessions = (row for row in sessions if row[1] >= month_from)
+
+        with self.db:
+            self.db_cur.execute(self.SQL_CLEAR_STATS,
+                                {"month_from": month_from})
+            self.add_session_stats(sessions)
+
+    def session_stats(self, project_id, date_from, date_to):
+        """
+        {project name: SessionSketch} of the sessions started in the UTC
+        months overlapping [date_from, date_to]: the statistics are kept
+        per month, so the range is widened to whole months.
+        """
+        params = {
+            "project_id": project_id,
+            "month_from": archive.month_start(date_from),
+            "date_to": int(date_to) + 1
+        }
+        if project_id > 0:
+            self.db_cur.execute(self.SQL_STATS_PROJECT, params)
+        else:
+            self.db_cur.execute(self.SQL_STATS, params)
+
+        sketches = {}
+        for row in iter_rows(self.db_cur):
+            sketches.setdefault(row[0], []).append(
+                stats.SessionSketch.from_row(row[1], row[2:])
+            )
+        return dict((name, stats.merge_sketches(months))
+                    for name, months in sketches.items())
+
+    # archive
+
+    def archive_boundary(self):
+        # first day that isn't archived, None without an archive
+        value = self.get_setting(self.ARCHIVE_BEFORE)
+        return int(value) if value is not None else None
+
+    def attach_archive(self, create=False):
+        """
+        Attach the archive database as ``archive``, creating the file if
+        ``create``. Must run outside of a transaction.
+        """
+        if self.archive_attached:
+            return
+
+        filename = archive.filename_for(self.filename)
+        if not create and not os.path.exists(filename):
+            raise sqlite3.DatabaseError("archive %s is missing" % filename)
+        if self.uri:
+            filename = readonly_uri(filename)
+
+        self.db_cur.execute(self.SQL_ATTACH_ARCHIVE, {"filename": filename})
+        self.archive_attached = True
+        if not create and not self.readonly:
+            archive.Archiver(self).recover()
+
+    def reaches_archive(self, date_from):
+        # whether a range starting at ``date_from`` needs the archive, which
+        # is attached on the way
+        boundary = self.archive_boundary()
+        if boundary is None or int(date_from) >= boundary:
+            return False
+        self.attach_archive()
+        return True
+
+    # reports
+
+    def max_duration(self):
+        return int(scalar(self.db_cur.execute(self.SQL_MAX_DURATION)) or 0)
+
+    def session_params(self, project_id, date_from, date_to):
+        return {
+            "project_id": project_id,
+            "date_min": int(date_from) - self.max_duration(),
+            "date_from": int(date_from),
+            "date_to": int(date_to)
+        }
+
+    def sessions(self, project_id, date_from, date_to):
+        """
+        (starts, ends) arrays of the sessions overlapping [date_from, date_to)
+        """
+        params = self.session_params(project_id, date_from, date_to)
+
+        if project_id > 0:
+            self.db_cur.execute(self.SQL_SESSIONS_PROJECT, params)
+        else:
+            self.db_cur.execute(self.SQL_SESSIONS, params)
+
+        starts = array(aggregate.INT64)
+        ends = array(aggregate.INT64)
+        for start, end in self.db_cur:
+            starts.append(start)
+            ends.append(end)
+
+        if self.reaches_archive(date_from):
+            for id, start, end in archive.Archiver(self).sessions(
+                    project_id, date_from, date_to):
+                starts.append(start)
+                ends.append(end)
+        return starts, ends
+
+    def daily_totals(self, project_id, date_from, date_to):
+        # (day, seconds) rows by day, for the UTC days starting in
+        # [date_from, date_to)
+        params = {
+            "project_id": project_id,
+            "date_from": int(date_from),
+            "date_to": int(date_to)
+        }
+
+        if self.reaches_archive(date_from):
+            if project_id > 0:
+                self.db_cur.execute(self.SQL_TOTALS_PROJECT_ARCHIVED, params)
+            else:
+                self.db_cur.execute(self.SQL_TOTALS_ARCHIVED, params)
+        elif project_id > 0:
+            self.db_cur.execute(self.SQL_TOTALS_PROJECT, params)
+        else:
+            self.db_cur.execute(self.SQL_TOTALS, params)
+        return iter_rows(self.db_cur)
+
+    def report_plan(self, date_from, date_to, edges, tz=None):
+        """
+        Split [date_from, date_to) between the rollup table and the raw
+        sessions. Returns (full_from, full_to, cut, segments): the whole UTC
+        days [full_from, full_to) come from daily_totals, except the days
+        in ``cut``, which a bucket edge crosses; those and the partial days
+        at both ends are the ``segments`` computed from raw sessions.
+        """
+        DAY = aggregate.DAY
+        full_from = -(-date_from // DAY) * DAY
+        full_to = date_to // DAY * DAY
+        if full_from >= full_to:
+            return date_to, date_to, set(), [(date_from, date_to)]
+
+        # local midnights off UTC ones, none without ``tz``
+        cut = set(edge // DAY * DAY for edge in edges[1:-1] if edge % DAY)
+        parts = [(date_from, full_from), (full_to, date_to)]
+        parts.extend((max(day, date_from), min(day + DAY, date_to))
+                     for day in cut)
+
+        segments = []
+        for start, end in sorted(parts):
+            if start >= end:
+                continue
+            if segments and start <= segments[-1][1]:
+                segments[-1] = (segments[-1][0], max(end, segments[-1][1]))
+            else:
+                segments.append((start, end))
+        return full_from, full_to, cut, segments
+
+    def report(self, project_id, date_from, date_to, tz=None,
+               granularity="day"):
+        """
+        Totals per ``granularity`` period (see aggregate.GRANULARITIES) for
+        [date_from, date_to] (both inclusive, in seconds), sessions clipped
+        to the range and split at local midnight in ``tz`` (None for UTC).
+        Returns a list of (label, seconds), one entry per period, empty
+        periods included.
+        """
+        date_from = int(date_from)
+        date_to = int(date_to) + 1
+        edges = aggregate.bucket_boundaries(date_from, date_to, granularity,
+                                            tz)
+        labels = aggregate.bucket_labels(edges, granularity, tz)
+        full_from, full_to, cut, segments = self.report_plan(
+            date_from, date_to, edges, tz
+        )
+
+        # whole days stream from the rollup table into their buckets ...
+        totals = [0] * (len(edges) - 1)
+        if full_from < full_to:
+            totals = aggregate.fold_days(
+                (row for row in self.daily_totals(project_id, full_from,
+                                                  full_to)
+                 if row[0] not in cut),
+                edges
+            )
+
+        # ... the rest is split from the raw sessions
+        for start, end in segments:
+            first, sub_edges = aggregate.clip_edges(edges, start, end)
+            starts, ends = self.sessions(project_id, start, end)
+            for i, seconds in enumerate(
+                    aggregate.split_intervals(starts, ends, sub_edges)):
+                totals[first + i] += seconds
+
+        return list(zip(labels, totals))
+
+    def sessions_by_project(self, project_id, date_from, date_to):
+        # {name: (starts, ends)} of the sessions overlapping the range
+        params = self.session_params(project_id, date_from, date_to)
+
+        if project_id > 0:
+            self.db_cur.execute(self.SQL_SESSIONS_NAMED_PROJECT, params)
+        else:
+            self.db_cur.execute(self.SQL_SESSIONS_NAMED, params)
+
+        out = {}
+        for name, start, end in self.db_cur:
+            if name not in out:
+                out[name] = (array(aggregate.INT64), array(aggregate.INT64))
+            out[name][0].append(start)
+            out[name][1].append(end)
+
+        if self.reaches_archive(date_from):
+            names = dict(self.project_rows())
+            for id, start, end in archive.Archiver(self).sessions(
+                    project_id, date_from, date_to):
+                name = names.get(id)
+                if name is None:
+                    continue
+                if name not in out:
+                    out[name] = (array(aggregate.INT64),
+                                 array(aggregate.INT64))
+                out[name][0].append(start)
+                out[name][1].append(end)
+        return out
+
+    def named_totals(self, cur, project_id, date_from, date_to):
+        # run the query of (day, project name, seconds) rows with time, by
+        # day then name, for the UTC days in [date_from, date_to) on ``cur``
+        params = {
+            "project_id": project_id,
+            "date_from": date_from,
+            "date_to": date_to
+        }
+        if date_from < date_to and self.reaches_archive(date_from):
+            if project_id > 0:
+                cur.execute(self.SQL_TOTALS_NAMED_PROJECT_ARCHIVED, params)
+            else:
+                cur.execute(self.SQL_TOTALS_NAMED_ARCHIVED, params)
+        elif project_id > 0:
+            cur.execute(self.SQL_TOTALS_NAMED_PROJECT, params)
+        else:
+            cur.execute(self.SQL_TOTALS_NAMED, params)
+
+    def iter_report(self, project_id, date_from, date_to, by_project=False,
+                    tz=None, granularity="day"):
+        """
+        Lazily yield (label, project name, seconds) rows for [date_from,
+        date_to], one period of ``granularity`` after the other. Without
+        ``by_project`` the name is None and every period yields exactly one
+        row. With it, periods without any time yield a single (label, None,
+        0) row.
+        """
+        if (tz is not None and self.reaches_archive(date_from) and
+                not archive.Archiver(self).has_raw()):
+            # without the archived sessions, archived days are UTC days; the
+            # period holding the boundary is summed from both parts
+            boundary = self.archive_boundary()
+            rows = self.iter_report(project_id, date_from,
+                                    min(int(date_to), boundary - 1),
+                                    by_project, None, granularity)
+            if int(date_to) >= boundary:
+                rows = chain(rows, self.iter_report(
+                    project_id, boundary, date_to, by_project, tz,
+                    granularity
+                ))
+            for row in merge_periods(rows):
+                yield row
+            return
+
+        if not by_project:
+            for label, seconds in self.report(project_id, date_from, date_to,
+                                              tz, granularity):
+                yield label, None, seconds
+            return
+
+        date_from = int(date_from)
+        date_to = int(date_to) + 1
+        edges = aggregate.bucket_boundaries(date_from, date_to, granularity,
+                                            tz)
+        labels = aggregate.bucket_labels(edges, granularity, tz)
+        full_from, full_to, cut, segments = self.report_plan(
+            date_from, date_to, edges, tz
+        )
+
+        # partial days, from raw sessions: {bucket: {name: seconds}}
+        raw = {}
+        for start, end in segments:
+            first, sub_edges = aggregate.clip_edges(edges, start, end)
+            sessions = self.sessions_by_project(project_id, start, end)
+            for name, (starts, ends) in sessions.items():
+                totals = aggregate.split_intervals(starts, ends, sub_edges)
+                for i, seconds in enumerate(totals):
+                    if seconds:
+                        bucket = raw.setdefault(first + i, {})
+                        bucket[name] = bucket.get(name, 0) + seconds
+
+        # whole days, streamed from the rollup table on a private cursor
+        cur = self.db.cursor()
+        self.named_totals(cur, project_id, full_from, full_to)
+        row = cur.fetchone()
+
+        for i, label in enumerate(labels):
+            totals = raw.get(i, {})
+            while row is not None and row[0] < edges[i + 1]:
+                if row[0] not in cut:
+                    totals[row[1]] = totals.get(row[1], 0) + row[2]
+                row = cur.fetchone()
+
+            if not totals:
+                yield label, None, 0
+            for name in sorted(totals, key=lambda x: x.lower()):
+                yield label, name, totals[name]
+
+        cur.close()
+
+metrics.registry.name_statements(TimeStore)
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Reports across many records.db files, read in place.
+
+Every database is opened read-only and aggregated on its own by
+``file_totals`` (the same per-day, per-project semantics as the Show Times
+window), fanned out over a process pool. The partial totals are merged by
+project name, case-insensitively, into rows the report writers accept.
+"""
+
+import os
+import glob
+import sqlite3
+from timeline import aggregate
+from timeline.storage import TimeStore
+from timeline.projects import sort_key
+
+
+def find_databases(paths):
+    # files as given, directories expanded to the *.db files inside
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(sorted(glob.glob(os.path.join(path, "*.db"))))
+        else:
+            filenames.append(path)
+    return filenames
+
+
+def file_totals(filename, project, date_from, date_to, tz=None,
+                granularity="day"):
+    """
+    Per-period, per-project totals of one database: (filename, {(label, name):
+    seconds}, error). ``project`` is a name (None for all projects); a
+    database without it contributes nothing. Runs in a worker process, so
+    everything is passed and returned by value.
+    """
+    try:
+        store = TimeStore(filename, readonly=True)
+    except sqlite3.Error as e:
+        return filename, {}, e.args[0]
+
+    totals = {}
+    try:
+        project_id = 0
+        if project is not None:
+            project_id = store.find_project(project)
+        if project_id is not None:
+            for day, name, seconds in store.iter_report(
+                    project_id, date_from, date_to, True, tz, granularity):
+                if seconds:
+                    totals[day, name] = totals.get((day, name), 0) + seconds
+    except sqlite3.Error as e:
+        return filename, {}, e.args[0]
+    finally:
+        store.close()
+
+    return filename, totals, None
+
+
+class TeamReport(object):
+    """
+    Fans ``file_totals`` out over ``jobs`` processes (default: one per
+    core). With one job, or one file, everything runs in this process.
+    Files that can't be read are reported in ``errors`` and skipped.
+    """
+
+    def __init__(self, filenames, jobs=None):
+        if jobs is None:
+            from multiprocessing import cpu_count
+            jobs = cpu_count()
+
+        self.filenames = list(filenames)
+        self.jobs = jobs
+        self.errors = {}
+
+    def collect(self, project, date_from, date_to, tz=None,
+                granularity="day"):
+        args = (project, date_from, date_to, tz, granularity)
+        if self.jobs <= 1 or len(self.filenames) <= 1:
+            return [file_totals(filename, *args)
+                    for filename in self.filenames]
+
+        # imported here, the pool costs nothing to the other commands
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+        except ImportError:
+            # Python 2
+            return self.collect_pool(args)
+
+        with ProcessPoolExecutor(self.jobs) as executor:
+            futures = [executor.submit(file_totals, filename, *args)
+                       for filename in self.filenames]
+            return [future.result() for future in futures]
+
+    def collect_pool(self, args):
+        from multiprocessing import Pool
+
+        pool = Pool(self.jobs)
+        try:
+            results = [pool.apply_async(file_totals, (filename,) + args)
+                       for filename in self.filenames]
+            return [result.get() for result in results]
+        finally:
+            pool.close()
+            pool.join()
+
+    def iter_report(self, project, date_from, date_to, by_project=False,
+                    tz=None, granularity="day"):
+        """
+        Rows like TimeStore.iter_report for [date_from, date_to], summed
+        over all files. Project names are merged case-insensitively and
+        shown as spelled in the first file that has them.
+        """
+        names = {}
+        totals = {}
+        self.errors = {}
+        for filename, partial, error in self.collect(project, date_from,
+                                                     date_to, tz,
+                                                     granularity):
+            if error is not None:
+                self.errors[filename] = error
+                continue
+
+            for (day, name), seconds in partial.items():
+                key = sort_key(name) if by_project else None
+                if key is not None and key not in names:
+                    names[key] = name
+                totals.setdefault(day, {})
+                totals[day][key] = totals[day].get(key, 0) + seconds
+
+        edges = aggregate.bucket_boundaries(int(date_from), int(date_to) + 1,
+                                            granularity, tz)
+        for day in aggregate.bucket_labels(edges, granularity, tz):
+            day_totals = totals.get(day)
+            if not day_totals:
+                yield day, None, 0
+                continue
+
+            for key in sorted(day_totals, key=lambda key: key or ""):
+                yield day, names.get(key), day_totals[key]
+
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4